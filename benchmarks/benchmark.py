@@ -0,0 +1,336 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks the speed of what JiTCODE generates for a set of typical systems: a small chaotic system (Lorenz), the two coupled FitzHugh–Nagumo oscillators from the examples (also with tangent vectors for Lyapunov exponents), and networks of Rössler oscillators of increasing size. For every system, backend (compiled C code with a given set of compiler flags or lambdified Python functions), the following is measured:
+
+* the time needed for building the functions (from `build_statistics` for C),
+* evaluations of the derivative and the Jacobian per second,
+* the integration throughput, i.e., the integrated time per second of wall time, for several integrators.
+
+The results are written to a JSON file together with the commit and versions, so runs for different commits or configurations can be compared:
+
+	python3 benchmarks/benchmark.py --output old.json
+	(switch to another commit)
+	python3 benchmarks/benchmark.py --output new.json
+	python3 benchmarks/benchmark.py --compare old.json new.json
+
+See `--help` for selecting systems, sizes, backends, compiler flags, and integrators.
+"""
+
+from __future__ import print_function, division
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from os import path, environ
+from time import time
+from warnings import catch_warnings, simplefilter
+
+import numpy as np
+import scipy
+import sympy
+
+from jitcode import jitcode, jitcode_lyap, provide_basic_symbols, DEFAULT_COMPILE_ARGS
+
+try:
+	from time import perf_counter
+except ImportError:
+	perf_counter = time
+
+t, y = provide_basic_symbols()
+
+FLAG_SETS = {
+		"default": DEFAULT_COMPILE_ARGS,
+		"O2": ["-std=c11", "-O2", "-g0", "-Wno-unknown-pragmas"],
+		"O3-native": ["-std=c11", "-O3", "-g0", "-march=native", "-mtune=native", "-Wno-unknown-pragmas"],
+	}
+
+INTEGRATORS = ["dopri5", "native_dopri5", "lsoda", "vode"]
+JACOBIAN_INTEGRATORS = ["lsoda", "vode"]
+
+# Systems
+# -------
+
+# Every system is a dictionary with the arguments for `jitcode` (or `jitcode_lyap`) as well as an initial state, the integration time per call of `integrate`, and optionally arguments for `generate_f_C`.
+
+def lorenz():
+	σ, ρ, β = 10.0, 28.0, 8.0/3.0
+	return {
+			"name": "lorenz",
+			"f_sym": [
+				σ*(y(1)-y(0)),
+				y(0)*(ρ-y(2)) - y(1),
+				y(0)*y(1) - β*y(2),
+				],
+			"initial_state": np.array([1.0, 2.0, 3.0]),
+			"interval": 1.0,
+		}
+
+def _double_fhn_f():
+	a  = -0.025794
+	b1 =  0.0065
+	b2 =  0.0135
+	c  =  0.02
+	k  =  0.128
+	return [
+		y(0) * ( a-y(0) ) * ( y(0)-1.0 ) - y(1) + k * (y(2) - y(0)),
+		b1*y(0) - c*y(1),
+		y(2) * ( a-y(2) ) * ( y(2)-1.0 ) - y(3) + k * (y(0) - y(2)),
+		b2*y(2) - c*y(3)
+		]
+
+def double_fhn():
+	return {
+			"name": "double_fhn",
+			"f_sym": _double_fhn_f(),
+			"initial_state": np.array([1.0, 2.0, 3.0, 4.0]),
+			"interval": 10.0,
+		}
+
+def double_fhn_lyapunov():
+	return {
+			"name": "double_fhn_lyapunov",
+			"f_sym": _double_fhn_f(),
+			"n_lyap": 4,
+			"initial_state": np.array([1.0, 2.0, 3.0, 4.0]),
+			"interval": 10.0,
+		}
+
+def roessler_network(N, seed=42):
+	# Rössler oscillators on a ring with 10 nearest neighbours on each side and random shortcuts, with an additional mean-field coupling of the z components, like in the example `SW_of_Roesslers`.
+	rng = np.random.RandomState(seed)
+	ω = rng.uniform(0.8, 1.0, N)
+	a, b, c, k = 0.165, 0.2, 10.0, 0.01
+	
+	A = np.zeros((N,N), dtype=bool)
+	for i in range(N):
+		for j in range(-min(10,(N-1)//2), min(10,(N-1)//2)+1):
+			A[i,(i+j)%N] = True
+	for _ in range(N//10):
+		i, j = rng.randint(0, N, 2)
+		A[i,j] = A[j,i] = True
+	np.fill_diagonal(A, False)
+	
+	sum_z = sympy.Symbol("sum_z")
+	helpers = [( sum_z, sum( y(3*j+2) for j in range(N) ) )]
+	
+	def f():
+		for i in range(N):
+			coupling_term = sympy.Mul(
+				k,
+				sum( (y(3*j)-y(3*i)) for j in np.flatnonzero(A[i]) ),
+				evaluate = False
+			)
+			yield -ω[i] * y(3*i+1) - y(3*i+2) + coupling_term
+			yield  ω[i] * y(3*i) + a*y(3*i+1)
+			yield b + y(3*i+2) * (y(3*i) - c) + k * (sum_z-N*y(3*i+2))
+	
+	return {
+			"name": "roessler_network",
+			"f_sym": f,
+			"helpers": helpers,
+			"n": 3*N,
+			"initial_state": rng.uniform(0.0, 1.0, 3*N),
+			"interval": 1.0,
+			"generation": {"simplify": False, "chunk_size": 150},
+		}
+
+SYSTEMS = {
+		"lorenz": lorenz,
+		"double_fhn": double_fhn,
+		"double_fhn_lyapunov": double_fhn_lyapunov,
+		"roessler_network": roessler_network,
+	}
+
+# Measurements
+# ------------
+
+def rate(function, min_time):
+	"""
+	Returns how often `function` can be called per second, measured over at least `min_time` seconds.
+	"""
+	
+	calls = 0
+	number = 1
+	start = perf_counter()
+	while True:
+		for _ in range(number):
+			function()
+		calls += number
+		elapsed = perf_counter()-start
+		if elapsed >= min_time:
+			return calls/elapsed
+		number *= 2
+
+def integration_throughput(ODE, integrator, initial_state, interval, min_time):
+	"""
+	Returns the integrated time per second of wall time, integrating in steps of `interval` for at least `min_time` seconds.
+	"""
+	
+	ODE.set_integrator(integrator)
+	ODE.set_initial_value(initial_state, 0.0)
+	ODE.integrate(interval) # warm-up
+	start_time = ODE.t
+	start = perf_counter()
+	while perf_counter()-start < min_time:
+		ODE.integrate(ODE.t+interval)
+	return (ODE.t-start_time)/(perf_counter()-start)
+
+def build(system, backend, flags, wants_jacobian):
+	# returns the instance with the functions generated and the time this took
+	arguments = { key:system[key] for key in ["f_sym", "helpers", "n"] if key in system }
+	if "n_lyap" in system:
+		ODE = jitcode_lyap(n_lyap=system["n_lyap"], wants_jacobian=wants_jacobian, **arguments)
+		ODE.verbose = False
+	else:
+		ODE = jitcode(wants_jacobian=wants_jacobian, verbose=False, **arguments)
+	
+	start = perf_counter()
+	if backend == "C":
+		ODE.generate_f_C(**system.get("generation",{}))
+		if wants_jacobian:
+			ODE.generate_jac_C(chunk_size=system.get("generation",{}).get("chunk_size",100))
+		ODE.compile_C(extra_compile_args=FLAG_SETS[flags])
+		stages = ODE.build_statistics.stages
+		build_time = sum( stage["wall_time"] for stage in stages if stage["parent"] is None )
+	else:
+		ODE.generate_lambdas()
+		build_time = perf_counter()-start
+	return ODE, build_time
+
+def benchmark(system, backend, flags, integrators, min_time, max_jac_dimension):
+	"""
+	Yields the results for one system and backend as dictionaries.
+	"""
+	
+	n = len(system["initial_state"])
+	dimension = n*(system["n_lyap"]+1) if "n_lyap" in system else n
+	wants_jacobian = dimension <= max_jac_dimension
+	
+	def result(measure, value, unit):
+		return {
+				"system": system["name"],
+				"n": dimension,
+				"backend": backend,
+				"flags": flags if backend=="C" else None,
+				"measure": measure,
+				"value": value,
+				"unit": unit,
+			}
+	
+	ODE, build_time = build(system, backend, flags, wants_jacobian)
+	yield result("build_time", build_time, "s")
+	
+	state = np.random.RandomState(0).uniform(-1, 1, dimension)
+	dy = np.empty(dimension)
+	yield result("f_rate", rate(lambda: ODE.f(0.0, state, out=dy), min_time), "1/s")
+	
+	if wants_jacobian:
+		yield result("jac_rate", rate(lambda: ODE.jac(0.0, state), min_time), "1/s")
+	
+	for integrator in integrators:
+		if integrator=="native_dopri5" and backend!="C":
+			continue
+		if integrator in JACOBIAN_INTEGRATORS and not wants_jacobian:
+			continue
+		# jitcode_lyap initialises the tangent vectors itself
+		throughput = integration_throughput(ODE, integrator, system["initial_state"], system["interval"], min_time)
+		yield result("integration:"+integrator, throughput, "time units/s")
+
+# Metadata and comparison
+# -----------------------
+
+def git(*args):
+	try:
+		return subprocess.check_output(
+				["git"] + list(args),
+				cwd = path.dirname(path.abspath(__file__)),
+				stderr = subprocess.STDOUT
+			).decode("utf-8").strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def metadata():
+	return {
+			"commit": git("rev-parse", "HEAD"),
+			"dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+			"date": datetime.now().isoformat(),
+			"python": platform.python_version(),
+			"numpy": np.__version__,
+			"scipy": scipy.__version__,
+			"sympy": sympy.__version__,
+			"platform": platform.platform(),
+			"processor": platform.processor(),
+			"compiler": environ.get("CC"),
+			"flag_sets": FLAG_SETS,
+			"arguments": sys.argv[1:],
+		}
+
+def _key(result):
+	return (result["system"], result["n"], result["backend"], result["flags"] or "", result["measure"])
+
+def compare(old_file, new_file):
+	"""
+	Prints the ratio of the new and old value for every measurement contained in both files. For `build_time`, a ratio below 1 is an improvement; for all other measures, a ratio above 1 is.
+	"""
+	
+	with open(old_file) as old, open(new_file) as new:
+		old_results = { _key(result):result["value"] for result in json.load(old)["results"] }
+		new_results = { _key(result):result["value"] for result in json.load(new)["results"] }
+	
+	row = "{:<22} {:>6} {:<7} {:<10} {:<24} {:>12} {:>12} {:>7}"
+	print(row.format("system", "n", "backend", "flags", "measure", "old", "new", "ratio"))
+	for key in sorted(set(old_results) & set(new_results)):
+		old_value, new_value = old_results[key], new_results[key]
+		ratio = new_value/old_value if old_value else float("nan")
+		print(row.format(*(key + ("%.4g"%old_value, "%.4g"%new_value, "%.3f"%ratio))))
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument("--output", default="benchmark_results.json", help="file to which the results are written")
+	parser.add_argument("--systems", nargs="+", default=sorted(SYSTEMS), choices=sorted(SYSTEMS))
+	parser.add_argument("--sizes", nargs="+", type=int, default=[10, 50, 200, 1000], help="numbers of oscillators in the Rössler network")
+	parser.add_argument("--backends", nargs="+", default=["C", "lambda"], choices=["C", "lambda"])
+	parser.add_argument("--flags", nargs="+", default=["default"], choices=sorted(FLAG_SETS), help="sets of compiler flags for the C backend")
+	parser.add_argument("--integrators", nargs="+", default=INTEGRATORS, choices=INTEGRATORS)
+	parser.add_argument("--min-time", type=float, default=1.0, help="minimum duration of each measurement in seconds")
+	parser.add_argument("--max-jac-dimension", type=int, default=600, help="the Jacobian (and integrators requiring it) are only benchmarked up to this dimension")
+	parser.add_argument("--quick", action="store_true", help="small sizes and short measurements, e.g., for testing the benchmark")
+	parser.add_argument("--compare", nargs=2, metavar=("OLD","NEW"), help="compare two result files instead of benchmarking")
+	args = parser.parse_args()
+	
+	if args.compare:
+		compare(*args.compare)
+		return
+	
+	if args.quick:
+		args.sizes = [ size for size in args.sizes if size<=50 ][:2] or [10]
+		args.min_time = min(args.min_time, 0.1)
+	
+	systems = []
+	for name in args.systems:
+		if name == "roessler_network":
+			systems.extend( roessler_network(N) for N in args.sizes )
+		else:
+			systems.append( SYSTEMS[name]() )
+	
+	results = []
+	for system in systems:
+		for backend in args.backends:
+			for flags in (args.flags if backend=="C" else [None]):
+				with catch_warnings():
+					simplefilter("ignore")
+					for result in benchmark(system, backend, flags, args.integrators, args.min_time, args.max_jac_dimension):
+						print("{system:<20} n={n:<6} {backend:<6} {flags!s:<10} {measure:<24} {value:.4g} {unit}".format(**result))
+						results.append(result)
+	
+	with open(args.output, "w") as output:
+		json.dump({"metadata":metadata(), "results":results}, output, indent=1)
+	print("Results written to " + args.output)
+
+if __name__ == "__main__":
+	main()
@@ -114,4 +114,4 @@ if __name__ == "__main__":
 	ODE.set_initial_value(initial_state,0.0)
 	
 	# data structure: x[0], v[0], z[0], x[1], …, x[N], v[N], z[N]
-	data = np.vstack(ODE.integrate(T) for T in range(10,100000,10))
+	data = ODE.integrate_grid(range(10,100000,10))
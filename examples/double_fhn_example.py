@@ -44,6 +44,6 @@ if __name__ == "__main__":
 	ODE.set_integrator("dopri5")
 	ODE.set_initial_value(initial_state,0.0)
 	
-	data = np.vstack(ODE.integrate(T) for T in range(10,1000000,10))
+	data = ODE.integrate_grid(range(10,1000000,10))
 	
 	np.savetxt("timeseries.dat", data)
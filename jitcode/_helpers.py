@@ -1,12 +1,47 @@
 from __future__ import print_function, division, with_statement
 from jinja2 import Environment, FileSystemLoader
 from sympy.printing.ccode import ccode
-from sys import version_info, stderr
+from sympy.printing.pycode import NumPyPrinter
+from sys import version_info, stderr, platform
 import numpy as np
-from os import path
+from os import path, rename, getpid, times
+from time import time
 from warnings import warn
-from itertools import chain
+from contextlib import contextmanager
+from tempfile import mkdtemp
+from itertools import chain, islice, count
+from functools import partial
+from collections import deque, OrderedDict
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
 from sympy.core.cache import clear_cache
+from sympy.core.function import UndefinedFunction, AppliedUndef
+import sympy
+import pickle
+import shutil
+import signal
+import json
+import logging
+import setuptools # noqa: F401 (unused, but provides distutils for Python versions that lack it, so it must precede the next import)
+from distutils.ccompiler import new_compiler
+from distutils.sysconfig import customize_compiler
+
+try:
+	import copyreg
+except ImportError:
+	import copy_reg as copyreg
+
+try:
+	from fcntl import flock, LOCK_EX, LOCK_UN
+except ImportError:
+	flock = None
+
+try:
+	from resource import getrusage, RUSAGE_SELF, RUSAGE_CHILDREN
+except ImportError:
+	getrusage = None
+
+logger = logging.getLogger("jitcode")
 
 
 # String manipulation
@@ -106,6 +141,112 @@ else:
 	
 	raise NotImplementedError("Module loading for Python versions between 3 and 3.3 was not implemented. Please upgrade to a newer Python version.")
 
+# Parallel processing
+# -------------------
+
+# Worker processes receive and return SymPy expressions via pickling, which does not work for undefined functions (such as `y`) in some versions of SymPy. As undefined functions are equal if their names are, it suffices to pickle them by name.
+def _reduce_undefined_function(function):
+	return sympy.Function, (function.__name__,)
+
+try:
+	pickle.loads(pickle.dumps(sympy.Function("y")(0)))
+except (pickle.PicklingError, AttributeError, TypeError):
+	copyreg.pickle(UndefinedFunction, _reduce_undefined_function)
+
+def _process_chunk(function, chunk):
+	results = [function(entry) for entry in chunk]
+	clear_cache()
+	return results
+
+def map_in_parallel(function, iterable, n_jobs=1, chunk_size=100):
+	"""
+	Lazy equivalent of `map(function, iterable)` that applies `function` in `n_jobs` worker processes (all available cores if `n_jobs` is `None`). Each worker handles chunks of `chunk_size` entries and clears SymPy’s cache afterwards. Results are yielded in the order of `iterable`. Only a few chunks per worker are queued at any time, so memory usage stays bounded for long generators. `function` must be picklable, e.g., a module-level function or a `functools.partial` thereof.
+	"""
+	
+	if n_jobs == 1:
+		for entry in iterable:
+			yield function(entry)
+		return
+	
+	n_jobs = n_jobs or cpu_count()
+	chunk_size = max(chunk_size, 1)
+	iterator = iter(iterable)
+	pending = deque()
+	exhausted = False
+	
+	pool = Pool(n_jobs)
+	try:
+		while pending or not exhausted:
+			while not exhausted and len(pending) < 2*n_jobs:
+				chunk = list(islice(iterator, chunk_size))
+				if chunk:
+					pending.append(pool.apply_async(_process_chunk, (function, chunk)))
+				else:
+					exhausted = True
+			
+			if pending:
+				for result in pending.popleft().get():
+					yield result
+	finally:
+		pool.terminate()
+
+# File handling
+# -------------
+
+@contextmanager
+def locked(lockfilename):
+	"""
+	Context manager holding an exclusive lock on the specified file (which is created if needed) for its duration. This serves to keep several processes from building the same cached module at the same time. On platforms without `fcntl`, no locking happens.
+	"""
+	
+	with open(lockfilename, "a") as lockfile:
+		if flock is not None:
+			flock(lockfile, LOCK_EX)
+		try:
+			yield
+		finally:
+			if flock is not None:
+				flock(lockfile, LOCK_UN)
+
+def publish_atomically(filenames, target_folder):
+	"""
+	Copies the specified files to a new folder `target_folder`. The files are first copied to a temporary folder next to `target_folder`, which is then renamed, so other processes either see all files or none. If `target_folder` already exists, nothing happens.
+	"""
+	
+	parent = path.dirname(path.abspath(target_folder))
+	staging = mkdtemp(dir=parent, prefix=".staging-%i-" % getpid())
+	try:
+		for filename in filenames:
+			shutil.copy(filename, staging)
+		try:
+			rename(staging, target_folder)
+		except OSError:
+			if not path.isdir(target_folder):
+				raise
+	finally:
+		shutil.rmtree(staging, ignore_errors=True)
+
+class expression_store(object):
+	"""
+	Evaluates an iterable of SymPy expressions once and writes them one by one (pickled) to the file `filename`. Calling the store returns a generator that replays the expressions from that file, so it can replace a generator function without keeping all expressions in memory or evaluating them again. `len` returns the number of expressions.
+	"""
+	
+	def __init__(self, expressions, filename):
+		self.filename = filename
+		self.length = 0
+		with open(filename, "wb") as storage:
+			for expression in expressions:
+				pickle.dump(sympy.sympify(expression), storage, pickle.HIGHEST_PROTOCOL)
+				self.length += 1
+	
+	def __len__(self):
+		return self.length
+	
+	def __call__(self):
+		with open(self.filename, "rb") as storage:
+			for _ in range(self.length):
+				yield pickle.load(storage)
+
 # Code and templates
 # ------------------
 
@@ -115,8 +256,13 @@ def check_code(code):
 		raise Exception("The above expression could not be converted to C Code.")
 	return code
 
-def write_in_chunks(lines, mainfile, deffile, name, chunk_size, arguments):
+def write_in_chunks(lines, mainfile, deffile, declfile, name, chunk_size, arguments, tmpfile):
+	"""
+	Writes the lines to `mainfile` unless they exceed `chunk_size`, in which case each chunk of lines is written to a function in a file of its own and `mainfile` only contains calls of these functions. `deffile` includes all these files and `declfile` declares all functions, so either can be included in the main code. Returns the names of the files containing the functions.
+	"""
+	
 	funcname = "definitions_" + name
+	chunk_files = []
 	
 	first_chunk = []
 	try:
@@ -128,27 +274,176 @@ def write_in_chunks(lines, mainfile, deffile, name, chunk_size, arguments):
 	else:
 		lines = chain(first_chunk, lines)
 		
+		if arguments:
+			call_arguments = ", ".join(argument[0] for argument in arguments)
+			parameters = ", ".join(argument[1]+" "+argument[0] for argument in arguments)
+		else:
+			call_arguments = ""
+			parameters = "void"
+		
 		while True:
-			mainfile.write(funcname + "(")
-			deffile.write("void " + funcname + "(")
-			if arguments:
-				mainfile.write(", ".join(argument[0] for argument in arguments))
-				deffile.write(", ".join(argument[1]+" "+argument[0] for argument in arguments))
-			else:
-				deffile.write("void")
-			mainfile.write(");\n")
-			deffile.write("){\n")
+			signature = "void " + funcname + "(" + parameters + ")"
+			mainfile.write(funcname + "(" + call_arguments + ");\n")
+			declfile.write(signature + ";\n")
+			deffile.write("# include \"" + funcname + ".c\"\n")
+			chunk_files.append(funcname + ".c")
 			
-			try:
-				for i in range(chunk_size):
-					deffile.write(next(lines))
-			except StopIteration:
-				break
-			finally:
-				deffile.write("}\n")
+			with open( tmpfile(funcname + ".c"), "w" ) as chunkfile:
+				chunkfile.write(signature + "{\n")
+				try:
+					for i in range(chunk_size):
+						chunkfile.write(next(lines))
+				except StopIteration:
+					break
+				finally:
+					chunkfile.write("}\n")
 			
 			funcname = count_up(funcname)
 			clear_cache()
+	
+	return chunk_files
+
+def render_code_line(expression, user_functions):
+	codeline = ccode(expression, user_functions=user_functions)
+	return check_code(codeline) + ";\n"
+
+def render_cse_block(expressions, user_functions):
+	"""
+	Applies SymPy’s common-subexpression detection to the expressions and translates the result to a single block of C code, in which the common subexpressions are stored in a local array `cse` (accessed via the macros `get_cse` and `set_cse`).
+	"""
+	
+	get_cse = sympy.Function("get_cse")
+	set_cse = sympy.Function("set_cse")
+	temporaries, reduced = sympy.cse(
+			list(expressions),
+			symbols = (get_cse(i) for i in count())
+		)
+	
+	user_functions = dict(user_functions, get_cse="get_cse", set_cse="set_cse")
+	codelines = [
+			render_code_line(set_cse(i,temporary[1]), user_functions)
+			for i,temporary in enumerate(temporaries)
+		] + [
+			render_code_line(expression, user_functions)
+			for expression in reduced
+		]
+	
+	if temporaries:
+		return "{\ncse_array(%i);\n" % len(temporaries) + "".join(codelines) + "}\n"
+	else:
+		return "".join(codelines)
+
+def motif_of(expression, indexed_functions):
+	"""
+	Splits the expression into a template and the values it needs to be filled with (see `fill_in_motif`): In the template, each integer argument of a function in `indexed_functions` is replaced by `motif_index(k)`, and each floating-point number (except exponents) is replaced by `motif_constant(k)`. The value argument of functions starting with `set_` is not considered an index. Expressions with the same template form a motif.
+	"""
+	
+	get_index = sympy.Function("motif_index")
+	get_constant = sympy.Function("motif_constant")
+	indices = []
+	constants = []
+	
+	def template_of(expression):
+		if expression.is_Float:
+			constants.append(float(expression))
+			return get_constant(len(constants)-1)
+		elif isinstance(expression,AppliedUndef) and expression.func.__name__ in indexed_functions:
+			args = list(expression.args)
+			n_indices = len(args)-1 if expression.func.__name__.startswith("set_") else len(args)
+			for k,arg in enumerate(args):
+				if k<n_indices and arg.is_Integer:
+					indices.append(int(arg))
+					args[k] = get_index(len(indices)-1)
+				else:
+					args[k] = template_of(arg)
+			return expression.func(*args)
+		elif expression.is_Pow:
+			return expression.func(template_of(expression.base), expression.exp)
+		elif expression.args:
+			return expression.func(*map(template_of,expression.args))
+		else:
+			return expression
+	
+	template = template_of(expression)
+	return template, tuple(indices), tuple(constants)
+
+def fill_in_motif(template, indices, constants):
+	"""
+	Inverse of `motif_of`.
+	"""
+	get_index = sympy.Function("motif_index")
+	get_constant = sympy.Function("motif_constant")
+	return template.xreplace(dict(
+			[ (get_index(k)   , sympy.Integer(value)) for k,value in enumerate(indices  ) ] +
+			[ (get_constant(k), sympy.Float  (value)) for k,value in enumerate(constants) ]
+		))
+
+def collect_motifs(expressions, indexed_functions, n_jobs=1, chunk_size=100):
+	"""
+	Groups the expressions by their templates (see `motif_of`). Returns an ordered dictionary mapping each template to the list of pairs of indices and constants it is filled with. Only the templates and these values are held in memory.
+	"""
+	motifs = OrderedDict()
+	for template,indices,constants in map_in_parallel(
+			partial(motif_of, indexed_functions=indexed_functions),
+			expressions,
+			n_jobs = n_jobs,
+			chunk_size = chunk_size
+		):
+		motifs.setdefault(template,[]).append((indices,constants))
+	return motifs
+
+def _table(c_type, name, rows, formatter):
+	return (
+			"static %s const %s[%i][%i] = {\n" % (c_type, name, len(rows), len(rows[0]))
+			+ ",\n".join( "{" + ",".join(formatter(value) for value in row) + "}" for row in rows )
+			+ "\n};\n"
+		)
+
+def render_motif(template, instances, user_functions):
+	"""
+	Translates a motif (see `collect_motifs`) to a C loop over its instances, which reads the indices and constants of each instance from static tables (accessed via the macros `motif_index` and `motif_constant`). Indices and constants that are the same for all instances are written into the code directly.
+	"""
+	
+	get_index = sympy.Function("motif_index")
+	get_constant = sympy.Function("motif_constant")
+	substitutions = {}
+	tables = []
+	
+	for placeholder, number, position, c_type, name, formatter, to_sympy in [
+			( get_index   , len(instances[0][0]), 0, "unsigned int", "motif_indices"  , str , sympy.Integer ),
+			( get_constant, len(instances[0][1]), 1, "double"      , "motif_constants", repr, sympy.Float   ),
+		]:
+		varying = []
+		for k in range(number):
+			values = [ instance[position][k] for instance in instances ]
+			if all( value==values[0] for value in values ):
+				substitutions[placeholder(k)] = to_sympy(values[0])
+			else:
+				substitutions[placeholder(k)] = placeholder(len(varying))
+				varying.append(values)
+		if varying:
+			rows = list(zip(*varying))
+			tables.append(_table(c_type, name, rows, formatter))
+	
+	user_functions = dict(user_functions, motif_index="motif_index", motif_constant="motif_constant")
+	return (
+			"{\n"
+			+ "".join(tables)
+			+ "for (unsigned int instance=0; instance<%i; instance++)\n" % len(instances)
+			+ render_code_line(template.xreplace(substitutions), user_functions)
+			+ "}\n"
+		)
+
+def windows(iterable, size):
+	"""
+	Yields consecutive lists of `size` elements of the iterable (the last one may be shorter).
+	"""
+	iterator = iter(iterable)
+	while True:
+		window = list(islice(iterator, size))
+		if not window:
+			return
+		yield window
 
 def render_and_write_code(
 	expressions,
@@ -156,25 +451,106 @@ def render_and_write_code(
 	name,
 	functions = [],
 	chunk_size = 100,
-	arguments = []
+	arguments = [],
+	n_jobs = 1,
+	cse = False,
+	motifs = False
 	):
+	"""
+	Translates the expressions to C code and writes it to `name.c` (see `write_in_chunks` for the other files). Returns the names of the files containing the chunk functions.
+	
+	If `cse` is true, common-subexpression detection is applied to each chunk of expressions separately (or to windows of 100 expressions if there is no chunking), and the common subexpressions become local variables of the respective chunk function. Thus only one chunk needs to be held in memory at any time.
+	
+	If `motifs` is true, expressions that only differ in indices and constants are translated to loops (see `render_motif`), each of which counts as one line. As this reorders the expressions, their order must not matter.
+	"""
 	
 	user_functions = {function:function for function in functions}
+	window_size = chunk_size if chunk_size>0 else 100
 	
 	def codelines():
-		for expression in expressions:
-			codeline = ccode(expression, user_functions=user_functions)
-			yield check_code(codeline) + ";\n"
+		singles = expressions
+		loops = []
+		if motifs:
+			groups = collect_motifs(expressions, functions, n_jobs, window_size)
+			loops = [
+					render_motif(template, instances, user_functions)
+					for template,instances in groups.items()
+					if len(instances)>1
+				]
+			singles = (
+					fill_in_motif(template, *instances[0])
+					for template,instances in groups.items()
+					if len(instances)==1
+				)
+		
+		if cse:
+			lines = map_in_parallel(
+				partial(render_cse_block, user_functions=user_functions),
+				windows(singles, window_size),
+				n_jobs = n_jobs,
+				chunk_size = 1
+				)
+		else:
+			lines = map_in_parallel(
+				partial(render_code_line, user_functions=user_functions),
+				singles,
+				n_jobs = n_jobs,
+				chunk_size = window_size
+				)
+		
+		return chain(loops, lines)
 	
 	with \
-		open( tmpfile(name+".c"            ), "w" ) as mainfile, \
-		open( tmpfile(name+"_definitions.c"), "w" ) as deffile:
+		open( tmpfile(name+".c"             ), "w" ) as mainfile, \
+		open( tmpfile(name+"_definitions.c" ), "w" ) as deffile, \
+		open( tmpfile(name+"_declarations.c"), "w" ) as declfile:
 		
 		if chunk_size < 1:
 			for line in codelines():
 				mainfile.write(line)
+			return []
 		else:
-			write_in_chunks(codelines(), mainfile, deffile, name, chunk_size, arguments)
+			return write_in_chunks(
+				codelines(),
+				mainfile, deffile, declfile,
+				name,
+				1 if cse else chunk_size,
+				arguments, tmpfile
+				)
+
+def split_evenly(sequence, number):
+	"""
+	Splits the sequence into `number` contiguous pieces of almost equal length (fewer if the sequence is too short).
+	"""
+	number = max(1, min(number, len(sequence)))
+	bounds = [ (i*len(sequence))//number for i in range(number+1) ]
+	return [ sequence[bounds[i]:bounds[i+1]] for i in range(number) ]
+
+def compile_in_parallel(sources, folder, include_dirs, extra_compile_args, n_jobs=None, verbose=False, record=None):
+	"""
+	Compiles each of the C sources to an object file in `folder` using the compiler and flags Python extensions are built with. Compilations are run in `n_jobs` parallel compiler processes (as many as there are cores, if `None`). Returns the object files. If `record` is given, it is called with the name of each source and the time needed for compiling it.
+	"""
+	
+	def compile_source(source):
+		start = time()
+		compiler = new_compiler(verbose=verbose)
+		customize_compiler(compiler)
+		result = compiler.compile(
+				[source],
+				output_dir = folder,
+				include_dirs = include_dirs,
+				extra_postargs = extra_compile_args
+			)[0]
+		if record is not None:
+			record(path.basename(source), time()-start)
+		return result
+	
+	pool = ThreadPool(n_jobs or cpu_count())
+	try:
+		return pool.map(compile_source, sources)
+	finally:
+		pool.close()
+		pool.join()
 
 def render_template(filename, target, **kwargs):
 	folder = path.dirname(__file__)
@@ -183,6 +559,173 @@ def render_template(filename, target, **kwargs):
 	with open(target, "w") as codefile:
 		codefile.write(template.render(kwargs))
 
+def numpy_function(name, parameters, helpers, assignments, shape, state="y", zeros=False, do_cse=True):
+	"""
+	Generates Python code for a function `name(*parameters, out=None)` with NumPy operations, executes it, and returns the function. The function first evaluates the `helpers` (pairs of symbols and expressions, each one only depending on previous ones) and then, for each pair of an index tuple and an expression in `assignments`, writes the expression to that index of `out`. If `out` is `None`, a new array with `shape` is allocated (filled with zeros if `zeros` is true); trailing dimensions of `state` beyond the first are appended to this shape, so several states can be processed at once. If `do_cse`, common subexpressions of all assignments are evaluated only once. The names of parameters are used as they are printed; helpers are renamed.
+	"""
+	
+	printer = NumPyPrinter()
+	def code(expression):
+		result = printer.doprint(expression)
+		if result.startswith("# Not"):
+			stderr.write(result)
+			raise Exception("The above expression could not be converted to Python code.")
+		return result
+	
+	renaming = {}
+	helper_lines = []
+	for i,(symbol,expression) in enumerate(helpers):
+		renaming[symbol] = sympy.Symbol("helper_%i" % i)
+		helper_lines.append("%s = %s" % (renaming[symbol], code(expression.xreplace(renaming))))
+	
+	indices = [ index for index,_ in assignments ]
+	expressions = [ expression.xreplace(renaming) for _,expression in assignments ]
+	cse_lines = []
+	if do_cse and expressions:
+		replacements, expressions = sympy.cse(
+				expressions,
+				symbols = (sympy.Symbol("cse_%i" % i) for i in count())
+			)
+		cse_lines = [ "%s = %s" % (symbol, code(expression)) for symbol,expression in replacements ]
+	
+	body = helper_lines + cse_lines
+	body.append( "if out is None: out = numpy.%s(%r + numpy.shape(%s)[1:])" % ("zeros" if zeros else "empty", tuple(shape), state) )
+	body.extend( "out[%s] = %s" % (", ".join(map(str,index)), code(expression)) for index,expression in zip(indices,expressions) )
+	body.append( "return out" )
+	
+	source = "\n\t".join( ["def %s(%s, out=None):" % (name, ", ".join(map(code,parameters)))] + body )
+	namespace = {"numpy": np}
+	exec(compile("from __future__ import division\n"+source, "<%s>" % name, "exec"), namespace)
+	return namespace[name]
+
+
+# Build statistics
+# ----------------
+
+def cpu_time():
+	# includes child processes (workers and compilers) that have finished
+	return sum(times()[:4])
+
+def peak_memory():
+	# peak resident set size of this process and the largest of its finished child processes in bytes
+	if getrusage is None:
+		return {}
+	unit = 1 if platform=="darwin" else 1024
+	return {
+			"peak_memory": getrusage(RUSAGE_SELF).ru_maxrss*unit,
+			"peak_memory_children": getrusage(RUSAGE_CHILDREN).ru_maxrss*unit,
+		}
+
+class build_statistics(object):
+	"""
+	Records the stages of building a module. For each stage, a dictionary is appended to `stages` (in the order in which the stages start) that contains its `"name"`, the name of the stage it is nested in (`"parent"`), the `"wall_time"` and `"cpu_time"` (in seconds, including finished child processes), the `"peak_memory"` and `"peak_memory_children"` (of this process and its largest finished child process so far, in bytes, on Unix only), and all quantities added with `add` during the stage. Like the times, these include nested stages. Completed stages are reported to the `jitcode` logger; the dictionary is attached to the log record as `jitcode_stage`.
+	"""
+	
+	def __init__(self):
+		self.stages = []
+		self._open = []
+	
+	@contextmanager
+	def stage(self, name):
+		"""
+		Context manager recording its body as a stage. If the innermost open stage has the same name (e.g., because a method calls its parent’s variant), no new stage is started.
+		"""
+		
+		if self._open and self._open[-1]["name"]==name:
+			yield self._open[-1]
+			return
+		
+		record = OrderedDict([
+				("name", name),
+				("parent", self._open[-1]["name"] if self._open else None),
+			])
+		self.stages.append(record)
+		self._open.append(record)
+		wall_start, cpu_start = time(), cpu_time()
+		try:
+			yield record
+		except:
+			record["failed"] = True
+			raise
+		finally:
+			self._open.pop()
+			record["wall_time"] = time()-wall_start
+			record["cpu_time"] = cpu_time()-cpu_start
+			record.update(peak_memory())
+			logger.info(
+					"%s took %.3f s (CPU: %.3f s)",
+					name, record["wall_time"], record["cpu_time"],
+					extra = {"jitcode_stage": record}
+				)
+	
+	def add(self, key, value):
+		"""
+		Adds the value to the quantity `key` of all open stages: Numbers are summed up and other values are collected in a list. Outside of stages, nothing happens.
+		"""
+		
+		for record in self._open:
+			if isinstance(value, (int,float)):
+				record[key] = record.get(key,0) + value
+			else:
+				record.setdefault(key,[]).append(value)
+	
+	def to_json(self, filename=None):
+		"""
+		Returns the stages as a JSON string and writes it to `filename` if given.
+		"""
+		
+		result = json.dumps({"stages":self.stages}, indent=1)
+		if filename is not None:
+			with open(filename, "w") as jsonfile:
+				jsonfile.write(result)
+		return result
+
+# Simplification
+# --------------
+
+class TimeLimitExceeded(Exception):
+	pass
+
+def _raise_time_limit_exceeded(signum, frame):
+	raise TimeLimitExceeded()
+
+@contextmanager
+def time_limit(seconds):
+	"""
+	Context manager that raises `TimeLimitExceeded` if its body takes longer than `seconds` (immediately if `seconds` is not positive). This uses `SIGALRM` and thus only has an effect on Unix and in the main thread of a process (which includes the worker processes of `map_in_parallel`). If `seconds` is `None` or the requirements are not met, the body is never interrupted.
+	"""
+	
+	if (seconds is not None) and seconds<=0:
+		raise TimeLimitExceeded()
+	
+	installed = False
+	if (seconds is not None) and hasattr(signal, "setitimer"):
+		try:
+			previous = signal.signal(signal.SIGALRM, _raise_time_limit_exceeded)
+		except ValueError:
+			# not in the main thread
+			pass
+		else:
+			installed = True
+	
+	if not installed:
+		yield
+		return
+	
+	signal.setitimer(signal.ITIMER_REAL, seconds)
+	try:
+		yield
+	finally:
+		signal.setitimer(signal.ITIMER_REAL, 0)
+		signal.signal(signal.SIGALRM, signal.SIG_DFL if previous is None else previous)
+
+def cheap_simplify(expression):
+	"""
+	A fast alternative to `sympy.simplify` that only cancels common factors and combines powers with the same exponent. Like `sympy.simplify` with `ratio=1`, it returns the original expression if the result is not shorter.
+	"""
+	
+	result = sympy.expand_power_base(sympy.cancel(expression))
+	return result if sympy.count_ops(result) < sympy.count_ops(expression) else expression
 
 # Numerical tools
 # ---------------
@@ -208,3 +751,38 @@ def orthonormalise(vectors):
 		norms.append(norm)
 	
 	return np.array(norms)
+
+def orthonormalise_qr(vectors, dependents=()):
+	"""
+	Like `orthonormalise`, but for a two-dimensional array whose rows are the vectors, which are overwritten. The orthonormalisation is done with a single QR decomposition (Householder), which is faster for many vectors and retains orthogonality better than classical Gram-Schmidt. The norms are the absolute values of the diagonal of R.
+	
+	`dependents` are arrays of shape `(…,len(vectors),len(vectors[0]))` that are subjected to the same linear combination of rows as `vectors` (in place). This is only done if all norms are finite and non-zero.
+	"""
+	Q,R = np.linalg.qr(vectors.T)
+	diagonal = np.diagonal(R)
+	# Householder QR determines the vectors only up to sign; choose them like Gram-Schmidt does:
+	signs = np.where(diagonal<0,-1.0,1.0)
+	vectors[:] = Q.T * signs[:,None]
+	norms = np.abs(diagonal)
+	
+	if np.all(np.isfinite(norms)) and np.all(norms>0):
+		# vectors = R.T·Q.T, i.e., the new vectors are signs·R^(-T)·vectors.
+		transformation = np.linalg.inv(R).T * signs[:,None]
+		for dependent in dependents:
+			dependent[:] = np.matmul(transformation, dependent)
+	
+	return norms
+
+def banded_from_dense(matrix, lband, uband):
+	"""
+	Converts a square matrix to the compact banded storage used by SciPy’s ODE (for `lsoda` and `vode`), i.e., `matrix[i,j]` ends up at `[i-j+uband,j]`. Entries outside the band are discarded.
+	"""
+	n = matrix.shape[1]
+	banded = np.zeros((lband+uband+1,n))
+	for k in range(-lband,uband+1):
+		diagonal = np.diagonal(matrix,k)
+		if k>=0:
+			banded[uband-k,k:] = diagonal
+		else:
+			banded[uband-k,:n+k] = diagonal
+	return banded
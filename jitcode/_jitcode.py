@@ -4,27 +4,39 @@
 from __future__ import print_function, absolute_import
 
 from scipy.integrate import ode
-from os import path as path
+from os import path as path, environ, makedirs
 from sys import version_info, modules
-from numpy import array, hstack, log, get_include
+from hashlib import sha256
+import sysconfig
+from numpy import hstack, log, get_include
 import numpy as np
 from warnings import warn
 from traceback import format_exc
 from types import FunctionType, BuiltinFunctionType
 from setuptools import setup, Extension
 from tempfile import mkdtemp
+from multiprocessing import cpu_count
 from inspect import getargspec, isgeneratorfunction
-from scipy.integrate._ode import find_integrator
+from scipy.integrate._ode import find_integrator, IntegratorBase, lsoda, vode, dopri5
 from copy import copy as copy_object
-from itertools import chain, count
+from itertools import count
+from functools import partial, wraps
+from collections import deque
+from time import time
+import heapq
 from jitcode._helpers import (
 	ensure_suffix, count_up,
 	get_module_path, modulename_from_path, find_and_load_module, module_from_path,
-	render_and_write_code,
-	render_template,
-	non_zero_ratio, random_direction, orthonormalise
+	map_in_parallel, render_and_write_code,
+	render_template, split_evenly, compile_in_parallel,
+	locked, publish_atomically, expression_store,
+	non_zero_ratio, random_direction, orthonormalise_qr,
+	numpy_function, time_limit, TimeLimitExceeded, cheap_simplify,
+	build_statistics, logger
 	)
 import sympy
+from sympy.core.function import AppliedUndef, UndefinedFunction
+from scipy.sparse import csr_matrix, vstack as sparse_vstack
 import shutil
 
 def provide_basic_symbols():
@@ -104,6 +116,20 @@ def _can_use_jacobian(integratorname):
 def _is_C(function):
 	return isinstance(function, BuiltinFunctionType)
 
+def _recorded_stage(name):
+	# decorator recording a method as a stage in `build_statistics`, including the size of the code it generated
+	def decorator(method):
+		@wraps(method)
+		def recorded(self, *args, **kwargs):
+			with self.build_statistics.stage(name):
+				result = method(self, *args, **kwargs)
+				self._record_code_size()
+			return result
+		# for `_record_options` (`wraps` only sets this from Python 3.2 on)
+		recorded.__wrapped__ = method
+		return recorded
+	return decorator
+
 def _is_lambda(function):
 	return isinstance(function, FunctionType)
 
@@ -112,51 +138,272 @@ def _sympify_helpers(helpers):
 	#return [tuple(map(sympy.sympify, helper)) for helper in helpers]
 
 
-def depends_on_any(helper, other_helpers):
-	for other_helper in other_helpers:
-		if helper[1].has(other_helper[0]):
-			return True
-	return False
-
 def _sort_helpers(helpers):
-	if len(helpers)>1:
-		for j,helper in enumerate(helpers):
-			if not depends_on_any(helper, helpers):
-				helpers.insert(0,helpers.pop(j))
-				break
-		else:
-			raise ValueError("Helpers have cyclic dependencies.")
-		
-		helpers[1:] = _sort_helpers(helpers[1:])
+	# Sorts helpers topologically (Kahn’s algorithm), keeping the given order where possible.
+	indices = dict( (helper[0],i) for i,helper in enumerate(helpers) )
+	dependents = [ [] for helper in helpers ]
+	number_of_dependencies = []
+	for i,helper in enumerate(helpers):
+		dependencies = set( indices[symbol] for symbol in helper[1].free_symbols if symbol in indices )
+		number_of_dependencies.append(len(dependencies))
+		for j in dependencies:
+			dependents[j].append(i)
 	
+	queue = deque( i for i,number in enumerate(number_of_dependencies) if number==0 )
+	order = []
+	while queue:
+		i = queue.popleft()
+		order.append(i)
+		for j in dependents[i]:
+			number_of_dependencies[j] -= 1
+			if number_of_dependencies[j]==0:
+				queue.append(j)
+	
+	if len(order) < len(helpers):
+		raise ValueError("Helpers have cyclic dependencies: " + ", ".join( str(helpers[i][0]) for i in _cyclic_helpers(dependents, number_of_dependencies) ))
+	
+	helpers[:] = [ helpers[i] for i in order ]
 	return helpers
 
-def _jac_from_f_with_helpers(f, helpers, simplify, n):
+def _cyclic_helpers(dependents, number_of_dependencies):
+	# Given the state of Kahn’s algorithm after it got stuck, removes the unsorted helpers on which no other unsorted helper depends (repeatedly) and returns the remaining ones, which are part of cycles or lie between cycles.
+	unsorted = set( i for i,number in enumerate(number_of_dependencies) if number>0 )
+	number_of_dependents = dict( (i, sum(j in unsorted for j in dependents[i])) for i in unsorted )
+	reverse_dependencies = dict( (i,[]) for i in unsorted )
+	for i in unsorted:
+		for j in dependents[i]:
+			if j in unsorted:
+				reverse_dependencies[j].append(i)
+	
+	queue = deque( i for i in unsorted if number_of_dependents[i]==0 )
+	while queue:
+		i = queue.popleft()
+		unsorted.remove(i)
+		for j in reverse_dependencies[i]:
+			number_of_dependents[j] -= 1
+			if number_of_dependents[j]==0:
+				queue.append(j)
+	
+	return sorted(unsorted)
+
+def _direct_y_dependencies(expression):
+	# Returns the indices of the components of y that appear in the expression itself (not via helpers) or `None` if these cannot be determined, e.g., because of symbolic indices.
 	t,y = provide_basic_symbols()
 	
-	dependent_helpers = [[] for i in range(n)]
-	for i in range(n):
-		for helper in helpers:
-			derivative = sympy.diff(helper[1], y(i))
-			for other_helper in dependent_helpers[i]:
-				derivative += sympy.diff(helper[1],other_helper[0]) * other_helper[1]
-			if derivative:
-				dependent_helpers[i].append( (helper[0], derivative) )
-	
-	def line(f_entry):
-		for j in range(n):
-			entry = sympy.diff( f_entry, y(j) )
-			for helper in dependent_helpers[j]:
-				entry += sympy.diff(f_entry,helper[0]) * helper[1]
-			if simplify:
+	dependencies = set()
+	for function in expression.atoms(AppliedUndef):
+		if function.func == y:
+			index = function.args[0]
+			if index.is_Integer:
+				dependencies.add(int(index))
+			else:
+				return None
+	return dependencies
+
+def _y_dependencies(expression, helper_dependencies):
+	# Returns the indices of the components of y on which the expression depends directly or via helpers or `None` if these cannot be determined, e.g., because of symbolic indices.
+	dependencies = _direct_y_dependencies(expression)
+	if dependencies is None:
+		return None
+	
+	for symbol in expression.free_symbols:
+		if symbol in helper_dependencies:
+			if helper_dependencies[symbol] is None:
+				return None
+			dependencies |= helper_dependencies[symbol]
+	
+	return dependencies
+
+def _helper_dependencies(helpers):
+	# Helpers referring to helpers not processed yet (which should not happen for sorted helpers) are conservatively assumed to depend on everything.
+	dependencies = dict( (helper[0], None) for helper in helpers )
+	for helper in helpers:
+		dependencies[helper[0]] = _y_dependencies(helper[1], dependencies)
+	return dependencies
+
+def _jac_sparsity(f, helpers, n):
+	helper_dependencies = _helper_dependencies(helpers)
+	
+	rows = []
+	columns = []
+	for i,entry in enumerate(f()):
+		dependencies = _y_dependencies(entry, helper_dependencies)
+		if dependencies is None:
+			dependencies = range(n)
+		dependencies = sorted( j for j in dependencies if 0<=j<n )
+		rows.extend( [i]*len(dependencies) )
+		columns.extend(dependencies)
+	
+	return csr_matrix(
+		( np.ones(len(rows), dtype=bool), (rows, columns) ),
+		shape = (n,n)
+		)
+
+def _jac_line(f_entry, helper_derivatives, helper_dependencies, simplify, n, simplify_budget=None):
+	# Returns the line and, for each simplified entry, its column, the time needed for simplifying it, and whether the time budget was exceeded.
+	t,y = provide_basic_symbols()
+	
+	dependencies = _y_dependencies(f_entry, helper_dependencies)
+	
+	# The partial derivatives with respect to the helpers are computed once for the entire line.
+	helper_partials = []
+	for symbol in f_entry.free_symbols:
+		if symbol in helper_derivatives:
+			partial_derivative = sympy.diff(f_entry, symbol)
+			if partial_derivative:
+				helper_partials.append( (partial_derivative, helper_derivatives[symbol]) )
+	
+	line = [sympy.S.Zero]*n
+	timings = []
+	for j in (range(n) if dependencies is None else dependencies):
+		if not 0<=j<n:
+			continue
+		entry = sympy.diff( f_entry, y(j) )
+		for partial_derivative, derivatives in helper_partials:
+			if j in derivatives:
+				entry += partial_derivative * derivatives[j]
+		if simplify:
+			entry, duration, fell_back = _simplify(entry, simplify, simplify_budget)
+			timings.append((j, duration, fell_back))
+		line[j] = entry
+	return line, timings
+
+def _helper_derivatives(helpers, n):
+	# Returns a dictionary mapping each helper to a dictionary that maps the index j to the total derivative of the helper with respect to y(j) (if not zero). This follows the dependency graph of the (sorted) helpers, i.e., each helper is only differentiated with respect to the components of y and the helpers that it directly depends on, and the total derivatives of the latter are reused.
+	t,y = provide_basic_symbols()
+	
+	derivatives = {}
+	for symbol, expression in helpers:
+		dependencies = _direct_y_dependencies(expression)
+		total = {}
+		for j in (range(n) if dependencies is None else dependencies):
+			if 0<=j<n:
+				derivative = sympy.diff(expression, y(j))
+				if derivative:
+					total[j] = derivative
+		
+		for other in expression.free_symbols:
+			if other in derivatives and derivatives[other]:
+				partial_derivative = sympy.diff(expression, other)
+				if partial_derivative:
+					for j,derivative in derivatives[other].items():
+						total[j] = total.get(j,sympy.S.Zero) + partial_derivative*derivative
+		
+		derivatives[symbol] = dict( (j,derivative) for j,derivative in total.items() if derivative )
+	
+	return derivatives
+
+def _jac_from_f_with_helpers(f, helpers, simplify, n, n_jobs=1, simplify_budget=None, record=None):
+	# If `record` is given, it is called with a description, the duration, and whether the time budget was exceeded for every simplified entry.
+	lines = map_in_parallel(
+		partial(
+			_jac_line,
+			helper_derivatives = _helper_derivatives(helpers, n),
+			helper_dependencies = _helper_dependencies(helpers),
+			simplify = _simplification_strategy(simplify),
+			n = n,
+			simplify_budget = simplify_budget
+			),
+		f(),
+		n_jobs = n_jobs,
+		chunk_size = 10
+		)
+	for i,(line,timings) in enumerate(lines):
+		if record:
+			for j,duration,fell_back in timings:
+				record("Jacobian[%i,%i]" % (i,j), duration, fell_back)
+		yield line
+
+def _simplification_strategy(simplify):
+	if simplify is True or simplify=="full":
+		return "full"
+	elif simplify=="cheap":
+		return "cheap"
+	elif simplify is False or simplify is None or simplify=="none":
+		return None
+	else:
+		raise ValueError("Simplification must be one of True, False, \"full\", \"cheap\", and \"none\".")
+
+def _simplify(entry, strategy, budget=None):
+	# Returns the simplified entry, the time needed, and whether full simplification exceeded the budget, in which case cheap simplification is used instead.
+	start = time()
+	fell_back = False
+	if strategy=="full":
+		try:
+			with time_limit(budget):
 				entry = sympy.simplify(entry, ratio=1.0)
-			yield entry
+		except TimeLimitExceeded:
+			entry = cheap_simplify(entry)
+			fell_back = True
+	elif strategy=="cheap":
+		entry = cheap_simplify(entry)
+	return entry, time()-start, fell_back
+
+def _simplify_and_substitute(entry, simplify, substitutions, simplify_budget=None):
+	entry, duration, fell_back = _simplify(entry, simplify, simplify_budget)
+	if substitutions:
+		entry = entry.subs(substitutions)
+	return entry, duration, fell_back
+
+def _control_par_substitutions(control_pars):
+	get_control_par = sympy.Function("control_par")
+	get_control_par_array = sympy.Function("control_par_array")
+	index = sympy.Dummy("index")
 	
-	for f_entry in f():
-		yield line(f_entry)
+	substitutions = []
+	kinds = []
+	for control_par in control_pars:
+		if isinstance(control_par, UndefinedFunction):
+			k = kinds.count(True)
+			substitutions.append(( control_par, sympy.Lambda(index,get_control_par_array(k,index)) ))
+			kinds.append(True)
+		elif isinstance(control_par, sympy.Symbol):
+			k = kinds.count(False)
+			substitutions.append(( control_par, get_control_par(k) ))
+			kinds.append(False)
+		else:
+			raise ValueError("Control parameters must be SymPy symbols or SymPy functions.")
+	return substitutions, kinds
 
-def _handle_input(f_sym,n):
+def _coupling_operator(couplings, n):
+	# Combines the coupling operators into one sparse matrix acting on the entire state, whose rows are the values of all couplings, one after another. Returns this matrix, the offset and number of rows for each coupling function, and the substitutions for the generated code.
+	get_coupling = sympy.Function("get_coupling")
+	index = sympy.Dummy("index")
+	
+	matrices = []
+	ranges = {}
+	substitutions = []
+	offset = 0
+	for coupling in couplings:
+		function, matrix = coupling[:2]
+		if not isinstance(function, UndefinedFunction):
+			raise ValueError("Couplings must be denoted by SymPy functions.")
+		matrix = csr_matrix(matrix, dtype=float)
+		components = np.asarray(coupling[2] if len(coupling)>2 else range(matrix.shape[1]), dtype=int)
+		if len(components) != matrix.shape[1]:
+			raise ValueError("Number of columns of coupling matrix (%i) does not match number of components it acts on (%i)." % (matrix.shape[1], len(components)))
+		if len(components) and not (0 <= components.min() and components.max() < n):
+			raise ValueError("Coupling matrix acts on components that do not exist.")
+		
+		matrices.append(csr_matrix(
+				(matrix.data, components[matrix.indices], matrix.indptr),
+				shape = (matrix.shape[0], n)
+			))
+		ranges[function] = (offset, matrix.shape[0])
+		substitutions.append(( function, sympy.Lambda(index,get_coupling(offset+index)) ))
+		offset += matrix.shape[0]
+	
+	operator = sparse_vstack(matrices, format="csr") if matrices else csr_matrix((0,n))
+	operator.sort_indices()
+	return operator, ranges, substitutions
+
+def _handle_input(f_sym,n,store_file=None):
 	if isgeneratorfunction(f_sym):
+		if store_file is not None:
+			store = expression_store(f_sym(), store_file)
+			if (n is not None) and (len(store) != n):
+				raise ValueError("Length of f_sym and n do not match.")
+			return ( store, len(store) )
 		n = n or sum(1 for _ in f_sym())
 		return ( f_sym, n )
 	else:
@@ -165,6 +412,135 @@ def _handle_input(f_sym,n):
 			raise ValueError("len(f_sym) and n do not match.")
 		return (lambda: (sympy.sympify(entry.doit()) for entry in f_sym), len_f)
 
+class native_dopri5(IntegratorBase):
+	"""
+	An explicit Runge–Kutta integrator of order 5(4) due to Dormand and Prince with adaptive step size, which is compiled into the module alongside the derivative. The entire integration happens within compiled code, without any Python being involved for individual steps or evaluations of the derivative, which makes this integrator considerably faster than `dopri5` for small systems. Select it with `set_integrator("native_dopri5")`; it only works with compiled derivatives (including those loaded with `ode_from_module_file`) whose module contains the integrator (see `native_integrator` in `compile_C`) and does not provide dense output.
+	
+	Parameters
+	----------
+	rtol, atol : floats
+		Relative and absolute tolerance for the local error estimate.
+	nsteps : integer
+		Maximum number of (accepted or rejected) steps during one call of `integrate`.
+	max_step : float
+		Maximum step size. If 0, the step size is not limited.
+	first_step : float
+		Initial step size. If 0, this is estimated automatically.
+	"""
+	
+	runner = True
+	supports_run_relax = False
+	supports_step = False
+	
+	messages = {
+		-1: "Larger nsteps is needed.",
+		-2: "Step size becomes too small.",
+		-3: "Norms of perturbation vectors for Lyapunov exponents out of numerical bounds. Use a smaller renorm_interval or max_growth.",
+		}
+	
+	def __init__(self, rtol=1e-6, atol=1e-12, nsteps=500, max_step=0.0, first_step=0.0):
+		self.rtol = rtol
+		self.atol = atol
+		self.nsteps = nsteps
+		self.max_step = max_step
+		self.first_step = first_step
+		self.success = 1
+	
+	def reset(self, n, has_jac):
+		self.work = np.empty(9*n)
+		self.h = self.first_step
+		self.success = 1
+	
+	def _compiled(self, f, name, message="The native integrator requires a compiled derivative."):
+		module = getattr(f, "__self__", None)
+		if _is_C(f) and not hasattr(module, "dopri5"):
+			raise NotImplementedError("The module was compiled without the native integrator. Use compile_C with native_integrator=True.")
+		if not hasattr(module, name):
+			raise NotImplementedError(message)
+		return getattr(module, name)
+	
+	def run(self, f, jac, y0, t0, t1, f_params, jac_params):
+		y = np.array(y0, dtype=float)
+		t, self.h, status = self._compiled(f, "dopri5")(
+				y, t0, t1, self.h,
+				self.rtol, self.atol, self.max_step, self.nsteps,
+				self.work,
+				*f_params
+			)
+		if status < 0:
+			warn("native_dopri5: " + self.messages[status])
+			self.success = 0
+		return y, t
+	
+	def run_grid(self, f, y0, t0, times, out, f_params):
+		y = np.array(y0, dtype=float)
+		t, self.h, status, done = self._compiled(f, "dopri5_grid")(
+				y, t0, times, out, self.h,
+				self.rtol, self.atol, self.max_step, self.nsteps,
+				self.work,
+				*f_params
+			)
+		if status < 0:
+			warn("native_dopri5: " + self.messages[status])
+			self.success = 0
+			out[done:] = np.nan
+		return y, t
+	
+	def run_lyap(self, f, y0, t0, t1, interval, log_growth, sums, f_params):
+		y = np.array(y0, dtype=float)
+		driver = self._compiled(f, "dopri5_lyap", "The native Lyapunov driver requires a compiled derivative of jitcode_lyap.")
+		t, self.h, interval, status, renormalisations = driver(
+				y, t0, t1, interval, log_growth, sums, self.h,
+				self.rtol, self.atol, self.max_step, self.nsteps,
+				self.work,
+				*f_params
+			)
+		if status < 0:
+			warn("native_dopri5: " + self.messages[status])
+			self.success = 0
+		return y, t, interval, renormalisations
+
+def _prepare_grid(times, out, n):
+	times = np.ascontiguousarray(times, dtype=float)
+	if times.ndim != 1:
+		raise ValueError("Times must be one-dimensional.")
+	steps = np.diff(times)
+	if not ( np.all(steps>=0) or np.all(steps<=0) ):
+		raise ValueError("Times must be sorted.")
+	
+	if out is None:
+		out = np.empty((len(times),n))
+	elif out.shape != (len(times),n):
+		raise ValueError("Output array must have the shape (len(times),%i)." % n)
+	
+	return times, out
+
+def _nordsieck_columns(integrator):
+	"""
+	returns the number of columns of the Nordsieck history that `lsoda` and `vode` keep between calls at the beginning of their real work array (after twenty entries of optional input and output), 0 for integrators that only use the state passed to them, and `None` for unknown integrators.
+	"""
+	if isinstance(integrator, lsoda):
+		return max( min(integrator.max_order_ns,12), min(integrator.max_order_s,5) ) + 1
+	elif isinstance(integrator, vode):
+		return min( integrator.order, 12 if integrator.meth==1 else 5 ) + 1
+	elif isinstance(integrator, (dopri5,native_dopri5)):
+		return 0
+	else:
+		return None
+
+def _register_integrator(new):
+	# Registering an integrator with SciPy makes it available to `set_integrator` of all instances of `scipy.integrate.ode` (not only of JiTCODE). A previous registration with the same name (e.g., if this module is reloaded) is replaced instead of adding another one.
+	IntegratorBase.integrator_classes[:] = [
+			integrator
+			for integrator in IntegratorBase.integrator_classes
+			if integrator.__name__ != new.__name__
+		] + [new]
+
+_register_integrator(native_dopri5)
+
+# When compiling with several jobs, the code is split into this many translation units per job. Units differ in size and compile time, so having more units than jobs keeps all jobs busy until the end, while each additional unit costs parsing the header and some linking time.
+_UNITS_PER_JOB = 4
+
 #: A list with the default extra compile arguments. Use and modify these to get the most of future versions of JiTCODE. Note that without `-Ofast`, `-ffast-math`, or `-funsafe-math-optimizations` (if supported by your compiler), you may experience a considerable speed loss since SymPy uses the `pow` function for small integer powers (`SymPy Issue 8997`_).
 DEFAULT_COMPILE_ARGS = [
 			"-std=c11",
@@ -193,29 +569,159 @@ class jitcode(ode):
 	
 	silent : boolean
 		Whether JiTCODE shall give progress reports on the processing steps.
+	
+	cache_dir : string specifying a path or `None`
+		If not `None`, compiled modules are stored in and retrieved from this directory. Before generating any code, `compile_C` looks for a module built from the same derivative, helpers, Jacobian settings, compiler arguments, compiler, and NumPy and Python versions. If it finds one, it loads it directly and skips all code-generation and compilation steps. Several processes may safely share a cache directory. See `caching` for details.
+	
+	control_pars : list of SymPy symbols and SymPy functions
+		Control parameters, whose values are not fixed in the generated code but passed to the derivative and Jacobian at runtime with `set_f_params`, in the order given here. A SymPy symbol denotes a scalar parameter. A SymPy function (e.g., `ω = sympy.Function("ω")`) denotes an array of parameters, whose components are referenced with an integer argument just like `y`, e.g., `ω(2)`. See `control_parameters` for details.
+	
+	store_f_sym : boolean
+		If `True` and `f_sym` is a generator function, it is only called once (on initialisation), and its entries are written to a temporary file, from which all later processing steps read them one by one. Use this if `f_sym` is expensive to evaluate, as it is otherwise called several times (e.g., to determine `n`, to generate the derivative, and to generate the Jacobian). The file is deleted with the `jitcode` instance.
+	
+	couplings : list of tuples, each containing a SymPy function, a matrix, and optionally a list of components
+		Each coupling is a linear operator given by a (preferably sparse) matrix `A`, which is applied to the components of `y` given as the third element of the tuple (all components by default). The function denotes the result in `f_sym`, i.e., `coupling(i)` stands for :math:`\\sum_j A_{ij} y_{c_j}`, where :math:`c` are the components. The argument of the function must be an integer. In the generated code, the couplings are evaluated once per call as sparse matrix–vector products, and their contributions to the Jacobian are filled in directly from the sparsity structure of `A`, so they need not be expanded symbolically. Couplings can only be used in `f_sym` (not in helpers), and they are not supported by `jitcode_lyap`. See `couplings` for details.
 	"""
 	
 	# Naming convention:
 	# If an underscore-prefixed and regular variant of a function exist, the ormer calls the latter if needed and tells the user what it did.
 	
-	def __init__(self, f_sym, helpers=None, wants_jacobian=False, n=None, verbose=True):
-		self.f_sym, self.n = _handle_input(f_sym,n)
+	# The temporary directory is created by `_tmpfile` when first needed, which may happen before `__init__` (in `jitcode_lyap`).
+	_tmpdir = None
+	
+	def __init__(self, f_sym, helpers=None, wants_jacobian=False, n=None, verbose=True, cache_dir=None, control_pars=(), store_f_sym=False, couplings=()):
+		self.f_sym, self.n = _handle_input(f_sym, n, self._tmpfile("f_sym.pickle") if store_f_sym else None)
 		self.f = None
+		self.f_batch = None
 		self._f_C_source = False
 		self.helpers = _sort_helpers(_sympify_helpers(helpers or []))
 		self._wants_jacobian = wants_jacobian
 		self.jac_sym = None
 		self.jac = None
 		self._jac_C_source = False
+		self._jac_band = None
 		self._helper_C_source = False
 		self._y = []
-		self._tmpdir = None
 		self._modulename = "jitced"
+		self._module_folder = None
+		self.cache_dir = None
+		if cache_dir is not None:
+			# the lock files are placed in the cache directory, which thus has to exist
+			self.cache_dir = path.expanduser(cache_dir)
+			try:
+				if not path.isdir(self.cache_dir):
+					makedirs(self.cache_dir)
+			except OSError:
+				# another process may have created it in the meantime
+				if not path.isdir(self.cache_dir):
+					raise
+		self._generation_options = {}
+		self._symbolic_hash = None
+		self._chunk_files = {}
+		self._recorded_chunk_files = {}
 		self.verbose = verbose
 		self._number_of_jac_helpers = None
 		self._number_of_f_helpers = None
 		self._number_of_general_helpers = len(self.helpers)
+		self._tangent_dynamics = None
 		self.helper_subs = []
+		self.control_pars = list(control_pars)
+		self._control_par_subs, self._control_par_kinds = _control_par_substitutions(self.control_pars)
+		self._control_par_array_lengths = [0]*sum(self._control_par_kinds)
+		self._control_par_values = ()
+		self._slowest_simplifications = []
+		self.build_statistics = build_statistics()
+		self.couplings = list(couplings)
+		self._coupling_operator, self._coupling_ranges, self._coupling_subs = _coupling_operator(self.couplings, self.n)
+		self._coupling_jac = None
+		for helper in self.helpers:
+			if self._coupling_references(helper[1]):
+				raise ValueError("Couplings cannot be used in helpers.")
+	
+	def _basic_arguments(self):
+		arguments = [("Y", "double const *restrict const")]
+		if not all(self._control_par_kinds):
+			arguments.append(("control_pars", "double const *restrict const"))
+		if any(self._control_par_kinds):
+			arguments.append(("control_par_arrays", "double const *const *restrict const"))
+		if self.couplings:
+			arguments.append(("coupling_value", "double const *restrict const"))
+		return arguments
+	
+	def _coupling_references(self, expression):
+		# returns the row of the coupling operator and the function call for every coupling referenced in the expression
+		references = []
+		for function in expression.atoms(AppliedUndef):
+			if function.func in self._coupling_ranges:
+				offset, rows = self._coupling_ranges[function.func]
+				index = function.args[0]
+				if len(function.args) != 1 or not index.is_Integer:
+					raise ValueError("Couplings must be referenced with a single integer argument.")
+				if not 0 <= index < rows:
+					raise ValueError("Coupling %s has only %i rows." % (function.func, rows))
+				references.append(( offset+int(index), function ))
+		return sorted(references, key=lambda reference: reference[0])
+	
+	def _check_couplings(self, expressions):
+		for expression in expressions:
+			self._coupling_references(expression)
+			yield expression
+	
+	def _coupling_factors(self):
+		# yields the row of the Jacobian, the row of the coupling operator, and the partial derivative of the respective entry of f with respect to the value of the coupling
+		for i,entry in enumerate(self.f_sym()):
+			for row,function in self._coupling_references(entry):
+				factor = sympy.diff(entry, function)
+				if factor != 0:
+					yield i, row, factor
+	
+	def _coupling_columns(self, row):
+		operator = self._coupling_operator
+		return operator.indices[operator.indptr[row]:operator.indptr[row+1]]
+	
+	def _track_control_par_arrays(self, expressions):
+		# determines how many components of each control-parameter array are used in the generated code
+		expressions = self._counted(expressions)
+		if not any(self._control_par_kinds):
+			return expressions
+		
+		get_control_par_array = sympy.Function("control_par_array")
+		def tracked():
+			for expression in expressions:
+				for function in expression.atoms(AppliedUndef):
+					if function.func != get_control_par_array:
+						continue
+					k, index = function.args
+					if index.is_Integer:
+						self._control_par_array_lengths[int(k)] = max(self._control_par_array_lengths[int(k)], int(index)+1)
+				yield expression
+		return tracked()
+	
+	def _counted(self, expressions):
+		for expression in expressions:
+			self.build_statistics.add("expressions", 1)
+			yield expression
+	
+	def _timed(self, iterable, key):
+		# adds the time needed for producing each item of the iterable to the quantity `key` of the stage consuming it
+		iterator = iter(iterable)
+		while True:
+			start = time()
+			try:
+				item = next(iterator)
+			except StopIteration:
+				return
+			self.build_statistics.add(key, time()-start)
+			yield item
+	
+	def _record_code_size(self):
+		# adds the size of the code files written since the last call
+		for name,chunk_files in self._chunk_files.items():
+			if chunk_files is not self._recorded_chunk_files.get(name):
+				for filename in [name+".c"] + chunk_files:
+					self.build_statistics.add("code_size", path.getsize(self._tmpfile(filename)))
+				self.build_statistics.add("chunks", len(chunk_files))
+				self._recorded_chunk_files[name] = chunk_files
 	
 	def _tmpfile(self, filename=None):
 		if self._tmpdir is None:
@@ -227,42 +733,117 @@ class jitcode(ode):
 			return path.join(self._tmpdir, filename)
 	
 	def report(self, message):
+		logger.info(message)
 		if self.verbose:
 			print(message)
 	
-	def _generate_jac_sym(self):
+	def _generate_jac_sym(self, n_jobs=1):
 		if self.jac_sym is None:
-			self.generate_jac_sym()
+			self.generate_jac_sym(n_jobs=n_jobs)
 			#self.report("generated symbolic Jacobian")
 	
-	def generate_jac_sym(self, simplify=True):
+	@_recorded_stage("generate_jac_sym")
+	def generate_jac_sym(self, simplify=True, n_jobs=1, simplify_budget=None):
 		"""
-		generates the Jacobian using SymPy’s differentiation.
+		generates the Jacobian using SymPy’s differentiation. Only entries that are structurally non-zero (see `get_jac_sparsity`) are differentiated. Couplings (see `couplings`) are treated as constants here; their contributions are added when generating code.
 		
 		Parameters
 		----------
-		simplify : boolean
-			Whether the resulting Jacobian should be `simplified <http://docs.sympy.org/dev/modules/simplify/simplify.html>`_ (with `ratio=1.0`). This is almost always a good thing.
+		simplify : boolean or string
+			Whether and how the entries of the Jacobian should be simplified. This can be:
+			
+			* `"full"` or `True`: `sympy.simplify <http://docs.sympy.org/dev/modules/simplify/simplify.html>`_ with `ratio=1.0`. This is almost always a good thing.
+			* `"cheap"`: only cancelling common factors and combining powers, which is much faster.
+			* `"none"` or `False`: no simplification.
+		
+		simplify_budget : float or `None`
+			If not `None`, full simplification of any entry taking longer than this many seconds is aborted and the entry is simplified cheaply instead. The slowest entries are listed by `simplification_report`. This requires Unix.
+		
+		n_jobs : integer or `None`
+			Number of worker processes among which the lines of the Jacobian are distributed for differentiation and simplification. If `None`, all available cores are used. See `large_systems` for details.
 		"""
 		
-		self.jac_sym = _jac_from_f_with_helpers(self.f_sym, self.helpers, simplify, self.n)
+		self._record_options("jac_sym", jitcode.generate_jac_sym, simplify=simplify, simplify_budget=simplify_budget)
+		
+		# The differentiation happens lazily, i.e., mostly when generating code for the Jacobian.
+		self.jac_sym = self._timed(
+			_jac_from_f_with_helpers(
+				self.f_sym, self.helpers, simplify, self.n, n_jobs,
+				simplify_budget = simplify_budget,
+				record = self._record_simplification
+				),
+			"differentiation_time"
+			)
+	
+	def _record_simplification(self, entry, duration, fell_back):
+		self.build_statistics.add("simplification_time", duration)
+		if fell_back:
+			self.report("simplifying %s exceeded the time budget; simplified it cheaply instead" % entry)
+		item = (duration, entry, fell_back)
+		if len(self._slowest_simplifications) < 10:
+			heapq.heappush(self._slowest_simplifications, item)
+		else:
+			heapq.heappushpop(self._slowest_simplifications, item)
+	
+	def simplification_report(self):
+		"""
+		returns the (at most ten) entries whose simplification took longest so far, e.g., to find expensive equations or to choose `simplify_budget` for `generate_f_C` and `generate_jac_sym`.
+		
+		Returns
+		-------
+		slowest : list of tuples
+			Each tuple contains the time in seconds that the simplification took, a description of the entry (such as `"f[3]"` or `"Jacobian[2,5]"`), and whether the time budget was exceeded (and the entry was simplified cheaply instead). The list is sorted with the slowest entry first.
+		"""
+		
+		return sorted(self._slowest_simplifications, reverse=True)
+	
+	def get_jac_sparsity(self):
+		"""
+		determines which entries of the Jacobian are structurally non-zero, i.e., for which `i` and `j` the `i`-th component of `f_sym` depends on `y(j)`, directly, via helpers, or via couplings. This does not require any symbolic differentiation and is also what `generate_jac_sym` uses to avoid differentiating entries that are certainly zero. If an entry of `f_sym` (or a helper it depends on) contains `y` with a non-integer argument (e.g., in a `sympy.Sum`), the entire respective row is considered non-zero.
+		
+		Returns
+		-------
+		sparsity : `scipy.sparse.csr_matrix` with boolean entries and shape `(n,n)`
+			The `(i,j)`-th entry is `True` if the `(i,j)`-th entry of the Jacobian may be non-zero. Entries may still vanish after differentiation, e.g., if the respective dependency is linear with a vanishing coefficient.
+		"""
+		
+		sparsity = _jac_sparsity(self.f_sym, self.helpers, self.n)
+		if self.couplings:
+			rows = []
+			columns = []
+			for i,entry in enumerate(self.f_sym()):
+				for row,_ in self._coupling_references(entry):
+					coupled = self._coupling_columns(row)
+					rows.extend( [i]*len(coupled) )
+					columns.extend(coupled)
+			sparsity = sparsity + csr_matrix(
+				( np.ones(len(rows), dtype=bool), (rows, columns) ),
+				shape = (self.n,self.n)
+				)
+		return sparsity
 	
 	def _generate_f_C(self):
 		if not self._f_C_source:
 			self.generate_f_C()
 			self.report("generated C code for f")
 	
-	def generate_f_C(self, simplify=True, do_cse=False, chunk_size=100):
+	@_recorded_stage("generate_f_C")
+	def generate_f_C(self, simplify=True, do_cse=False, chunk_size=100, n_jobs=1, simplify_budget=None, motifs=False):
 		"""
 		translates the derivative to C code using SymPy’s `C-code printer <http://docs.sympy.org/dev/modules/printing.html#module-sympy.printing.ccode>`_.
 		
 		Parameters
 		----------
-		simplify : boolean
-			Whether the derivative should be `simplified <http://docs.sympy.org/dev/modules/simplify/simplify.html>`_ (with `ratio=1.0`) before translating to C code. The main reason why you could want to disable this is if your derivative is already  optimised and so large that simplifying takes a considerable amount of time.
+		simplify : boolean or string
+			Whether and how the derivative should be simplified before translating to C code: `"full"` or `True` for `sympy.simplify <http://docs.sympy.org/dev/modules/simplify/simplify.html>`_ (with `ratio=1.0`), `"cheap"` for only cancelling common factors and combining powers, and `"none"` or `False` for no simplification. The main reason why you could want to avoid full simplification is if your derivative is already optimised and so large that simplifying takes a considerable amount of time.
 		
-		do_cse : boolean
+		simplify_budget : float or `None`
+			If not `None`, full simplification of any entry taking longer than this many seconds is aborted and the entry is simplified cheaply instead. Use `simplification_report` to find the slowest entries. This requires Unix.
+		
+		do_cse : boolean or `"chunk"`
 			Whether SymPy’s `common-subexpression detection <http://docs.sympy.org/dev/modules/rewriting.html#module-sympy.simplify.cse_main>`_ should be applied before translating to C code. It is almost always better to let the compiler do this (unless you want to set the compiler optimisation to `-O2` or lower): For simple differential equations this should not make any difference to the compiler’s optimisations. For large ones, it may make a difference but also take long. As this requires all entries of `f` at once, it may void advantages gained from using generator functions as an input.
+			
+			If `"chunk"`, common subexpressions are only detected within each chunk (see `chunk_size`) and stored in local variables of the respective chunk function. This works with generator functions and only requires memory for one chunk at a time, but common subexpressions shared between chunks are not found. If no chunking happens, windows of 100 instructions are used instead.
 		
 		chunk_size : integer
 			If the number of instructions in the final C code exceeds this number, it will be split into chunks of this size. After the generation of each chunk, SymPy’s cache is cleared. See `large_systems` on why this is useful.
@@ -270,23 +851,50 @@ class jitcode(ode):
 			If there is an obvious grouping of your :math:`f`, the group size suggests itself for `chunk_size`. For example, if you want to simulate the dynamics of three-dimensional oscillators coupled onto a 40×40 lattice and if the differential equations are grouped first by oscillator and then by lattice row, a chunk size of 120 suggests itself.
 			
 			If smaller than 1, no chunking will happen.
-		"""
 		
-		self._generate_helpers_C()
+		n_jobs : integer or `None`
+			Number of worker processes among which simplifying and translating the entries of `f` to C code is distributed. If `None`, all available cores are used. The generated code does not depend on this. See `large_systems` for details.
 		
-		f_sym_wc = self.f_sym()
+		motifs : boolean
+			Whether entries of `f` that only differ in the indices of dynamical variables, helpers, and control parameters as well as in floating-point constants should be translated to one loop per such motif, which reads the indices and constants of each instance from a static table. For large networks of similar units, this drastically reduces the size of the C code and thus the compile time. On the downside, the compiler cannot exploit the specific values of the constants in the tables. See `large_systems` for details.
+		"""
 		
-		if simplify:
-			f_sym_wc = (sympy.simplify(entry,ratio=1) for entry in f_sym_wc)
+		self._record_options("f", jitcode.generate_f_C, simplify=simplify, do_cse=do_cse, chunk_size=chunk_size, simplify_budget=simplify_budget, motifs=motifs)
 		
-		if self.helpers:
-			f_sym_wc = (entry.subs(self.helper_subs) for entry in f_sym_wc)
+		self._generate_helpers_C()
 		
-		arguments = [("Y", "PyArrayObject *restrict const")]
+		f_sym_wc = self._f_entries_C()
+		if self.couplings:
+			f_sym_wc = self._check_couplings(f_sym_wc)
+		simplify = _simplification_strategy(simplify)
+		
+		if simplify or self.helpers or self.control_pars or self.couplings:
+			results = map_in_parallel(
+				partial(
+					_simplify_and_substitute,
+					simplify = simplify,
+					substitutions = self.helper_subs+self._control_par_subs+self._coupling_subs,
+					simplify_budget = simplify_budget
+					),
+				f_sym_wc,
+				n_jobs = n_jobs,
+				chunk_size = chunk_size if chunk_size>0 else 100
+				)
+			
+			def recorded():
+				for i,(entry,duration,fell_back) in enumerate(results):
+					if simplify:
+						self._record_simplification("f[%i]" % i, duration, fell_back)
+					yield entry
+			
+			f_sym_wc = recorded()
+		
+		arguments = self._basic_arguments()
 		if self._number_of_general_helpers:
 			arguments.append(("general_helper","double const *restrict const"))
 		
-		if do_cse:
+		chunk_cse = (do_cse == "chunk")
+		if do_cse and not chunk_cse:
 			get_helper = sympy.Function("get_f_helper")
 			set_helper = sympy.Function("set_f_helper")
 			
@@ -299,43 +907,54 @@ class jitcode(ode):
 			
 			if more_helpers:
 				arguments.append(("f_helper","double *restrict const"))
-				render_and_write_code(
-					(set_helper(i, helper[1]) for i,helper in enumerate(more_helpers)),
+				self._chunk_files["f_helpers"] = render_and_write_code(
+					self._track_control_par_arrays(set_helper(i, helper[1]) for i,helper in enumerate(more_helpers)),
 					self._tmpfile,
 					"f_helpers",
-					["y", "get_f_helper", "set_f_helper", "get_general_helper"],
+					["y", "get_f_helper", "set_f_helper", "get_general_helper", "control_par", "control_par_array", "get_coupling"],
 					chunk_size = chunk_size,
-					arguments = arguments
+					arguments = arguments,
+					n_jobs = n_jobs
 					)
 				self._number_of_f_helpers = len(more_helpers)
 		
 		set_dy = sympy.Function("set_dy")
-		render_and_write_code(
-			(set_dy(i,entry) for i,entry in enumerate(f_sym_wc)),
+		self._chunk_files["f"] = render_and_write_code(
+			self._track_control_par_arrays(set_dy(i,entry) for i,entry in enumerate(f_sym_wc)),
 			self._tmpfile,
 			"f",
-			["set_dy", "y", "get_f_helper", "get_general_helper"],
+			["set_dy", "y", "get_f_helper", "get_general_helper", "control_par", "control_par_array", "get_coupling"],
 			chunk_size = chunk_size,
-			arguments = arguments+[("dY", "PyArrayObject *restrict const")]
+			arguments = arguments+[("dY", "double *restrict const")],
+			n_jobs = n_jobs,
+			cse = chunk_cse,
+			motifs = motifs
 			)
 		
 		self._f_C_source = True
 	
+	def _f_entries_C(self):
+		# the entries of f that are translated to C code directly
+		return self.f_sym()
+	
 	def _generate_jac_C(self):
 		if self._wants_jacobian and not self._jac_C_source:
 			self.generate_jac_C()
 			self.report("generated C code for Jacobian")
 	
-	def generate_jac_C(self, do_cse=False, chunk_size=100, sparse=True):
+	@_recorded_stage("generate_jac_C")
+	def generate_jac_C(self, do_cse=False, chunk_size=100, sparse=True, banded=False, n_jobs=1, motifs=False):
 		"""
 		translates the symbolic Jacobian to C code using SymPy’s `C-code printer <http://docs.sympy.org/dev/modules/printing.html#module-sympy.printing.ccode>`_. If the symbolic Jacobian has not been generated, it generates it by calling `generate_jac_sym`.
 		
 		Parameters
 		----------
 		
-		do_cse : boolean
+		do_cse : boolean or `"chunk"`
 			Whether SymPy’s `common-subexpression detection <http://docs.sympy.org/dev/modules/rewriting.html#module-sympy.simplify.cse_main>`_ should be applied before translating to C code. It is almost always better to let the compiler do this (unless you want to set the compiler optimisation to `-O2` or lower): For simple differential equations this should not make any difference to the compiler’s optimisations. For large ones, it may make a difference but also take long. As this requires the entire Jacobian at once, it may void advantages gained from using generator functions as an input.
 			
+			If `"chunk"`, common subexpressions are only detected within each chunk (see `chunk_size`) and stored in local variables of the respective chunk function. This works with generator functions and only requires memory for one chunk at a time, but common subexpressions shared between chunks are not found. If no chunking happens, windows of 100 instructions are used instead.
+			
 		chunk_size : integer
 			If the number of instructions in the final C code exceeds this number, it will be split into chunks of this size. After the generation of each chunk, SymPy’s cache is cleared. See `large_systems` on why this is useful.
 			
@@ -345,67 +964,132 @@ class jitcode(ode):
 		
 		sparse : boolean
 			Whether a sparse Jacobian should be assumed for optimisation. Note that this does not mean that the Jacobian is stored, parsed or handled as a sparse matrix. This kind of optimisation would require SciPy’s ODE to be able to handle sparse matrices.
+		
+		banded : boolean or pair of integers
+			Whether the Jacobian should be returned in the compact banded storage used by the integrators `lsoda` and `vode`, i.e., as an array of shape `(lband+uband+1,n)` whose `(i-j+uband,j)`-th entry is the `(i,j)`-th entry of the Jacobian. If `True`, the lower and upper bandwidths `lband` and `uband` are determined from the non-zero entries of the symbolic Jacobian. Alternatively, you can specify them as a pair `(lband,uband)`, in which case an error is raised if the symbolic Jacobian has non-zero entries outside this band. For systems with a small bandwidth, such as chains and lattices, this considerably reduces the cost of evaluating the Jacobian and of the integrator’s linear algebra. `set_integrator` automatically passes the bandwidths to the integrator (unless you specify them yourself). The banded storage implies `sparse`.
+		
+		n_jobs : integer or `None`
+			Number of worker processes among which translating the Jacobian to C code (and generating the symbolic Jacobian, if this has not happened yet) is distributed. If `None`, all available cores are used. The generated code does not depend on this. See `large_systems` for details.
+		
+		motifs : boolean
+			Whether entries of the Jacobian that only differ in indices and floating-point constants should be translated to loops over static tables. See `generate_f_C` for details.
 		"""
 		
+		self._record_options("jac", jitcode.generate_jac_C, do_cse=do_cse, chunk_size=chunk_size, sparse=sparse, banded=banded, motifs=motifs)
+		
 		self._generate_helpers_C()
-		self._generate_jac_sym()
+		self._generate_jac_sym(n_jobs)
 		
-		jac_sym_wc = sympy.Matrix([ [entry.subs(self.helper_subs) for entry in line] for line in self.jac_sym ])
+		jac_sym_wc = (
+				[ (entry.subs(self.helper_subs+self._control_par_subs+self._coupling_subs) if entry!=0 else entry) for entry in line ]
+				for line in self.jac_sym
+			)
 		self.sparse_jac = sparse
 		
-		arguments = [("Y", "PyArrayObject *restrict const")]
+		arguments = self._basic_arguments()
 		if self._number_of_general_helpers:
 			arguments.append(("general_helper","double const *restrict const"))
 		
-		if do_cse:
+		chunk_cse = (do_cse == "chunk")
+		if do_cse and not chunk_cse:
 			get_helper = sympy.Function("get_jac_helper")
 			set_helper = sympy.Function("set_jac_helper")
 			
 			_cse = sympy.cse(
-					jac_sym_wc,
+					sympy.Matrix(list(jac_sym_wc)),
 					symbols = (get_helper(i) for i in count())
 				)
 			more_helpers = _cse[0]
-			jac_sym_wc = _cse[1][0]
+			jac_sym_wc = _cse[1][0].tolist()
 			
 			if more_helpers:
 				arguments.append(("jac_helper","double *restrict const"))
-				render_and_write_code(
-					(set_helper(i, helper[1]) for i,helper in enumerate(more_helpers)),
+				self._chunk_files["jac_helpers"] = render_and_write_code(
+					self._track_control_par_arrays(set_helper(i, helper[1]) for i,helper in enumerate(more_helpers)),
 					self._tmpfile,
 					"jac_helpers",
-					["y", "get_jac_helper", "set_jac_helper", "get_general_helper"],
+					["y", "get_jac_helper", "set_jac_helper", "get_general_helper", "control_par", "control_par_array", "get_coupling"],
 					chunk_size = chunk_size,
-					arguments = arguments
+					arguments = arguments,
+					n_jobs = n_jobs
 					)
 				self._number_of_jac_helpers = len(more_helpers)
 		
-		jac_sym_wc = jac_sym_wc.tolist()
-		
 		set_dfdy = sympy.Function("set_dfdy")
 		
-		render_and_write_code(
-			(
-				set_dfdy(i,j,entry)
-				for i,line in enumerate(jac_sym_wc)
-				for j,entry in enumerate(line)
-				if ( (entry != 0) or not self.sparse_jac )
-			),
+		if banded:
+			band = [0,0] if banded is True else list(banded)
+			if min(band)<0:
+				raise ValueError("Bandwidths must not be negative.")
+			self.sparse_jac = True
+		
+		def entries():
+			for i,line in enumerate(jac_sym_wc):
+				for j,entry in enumerate(line):
+					if entry != 0:
+						if banded is True:
+							band[0] = max(band[0],i-j)
+							band[1] = max(band[1],j-i)
+						elif banded and not (-band[1] <= i-j <= band[0]):
+							raise ValueError("The Jacobian has a non-zero entry outside of the specified band at (%i,%i)." % (i,j))
+						yield set_dfdy(i,j,entry)
+					elif not self.sparse_jac:
+						yield set_dfdy(i,j,entry)
+		
+		self._chunk_files["jac"] = render_and_write_code(
+			self._track_control_par_arrays(entries()),
 			self._tmpfile,
 			"jac",
-			["set_dfdy", "y", "get_jac_helper", "get_general_helper"],
+			["set_dfdy", "y", "get_jac_helper", "get_general_helper", "control_par", "control_par_array", "get_coupling"],
 			chunk_size = chunk_size,
-			arguments = arguments+[("dfdY", "PyArrayObject *restrict const")]
+			arguments = arguments+[("dfdY", "double *restrict const")],
+			n_jobs = n_jobs,
+			cse = chunk_cse,
+			motifs = motifs
 		)
 		
+		if self.couplings:
+			self._generate_coupling_jac_C(band if banded else None, banded, arguments, chunk_size, n_jobs)
+		
+		self._jac_band = tuple(band) if banded else None
 		self._jac_C_source = True
 	
+	def _generate_coupling_jac_C(self, band, banded, arguments, chunk_size, n_jobs):
+		# The contribution of the couplings to the Jacobian is the partial derivative of an entry of f with respect to the value of a coupling times the respective row of the coupling operator. Only these partial derivatives are translated to C code; they are applied to the rows of the coupling operator in a loop.
+		set_coupling_factor = sympy.Function("set_coupling_factor")
+		substitutions = self.helper_subs+self._control_par_subs+self._coupling_subs
+		rows = []
+		couplings = []
+		factors = []
+		for i,row,factor in self._coupling_factors():
+			for j in map(int,self._coupling_columns(row)):
+				if banded is True:
+					band[0] = max(band[0],i-j)
+					band[1] = max(band[1],j-i)
+				elif banded and not (-band[1] <= i-j <= band[0]):
+					raise ValueError("The Jacobian has a non-zero entry outside of the specified band at (%i,%i)." % (i,j))
+			rows.append(i)
+			couplings.append(row)
+			factors.append(set_coupling_factor(len(factors), factor.subs(substitutions)))
+		
+		self._chunk_files["coupling_factors"] = render_and_write_code(
+			self._track_control_par_arrays(factors),
+			self._tmpfile,
+			"coupling_factors",
+			["set_coupling_factor", "y", "get_general_helper", "control_par", "control_par_array", "get_coupling"],
+			chunk_size = chunk_size,
+			arguments = arguments+[("coupling_factor", "double *restrict const")],
+			n_jobs = n_jobs
+			)
+		self._coupling_jac = { "rows": rows, "couplings": couplings } if rows else None
+	
 	def _generate_helpers_C(self):
 		if self.helpers and not self._helper_C_source:
 			self.generate_helpers_C()
 			self.report("generated C code for helpers")
 	
-	def generate_helpers_C(self, chunk_size=100):
+	@_recorded_stage("generate_helpers_C")
+	def generate_helpers_C(self, chunk_size=100, n_jobs=1):
 		"""
 		translates the helpers to C code using SymPy’s `C-code printer <http://docs.sympy.org/dev/modules/printing.html#module-sympy.printing.ccode>`_.
 		
@@ -417,20 +1101,29 @@ class jitcode(ode):
 			If there is an obvious grouping of your helpers, the group size suggests itself for `chunk_size`.
 			
 			If smaller than 1, no chunking will happen.
+		
+		n_jobs : integer or `None`
+			Number of worker processes among which translating the helpers to C code is distributed. If `None`, all available cores are used. The generated code does not depend on this.
 		"""
 		
+		self._record_options("helpers", jitcode.generate_helpers_C, chunk_size=chunk_size)
+		
 		if self.helpers:
 			get_helper = sympy.Function("get_general_helper")
 			set_helper = sympy.Function("set_general_helper")
 			
 			self.helper_subs = [(helper[0],get_helper(i)) for i,helper in enumerate(self.helpers)]
-			render_and_write_code(
-				(set_helper(i, helper[1].subs(self.helper_subs)) for i,helper in enumerate(self.helpers)),
+			self._chunk_files["general_helpers"] = render_and_write_code(
+				self._track_control_par_arrays(
+					set_helper(i, helper[1].subs(self.helper_subs+self._control_par_subs))
+					for i,helper in enumerate(self.helpers)
+					),
 				self._tmpfile,
 				"general_helpers",
-				["y", "get_general_helper", "set_general_helper"],
+				["y", "get_general_helper", "set_general_helper", "control_par", "control_par_array"],
 				chunk_size = chunk_size,
-				arguments = [("Y", "PyArrayObject *restrict const"), ("general_helper","double *restrict const")]
+				arguments = self._basic_arguments() + [("general_helper","double *restrict const")],
+				n_jobs = n_jobs
 				)
 		
 		self._helper_C_source = True
@@ -444,7 +1137,11 @@ class jitcode(ode):
 		self,
 		extra_compile_args = DEFAULT_COMPILE_ARGS,
 		verbose = False,
-		modulename = None
+		modulename = None,
+		n_jobs = 1,
+		batch = False,
+		instrument = False,
+		native_integrator = True
 		):
 		"""
 		compiles the C code (using `Setuptools <http://pythonhosted.org/setuptools/>`_) and loads the compiled functions. If no C code exists, it is generated by calling `generate_f_C` and `generate_jac_C`.
@@ -457,18 +1154,125 @@ class jitcode(ode):
 			Whether the compiler commands shall be shown. This is the same as Setuptools’ `verbose` setting.
 		modulename : string or `None`
 			The name used for the compiled module. If `None` or empty, the filename will be chosen by JiTCODE based on previously used filenames or default to `jitced.so`. The only reason why you may want to change this is if you want to save the module file for later use (with`save_compiled`). It is not possible to re-use a modulename for a given instance of Python (due to the limitations of Python’s import machinery).
+		n_jobs : integer or `None`
+			If not 1, the chunks of the generated code (see `chunk_size` in `generate_f_C` and similar) are compiled as separate translation units by up to `n_jobs` parallel compiler processes (as many as there are cores, if `None`) and then linked into the module. This considerably reduces the time and memory needed for compiling very large differential equations, but the compiler cannot optimise across translation units. See `large_systems` for details.
+		batch : boolean or integer
+			Whether to additionally compile a function `f_batch`, which evaluates the derivative for many states at once and is then available as an attribute of this instance. See `ensembles` for details. If an integer, it specifies the number of states that are processed simultaneously (and should be a multiple of the number of doubles fitting into your processor’s vector registers); if `True`, this defaults to 8.
+		instrument : boolean or `"chunks"`
+			Whether the compiled module shall count the calls of the derivative and Jacobian as well as the time spent in them, which you can then obtain with `runtime_statistics`. If `"chunks"`, the calls of and time spent in every chunk function (see `chunk_size` in `generate_f_C` and similar) are recorded as well, which comes with a considerable overhead for small chunks. Without instrumentation, the compiled code contains nothing of this. See `profiling` for details.
+		native_integrator : boolean
+			Whether to compile the integrator `native_dopri5` (see `native_integrator`) into the module. If you do not use it, setting this to `False` slightly reduces the size of the module and the time needed to compile it.
 		
 		Notes
 		-----
 		If you want to change the compiler, the intended way is your operating system’s `CC` flag, e.g., by calling `export CC=clang` in the terminal or `os.environ["CC"] = "clang"` in Python.
+		
+		If `cache_dir` was specified on initialisation, the cache is searched first (see `caching`). In this case, `modulename` defaults to a name derived from the cache key.
 		"""
 		
+		batch_size = (8 if batch is True else int(batch)) if batch else 0
+		instrument = "chunks" if instrument=="chunks" else bool(instrument)
+		
+		if self.cache_dir is None:
+			self._build_module(extra_compile_args, verbose, modulename, n_jobs, batch_size, instrument, native_integrator)
+			self._load_module(self._tmpfile())
+		else:
+			key = self._cache_key(extra_compile_args, modulename, n_jobs, batch_size, instrument, native_integrator)
+			folder = path.join(self.cache_dir, key)
+			
+			loaded = None if modulename else modules.get("jitced_" + key[:16])
+			with locked(folder + ".lock"):
+				if path.isdir(folder):
+					self.report("found compiled module in cache")
+				elif loaded and path.isfile(loaded.__file__):
+					# same module was loaded from another cache directory
+					publish_atomically([loaded.__file__], folder)
+				else:
+					# If the other cache directory has been cleared since, the module is built again for this cache, but the loaded one is used.
+					self._build_module(extra_compile_args, verbose, modulename or "jitced_" + key[:16], n_jobs, batch_size, instrument, native_integrator, rebuild=bool(loaded))
+					modulefile = get_module_path(self._modulename, self._tmpfile())
+					publish_atomically([modulefile], folder)
+			
+			self._modulename = modulename or "jitced_" + key[:16]
+			self._load_module(folder)
+	
+	def _record_options(self, step, method, **arguments):
+		# stores the arguments of a code-generation step that differ from its defaults, so they become part of the cache key
+		argspec = getargspec(method.__wrapped__)
+		defaults = dict(zip(argspec.args[::-1], argspec.defaults[::-1]))
+		self._generation_options.pop(step, None)
+		options = sorted(
+				(name,value)
+				for name,value in arguments.items()
+				if value != defaults[name]
+			)
+		if options:
+			self._generation_options[step] = options
+	
+	def _symbolic_digest(self):
+		# Evaluating and serialising the entire symbolic input is expensive for large systems, but the input cannot change for a given instance.
+		if self._symbolic_hash is None:
+			hasher = sha256()
+			for item in self._symbolic_identity():
+				hasher.update((item+"\n").encode("utf-8"))
+			self._symbolic_hash = hasher.hexdigest()
+		return self._symbolic_hash
+	
+	def _symbolic_identity(self):
+		for entry in self.f_sym():
+			yield sympy.srepr(entry)
+		for helper in self.helpers:
+			yield sympy.srepr(helper[0]) + " = " + sympy.srepr(helper[1])
+	
+	def _cache_key(self, extra_compile_args, modulename, n_jobs=1, batch_size=0, instrument=False, native_integrator=True):
+		hasher = sha256()
+		def update(item):
+			hasher.update((str(item)+"\n").encode("utf-8"))
+		
+		for filename in ["jitced_template.c", "jitced_template.h"]:
+			with open(path.join(path.dirname(__file__), filename), "r") as template:
+				update(template.read())
+		
+		for item in [
+				version_info[:3],
+				sysconfig.get_config_var("EXT_SUFFIX") or sysconfig.get_config_var("SO"),
+				environ.get("CC", sysconfig.get_config_var("CC")),
+				np.__version__,
+				sympy.__version__,
+				modulename or "",
+				self.n,
+				self._wants_jacobian or self._jac_C_source,
+				self._jac_band,
+				n_jobs!=1,
+				batch_size,
+				instrument,
+				native_integrator,
+				sorted(self._generation_options.items()),
+				]:
+			update(item)
+		
+		for control_par in self.control_pars:
+			update(sympy.srepr(control_par))
+		
+		for coupling in self.couplings:
+			update(sympy.srepr(coupling[0]))
+		for array in [self._coupling_operator.indptr, self._coupling_operator.indices, self._coupling_operator.data]:
+			hasher.update(np.ascontiguousarray(array).tobytes())
+		
+		for arg in extra_compile_args:
+			update(arg)
+		
+		update(self._symbolic_digest())
+		
+		return hasher.hexdigest()
+	
+	def _build_module(self, extra_compile_args, verbose, modulename, n_jobs=1, batch_size=0, instrument=False, native_integrator=True, rebuild=False):
 		self._generate_helpers_C()
 		self._generate_f_C()
 		self._generate_jac_C()
 		
 		if modulename:
-			if modulename in modules.keys():
+			if modulename in modules.keys() and not rebuild:
 				raise NameError("Module name has already been used in this instance of Python.")
 			self._modulename = modulename
 		else:
@@ -481,6 +1285,28 @@ class jitcode(ode):
 		if path.isfile(modulefile):
 			raise OSError("Module file already exists.")
 		
+		with self.build_statistics.stage("compile_C"):
+			self._compile_module(sourcefile, extra_compile_args, verbose, n_jobs, batch_size, instrument, native_integrator)
+	
+	def _record_compilation(self, filename, duration):
+		self.build_statistics.add("units", {"file":filename, "compile_time":duration})
+	
+	def _compile_module(self, sourcefile, extra_compile_args, verbose, n_jobs, batch_size, instrument, native_integrator):
+		render_template(
+			"jitced_template.h",
+			self._tmpfile("jitced.h"),
+			n = self.n,
+			has_Jacobian = self._jac_C_source,
+			jac_band = self._jac_band,
+			tangent_dynamics = self._tangent_dynamics
+			)
+		
+		control_pars = []
+		for is_array in self._control_par_kinds:
+			k = sum( kind==is_array for kind,_,_ in control_pars )
+			length = self._control_par_array_lengths[k] if is_array else None
+			control_pars.append((is_array, k, length))
+		
 		render_template(
 			"jitced_template.c",
 			sourcefile,
@@ -491,14 +1317,47 @@ class jitcode(ode):
 			number_of_f_helpers = self._number_of_f_helpers or 0,
 			number_of_jac_helpers = self._number_of_jac_helpers or 0,
 			number_of_general_helpers = len(self.helpers),
-			sparse_jac = self.sparse_jac if self._jac_C_source else None
+			sparse_jac = self.sparse_jac if self._jac_C_source else None,
+			jac_band = self._jac_band,
+			separate_units = (n_jobs != 1),
+			fastcall = (version_info >= (3,7)),
+			batch_size = batch_size,
+			instrument = instrument,
+			native_integrator = native_integrator,
+			timed_chunks = self._timed_chunks() if instrument=="chunks" else [],
+			control_pars = control_pars,
+			number_of_control_pars = self._control_par_kinds.count(False),
+			number_of_control_par_arrays = self._control_par_kinds.count(True),
+			tangent_dynamics = self._tangent_dynamics,
+			couplings = self._coupling_tables(),
+			coupling_jac = self._coupling_jac if self._jac_C_source else None,
+			batch_functions = [
+					path.splitext(chunk_file)[0]
+					for name in ["general_helpers", "f_helpers", "f", "tangent_jac"]
+					for chunk_file in self._chunk_files.get(name,[])
+				]
 			)
+		self.build_statistics.add("code_size", path.getsize(sourcefile))
+		
+		objects = []
+		if n_jobs != 1:
+			objects = compile_in_parallel(
+				self._write_units(_UNITS_PER_JOB*(n_jobs or cpu_count())),
+				self._tmpfile(),
+				[ get_include(), sysconfig.get_paths()["include"], sysconfig.get_paths()["platinclude"] ],
+				extra_compile_args,
+				n_jobs = n_jobs,
+				verbose = verbose,
+				record = self._record_compilation
+				)
 		
+		start = time()
 		setup(
 			name = self._modulename,
 			ext_modules = [Extension(
 				self._modulename,
 				sources = [sourcefile],
+				extra_objects = objects,
 				extra_compile_args = ["-lm", "-I" + get_include()] + extra_compile_args
 				)],
 			script_args = [
@@ -510,68 +1369,205 @@ class jitcode(ode):
 				],
 			verbose = verbose
 			)
-		
-		self._jitced = find_and_load_module(self._modulename,self._tmpfile())
+		self._record_compilation(path.basename(sourcefile), time()-start)
+	
+	def _timed_chunks(self):
+		# the chunk functions called by f (and the Jacobian) with a unique index and whether they belong to the Jacobian
+		names = [ (name,False) for name in ["general_helpers", "f_helpers", "f", "tangent_jac"] ]
+		if self._jac_C_source:
+			names += [ (name,True) for name in ["jac_helpers", "jac", "coupling_factors"] ]
+		functions = [
+				(path.splitext(chunk_file)[0], jacobian)
+				for name,jacobian in names
+				for chunk_file in self._chunk_files.get(name,[])
+			]
+		return [
+				{"index": k, "name": name, "jacobian": jacobian}
+				for k,(name,jacobian) in enumerate(functions)
+			]
+	
+	def _coupling_tables(self):
+		# the coupling operator in CSR format, formatted for the template
+		if not self.couplings:
+			return None
+		operator = self._coupling_operator
+		return {
+				"rows": operator.shape[0],
+				"size": max(operator.nnz,1),
+				"indptr": ", ".join(map(str,operator.indptr)),
+				"columns": ", ".join(map(str,operator.indices)) or "0",
+				"data": ", ".join(map(repr,map(float,operator.data))) or "0.0",
+			}
+	
+	def _write_units(self, number):
+		names = ["general_helpers"] if self.helpers else []
+		if self._number_of_f_helpers:
+			names.append("f_helpers")
+		names.append("f")
+		if self._tangent_dynamics:
+			names.append("tangent_jac")
+		if self._jac_C_source:
+			if self._number_of_jac_helpers:
+				names.append("jac_helpers")
+			names.append("jac")
+			if self._coupling_jac:
+				names.append("coupling_factors")
+		
+		chunk_files = [ chunk_file for name in names for chunk_file in self._chunk_files.get(name,[]) ]
+		
+		units = []
+		for i,group in enumerate(split_evenly(chunk_files, number)):
+			unit = self._tmpfile("%s_unit_%i.c" % (self._modulename, i))
+			with open(unit, "w") as unitfile:
+				unitfile.write("# define NO_IMPORT_ARRAY\n")
+				unitfile.write("# include \"jitced.h\"\n")
+				for chunk_file in group:
+					unitfile.write("# include \"" + chunk_file + "\"\n")
+			units.append(unit)
+		return units
+	
+	@_recorded_stage("load")
+	def _load_module(self, folder):
+		loaded = modules.get(self._modulename)
+		if loaded and path.basename(path.dirname(loaded.__file__)) == path.basename(path.normpath(folder)):
+			self._jitced = loaded
+		else:
+			self._jitced = find_and_load_module(self._modulename, folder)
+		self._module_folder = folder
 		
 		self.f = self._jitced.f
-		if self._jac_C_source:
+		if hasattr(self._jitced, "jac"):
 			self.jac = self._jitced.jac
+		self.f_batch = getattr(self._jitced, "f_batch", None)
+	
+	def _instrumented_module(self):
+		if not hasattr(getattr(self, "_jitced", None), "stats"):
+			raise RuntimeError("No instrumented module was compiled. Use compile_C with instrument=True.")
+		return self._jitced
+	
+	def runtime_statistics(self):
+		"""
+		returns how often the compiled derivative and Jacobian were called and how much time was spent in them (since compiling or the last call of `reset_runtime_statistics`). This requires that the module was compiled with `instrument` (see `compile_C`). Evaluations by SciPy’s integrators and by `native_dopri5` are counted alike.
+		
+		Returns
+		-------
+		statistics : dictionary
+			For each of `"f"`, `"jac"` (if compiled), and `"f_batch"` (if compiled), a dictionary with the number of `"calls"` and the total `"time"` in seconds. If compiled with `instrument="chunks"`, the entry `"chunks"` contains such a dictionary for every chunk function, e.g., `"definitions_f_3"`. Calls of chunk functions by `f_batch` are not recorded.
+		"""
+		
+		return self._instrumented_module().stats()
+	
+	def reset_runtime_statistics(self):
+		"""
+		resets all counters of `runtime_statistics` to zero.
+		"""
+		
+		self._instrumented_module().reset_stats()
 	
 	def _generate_f_lambda(self):
 		if not _is_lambda(self.f):
 			self.generate_f_lambda()
 			self.report("generated lambdified f")
 	
-	def generate_f_lambda(self, simplify=True):
+	def generate_f_lambda(self, simplify=True, do_cse=True):
 		"""
-		translates the symbolic derivative to a function using SymPy’s `lambdify <http://docs.sympy.org/latest/modules/utilities/lambdify.html>`_ tool.
+		translates the derivative to a Python function using NumPy operations, which is a fallback if compiling fails. Helpers are evaluated only once per call. The function takes the state as a NumPy array and can write the result to an array passed as `out`. If the state has more than one dimension, all operations are applied along the additional dimensions, e.g., `f(t,Y)` evaluates the derivative for every column of `Y`.
 		
 		Parameters
 		----------
-		simplify : boolean
-			Whether the derivative should be `simplified <http://docs.sympy.org/dev/modules/simplify/simplify.html>`_ (with `ratio=1.0`) before translating to C code. The main reason why you could want to disable this is if your derivative is already optimised and so large that simplifying takes a considerable amount of time.
-		"""
+		simplify : boolean or string
+			Whether and how the derivative should be simplified before translating to Python code (see `generate_f_C`). The main reason why you could want to avoid full simplification is if your derivative is already optimised and so large that simplifying takes a considerable amount of time.
 		
-		if self.helpers:
-			warn("Lambdification does not handle helpers in an efficient manner.")
-		
-		t,y = provide_basic_symbols()
-		Y = sympy.symarray("Y", self.n)
+		do_cse : boolean
+			Whether SymPy’s `common-subexpression detection <http://docs.sympy.org/dev/modules/rewriting.html#module-sympy.simplify.cse_main>`_ should be applied, so that common subexpressions are evaluated only once. Unlike for C code, there is no compiler to do this otherwise.
+		"""
 		
-		substitutions = self.helpers[::-1] + [(y(i),Y[i]) for i in range(self.n)]
-		f_sym_wc = (entry.subs(substitutions) for entry in self.f_sym())
+		substitutions, parameters, helpers = self._lambda_substitutions()
+		f_sym_wc = (self._expand_couplings(entry).subs(substitutions) for entry in self.f_sym())
+		simplify = _simplification_strategy(simplify)
 		if simplify:
-			f_sym_wc = (entry.simplify(ratio=1.0) for entry in f_sym_wc)
-		F = sympy.lambdify([t]+[Yentry for Yentry in Y], list(f_sym_wc))
+			f_sym_wc = (_simplify(entry, simplify)[0] for entry in f_sym_wc)
 		
-		self.f = lambda t,ypsilon: array(F(t,*ypsilon)).flatten()
+		self.f = numpy_function(
+				"f", parameters, helpers,
+				[ ((i,),entry) for i,entry in enumerate(f_sym_wc) ],
+				shape = (self.n,),
+				do_cse = do_cse
+			)
 	
 	def _generate_jac_lambda(self):
 		if not _is_lambda(self.jac):
 			self.generate_jac_lambda()
 			self.report("generated lambdified Jacobian")
 	
-	def generate_jac_lambda(self):
-		"""
-		translates the symbolic Jacobian to a function using SymPy’s `lambdify <http://docs.sympy.org/latest/modules/utilities/lambdify.html>`_ tool. If the symbolic Jacobian has not been generated, it is generated by calling `generate_jac_sym`.
+	def generate_jac_lambda(self, do_cse=True):
 		"""
+		translates the symbolic Jacobian to a Python function using NumPy operations, like `generate_f_lambda`. Only non-zero entries are evaluated. If the symbolic Jacobian has not been generated, it is generated by calling `generate_jac_sym`.
 		
-		if self.helpers:
-			warn("Lambdification handles helpers by pluggin them in. This may be very ineficient")
+		Parameters
+		----------
+		do_cse : boolean
+			Whether SymPy’s `common-subexpression detection <http://docs.sympy.org/dev/modules/rewriting.html#module-sympy.simplify.cse_main>`_ should be applied, so that common subexpressions are evaluated only once.
+		"""
 		
 		self._generate_jac_sym()
 		
-		jac_matrix = sympy.Matrix([ [entry for entry in line] for line in self.jac_sym ])
-		
+		substitutions, parameters, helpers = self._lambda_substitutions()
+		assignments = []
+		for i,line in enumerate(self.jac_sym):
+			for j,entry in enumerate(line):
+				if entry != 0:
+					assignments.append(( (i,j), self._expand_couplings(entry).subs(substitutions) ))
+		
+		if self.couplings:
+			entries = dict(assignments)
+			operator = self._coupling_operator
+			for i,row,factor in self._coupling_factors():
+				factor = self._expand_couplings(factor).subs(substitutions)
+				for p in range(operator.indptr[row],operator.indptr[row+1]):
+					j = int(operator.indices[p])
+					entries[i,j] = entries.get((i,j),sympy.S.Zero) + factor*float(operator.data[p])
+			assignments = sorted(entries.items())
+		
+		shape = (self.n,self.n)
+		if self._jac_band:
+			lband, uband = self._jac_band
+			assignments = [ ((i-j+uband,j),entry) for (i,j),entry in assignments if -lband<=j-i<=uband ]
+			shape = (lband+uband+1,self.n)
+		
+		self.jac = numpy_function("jac", parameters, helpers, assignments, shape, zeros=True, do_cse=do_cse)
+	
+	def _expand_couplings(self, expression):
+		# replaces couplings by the explicit sums they stand for
 		t,y = provide_basic_symbols()
-		Y = sympy.symarray("Y", self.n)
-		
-		substitutions = self.helpers[::-1] + [(y(i),Y[i]) for i in range(self.n)]
-		jac_subsed = jac_matrix.subs(substitutions)
-		JAC = sympy.lambdify([t]+[Yentry for Yentry in Y], jac_subsed)
-		
-		self.jac = lambda t,ypsilon: array(JAC(t,*ypsilon))
-
+		operator = self._coupling_operator
+		for row,function in self._coupling_references(expression):
+			explicit = sum(
+					float(operator.data[p])*y(int(operator.indices[p]))
+					for p in range(operator.indptr[row],operator.indptr[row+1])
+				)
+			expression = expression.subs(function, explicit)
+		return expression
+	
+	def _lambda_substitutions(self):
+		# Returns the substitutions, parameters, and helpers for `numpy_function`: The state and arrays of control parameters are represented by indexed objects, scalar control parameters are renamed to avoid clashes.
+		t,y = provide_basic_symbols()
+		index = sympy.Dummy("index")
+		Y = sympy.IndexedBase("y")
+		substitutions = [(y, sympy.Lambda(index,Y[index]))]
+		parameters = [t,Y]
+		for i,control_par in enumerate(self.control_pars):
+			if self._control_par_kinds[i]:
+				symbol = sympy.IndexedBase("control_par_array_%i" % i)
+				substitutions.append(( control_par, sympy.Lambda(index,symbol[index]) ))
+			else:
+				symbol = sympy.Symbol("control_par_%i" % i)
+				substitutions.append(( control_par, symbol ))
+			parameters.append(symbol)
+		
+		helpers = [ (helper[0], helper[1].subs(substitutions)) for helper in self.helpers ]
+		return substitutions, parameters, helpers
+	
 	def generate_lambdas(self):
 		"""
 		If they do not already exists, this generates lambdified functions by calling `self.generate_f_lambda()` and, if wanted, `generate_jac_lambda()`.
@@ -622,6 +1618,10 @@ class jitcode(ode):
 		self._wants_jacobian |= _can_use_jacobian(name)
 		self._generate_functions()
 		
+		if self._jac_band and name in ["lsoda", "vode"]:
+			integrator_params.setdefault("lband", self._jac_band[0])
+			integrator_params.setdefault("uband", self._jac_band[1])
+		
 		try:
 			save_y = self._y
 			save_t = self.t
@@ -633,13 +1633,73 @@ class jitcode(ode):
 			super(jitcode, self).set_integrator(name, **integrator_params)
 			super(jitcode, self).set_initial_value(save_y, save_t)
 		
+		if self._control_par_values:
+			self.set_parameters(*self._control_par_values)
+		
 		return self
 
+	def integrate_grid(self, times, out=None):
+		"""
+		integrates the differential equation from the current time over a whole sorted grid of times and returns the states at these times. This is equivalent to calling `integrate` for every time and stacking the results, but avoids the respective overhead. With the integrator `native_dopri5`, the entire grid is handled in compiled code.
+		
+		Parameters
+		----------
+		times : one-dimensional array of floats
+			The times at which the state shall be recorded. These must be sorted.
+		out : two-dimensional NumPy array or `None`
+			Array of shape `(len(times),n)` into which the states are written. If `None`, a new array is created.
+		
+		Returns
+		-------
+		states : two-dimensional NumPy array
+			The `i`-th row is the state at `times[i]`. This is `out`, if it was specified. If the integration fails (e.g., because the maximum number of steps was exceeded), the rows from the time at which it failed on are `nan`, and `successful` returns `False`.
+		"""
+		
+		times, out = _prepare_grid(times, out, self.n)
+		
+		if isinstance(self._integrator, native_dopri5):
+			target = out if out.flags.c_contiguous else np.empty(out.shape)
+			self._y, self.t = self._integrator.run_grid(self.f, self._y, self.t, times, target, self.f_params)
+			out[:] = target
+		else:
+			for i,target_time in enumerate(times):
+				# some integrators fail when asked to integrate to the current time
+				out[i] = self._y if target_time==self.t else self.integrate(target_time)
+				if not self.successful():
+					# like native_dopri5
+					out[i:] = np.nan
+					break
+		
+		return out
+	
+	def set_parameters(self, *args):
+		"""
+		sets the values of the control parameters (see `control_pars`) for the derivative and the Jacobian alike, in the order in which the control parameters were specified on initialisation. Array-valued control parameters must be one-dimensional arrays (or other sequences) of floats; if they are contiguous NumPy arrays of doubles, they are used directly without copying, so changing their contents affects subsequent calls of the derivative. `set_f_params` and `set_jac_params` are aliases of this.
+		"""
+		
+		if len(args) != len(self.control_pars):
+			raise ValueError("Number of parameters (%i) does not match number of control parameters (%i)." % (len(args), len(self.control_pars)))
+		
+		args = tuple(
+			np.ascontiguousarray(arg, dtype=float) if is_array else float(arg)
+			for arg,is_array in zip(args, self._control_par_kinds)
+			)
+		self._control_par_values = args
+		self.f_params = args
+		self.jac_params = args
+		return self
+	
 	def set_f_params(self, *args):
-		raise NotImplementedError("JiTCODE does not support passing parameters to the derivative yet.")
+		"""
+		Same as `set_parameters`.
+		"""
+		return self.set_parameters(*args)
 	
 	def set_jac_params(self, *args):
-		raise NotImplementedError("JiTCODE does not support passing parameters to the Jacobian yet.")
+		"""
+		Same as `set_parameters`.
+		"""
+		return self.set_parameters(*args)
 	
 	def save_compiled(self, destination="", overwrite=False):
 		"""
@@ -661,10 +1721,10 @@ class jitcode(ode):
 			if modulename != self._modulename:
 				self.compile_C(modulename=modulename)
 				self.report("compiled C code")
-			sourcefile = get_module_path(self._modulename, self._tmpfile())
+			sourcefile = get_module_path(self._modulename, self._module_folder)
 		else:
 			self._compile_C()
-			sourcefile = get_module_path(self._modulename, self._tmpfile())
+			sourcefile = get_module_path(self._modulename, self._module_folder)
 			destination = path.join(folder, ensure_suffix(self._modulename, ".so"))
 			self.report("saving file to " + destination)
 		
@@ -687,10 +1747,18 @@ class jitcode_lyap(jitcode):
 	----------
 	n_lyap : integer
 		Number of Lyapunov exponents to calculate. If negative or larger than the dimension of the system, all Lyapunov exponents are calculated.
+	
+	store_f_sym : boolean
+		Like for `jitcode`; this applies to `f_sym` as given (and not to the tangent dynamics derived from it).
+	
+	Notes
+	-----
+	The compiled derivative (see `generate_f_C`) and the lambdified one (see `generate_f_lambda`) are generated from the derivative of the original system and the non-zero entries of its Jacobian only, so their cost does not depend on the number of Lyapunov exponents. Everything else that uses the derivative of the full system including the tangent vectors (`f_sym`), in particular the Jacobian of the full system (`generate_jac_sym`, needed if `wants_jacobian`) and `get_jac_sparsity`, processes :math:`n·n_\text{lyap}` symbolic sums of up to :math:`n` terms each.
 	"""
 	
-	def __init__(self, f_sym, helpers=None, wants_jacobian=False, n=None, n_lyap=-1):
-		f_basic, n = _handle_input(f_sym,n)
+	def __init__(self, f_sym, helpers=None, wants_jacobian=False, n=None, n_lyap=-1, cache_dir=None, control_pars=(), store_f_sym=False):
+		f_basic, n = _handle_input(f_sym, n, self._tmpfile("f_sym.pickle") if store_f_sym else None)
+		self._f_basic = f_basic
 		self.n_basic = n
 		self._n_lyap = n if (n_lyap<0 or n_lyap>n) else n_lyap
 		
@@ -703,16 +1771,124 @@ class jitcode_lyap(jitcode):
 			for entry in f_basic():
 				yield entry
 			
+			jac_lines = list(_jac_from_f_with_helpers(f_basic, helpers, False, n))
 			for i in range(self._n_lyap):
-				for line in _jac_from_f_with_helpers(f_basic, helpers, False, n):
-					yield sympy.simplify( sum( entry * y(k+(i+1)*n) for k,entry in enumerate(line) ), ratio=1.0 )
+				for line in jac_lines:
+					yield sympy.Add(*[ entry * y(k+(i+1)*n) for k,entry in enumerate(line) if entry!=0 ])
 		
 		super(jitcode_lyap, self).__init__(
 			f_lyap,
 			helpers = helpers,
 			wants_jacobian = wants_jacobian,
-			n = self.n_basic*(self._n_lyap+1)
+			n = self.n_basic*(self._n_lyap+1),
+			cache_dir = cache_dir,
+			control_pars = control_pars
+			)
+	
+	def _f_entries_C(self):
+		return self._f_basic()
+	
+	@_recorded_stage("generate_f_C")
+	def generate_f_C(self, simplify=True, do_cse=False, chunk_size=100, n_jobs=1, simplify_budget=None, motifs=False):
+		"""
+		Like `jitcode.generate_f_C`, except that only the derivative of the original system is translated entry by entry. For the tangent dynamics, only the non-zero entries of the Jacobian of the original system are translated, and the generated code applies them to all tangent vectors in a loop. Thus the size of the code and the time needed to generate it do not depend on the number of Lyapunov exponents.
+		"""
+		
+		super(jitcode_lyap, self).generate_f_C(simplify=simplify, do_cse=do_cse, chunk_size=chunk_size, n_jobs=n_jobs, simplify_budget=simplify_budget, motifs=motifs)
+		
+		rows, columns, entries = self._tangent_jac_entries(simplify, n_jobs, simplify_budget)
+		
+		substitutions = self.helper_subs + self._control_par_subs
+		set_tangent_jac = sympy.Function("set_tangent_jac")
+		arguments = self._basic_arguments()
+		if self._number_of_general_helpers:
+			arguments.append(("general_helper","double const *restrict const"))
+		
+		self._chunk_files["tangent_jac"] = render_and_write_code(
+			self._track_control_par_arrays(
+				set_tangent_jac(k, entry.subs(substitutions) if substitutions else entry)
+				for k,entry in enumerate(entries)
+				),
+			self._tmpfile,
+			"tangent_jac",
+			["set_tangent_jac", "y", "get_general_helper", "control_par", "control_par_array"],
+			chunk_size = chunk_size,
+			arguments = arguments+[("tangent_jac", "double *restrict const")],
+			n_jobs = n_jobs,
+			cse = (do_cse == "chunk"),
+			motifs = motifs
+			)
+		
+		self._tangent_dynamics = {
+				"n_basic": self.n_basic,
+				"rows": rows,
+				"columns": columns,
+			}
+	
+	def _tangent_jac_entries(self, simplify, n_jobs=1, simplify_budget=None):
+		# returns the rows, columns, and values of the non-zero entries of the Jacobian of the original system
+		rows = []
+		columns = []
+		entries = []
+		jac_lines = _jac_from_f_with_helpers(
+				self._f_basic, self.helpers, simplify, self.n_basic, n_jobs,
+				simplify_budget = simplify_budget,
+				record = self._record_simplification
+			)
+		for i,line in enumerate(jac_lines):
+			for j,entry in enumerate(line):
+				if entry != 0:
+					rows.append(i)
+					columns.append(j)
+					entries.append(entry)
+		return rows, columns, entries
+	
+	def generate_f_lambda(self, simplify=True, do_cse=True):
+		"""
+		Like `jitcode.generate_f_lambda`, except that, like for `generate_f_C`, only the derivative of the original system and the non-zero entries of its Jacobian are translated. The resulting function applies the latter to all tangent vectors with a single NumPy product, so the size of the code and the time needed to generate it do not depend on the number of Lyapunov exponents.
+		"""
+		
+		substitutions, parameters, helpers = self._lambda_substitutions()
+		f_basic_wc = (entry.subs(substitutions) for entry in self._f_basic())
+		strategy = _simplification_strategy(simplify)
+		if strategy:
+			f_basic_wc = (_simplify(entry, strategy)[0] for entry in f_basic_wc)
+		f_basic = numpy_function(
+				"f_basic", parameters, helpers,
+				[ ((i,),entry) for i,entry in enumerate(f_basic_wc) ],
+				shape = (self.n_basic,),
+				do_cse = do_cse
 			)
+		
+		rows, columns, entries = self._tangent_jac_entries(simplify)
+		tangent_jac = numpy_function(
+				"tangent_jac", parameters, helpers,
+				[ ((k,),entry.subs(substitutions)) for k,entry in enumerate(entries) ],
+				shape = (len(entries),),
+				do_cse = do_cse
+			)
+		
+		n, n_lyap = self.n_basic, self._n_lyap
+		def f(*args, **kwargs):
+			Y = np.asarray(args[1])
+			out = kwargs.get("out")
+			if out is None:
+				out = np.empty(Y.shape)
+			f_basic(*args, out=out[:n])
+			jac = np.zeros((n,n)+Y.shape[1:])
+			jac[rows,columns] = tangent_jac(*args)
+			tangent_vectors = Y[n:].reshape((n_lyap,n)+Y.shape[1:])
+			out[n:] = np.einsum("ij...,lj...->li...", jac, tangent_vectors).reshape((n_lyap*n,)+Y.shape[1:])
+			return out
+		
+		self.f = f
+	
+	def _symbolic_identity(self):
+		yield "Lyapunov exponents: %i" % self._n_lyap
+		for entry in self._f_basic():
+			yield sympy.srepr(entry)
+		for helper in self.helpers:
+			yield sympy.srepr(helper[0]) + " = " + sympy.srepr(helper[1])
 	
 	def set_initial_value(self, y, t=0.0):
 		new_y = [y]
@@ -721,9 +1897,34 @@ class jitcode_lyap(jitcode):
 		
 		super(jitcode_lyap, self).set_initial_value(hstack(new_y), t)
 	
+	def _renormalise(self):
+		n = self.n_basic
+		tangent_vectors = self._y[n:].reshape(self._n_lyap,n)
+		
+		columns = _nordsieck_columns(self._integrator)
+		if columns and len(self._integrator.rwork) < 20+columns*self.n:
+			# The work array does not have the expected layout; so the integrator is restarted instead.
+			columns = None
+		if columns:
+			# The tangent dynamics are linear; so the integrator’s history can be subjected to the same linear transformation as the tangent vectors.
+			history = self._integrator.rwork[20:20+columns*self.n].reshape(columns,self._n_lyap+1,n)[:,1:]
+			norms = orthonormalise_qr(tangent_vectors, [history])
+		else:
+			norms = orthonormalise_qr(tangent_vectors)
+		
+		if not np.all(np.isfinite(norms)):
+			warn("Norms of perturbation vectors for Lyapunov exponents out of numerical bounds. You probably waited too long before renormalising and should call integrate with smaller intervals between steps (as renormalisations happen once with every call of integrate).")
+		
+		if columns is None or not np.all(np.isfinite(norms)) or not np.all(norms>0):
+			super(jitcode_lyap, self).set_initial_value(self._y, self.t)
+		
+		return norms
+	
 	def integrate(self, *args, **kwargs):
 		"""
-		Like SciPy’s ODE’s `integrate`, except for orthonormalising the tangent vectors and:
+		Like SciPy’s ODE’s `integrate`, except for orthonormalising the tangent vectors and the return value (see below).
+		
+		The orthonormalisation happens in place, i.e., the integrator is not restarted and keeps its step size. For `lsoda` and `vode`, the stored history of the tangent vectors is subjected to the same linear transformation, so the order and history are retained as well. Other integrators (except `dopri5`, `dop853`, and `native_dopri5`, which do not keep any history) are restarted after every orthonormalisation.
 		
 		Returns
 		-------
@@ -736,17 +1937,140 @@ class jitcode_lyap(jitcode):
 		super(jitcode_lyap, self).integrate(*args, **kwargs)
 		delta_t = self.t-old_t
 		
-		n = self.n_basic
-		tangent_vectors = [ self._y[(i+1)*n:(i+2)*n] for i in range(self._n_lyap) ]
-		norms = orthonormalise(tangent_vectors)
-		if not np.all(np.isfinite(norms)):
-			warn("Norms of perturbation vectors for Lyapunov exponents out of numerical bounds. You probably waited too long before renormalising and should call integrate with smaller intervals between steps (as renormalisations happen once with every call of integrate).")
+		lyaps = log(self._renormalise()) / delta_t
+		
+		return hstack((self._y[:self.n_basic], lyaps))
+	
+	def integrate_grid(self, times, out=None):
+		"""
+		Like `jitcode.integrate_grid`, except that the tangent vectors are orthonormalised at each time of the grid and:
+		
+		Returns
+		-------
+		states : two-dimensional NumPy array
+			The `i`-th row is the state of the system (without tangent vectors) at `times[i]`. This is `out` (whose shape must be `(len(times),len(f_sym))`), if it was specified.
+		lyaps : two-dimensional NumPy array
+			The `i`-th row contains the local Lyapunov exponents estimated from the integration from the previous time in the grid (or the current time for the first row) to `times[i]` (see `integrate`). If `times[0]` is the current time, the first row is `nan`.
+		"""
+		
+		times, out = _prepare_grid(times, out, self.n_basic)
+		lyaps = np.empty((len(times),self._n_lyap))
+		
+		for i,target_time in enumerate(times):
+			if target_time==self.t:
+				out[i] = self._y[:self.n_basic]
+				lyaps[i] = np.nan
+			else:
+				result = self.integrate(target_time)
+				out[i] = result[:self.n_basic]
+				lyaps[i] = result[self.n_basic:]
+			if not self.successful():
+				out[i:] = np.nan
+				lyaps[i:] = np.nan
+				break
 		
-		lyaps = log(norms) / delta_t
+		return out, lyaps
+	
+	def _lyap_sums(self, duration, interval, log_growth):
+		sums = np.zeros((2,self._n_lyap))
+		t_end = self.t + duration
+		
+		if isinstance(self._integrator, native_dopri5):
+			self._y, self.t, interval, renormalisations = self._integrator.run_lyap(
+					self.f, self._y, self.t, t_end,
+					interval, log_growth, sums, self.f_params
+				)
+			return sums, interval, renormalisations
+		
+		renormalisations = 0
+		while self.t < t_end:
+			t_start = self.t
+			super(jitcode_lyap, self).integrate(min(self.t+interval,t_end))
+			delta_t = self.t-t_start
+			if not (self.successful() and delta_t>0):
+				break
+			log_norms = log(self._renormalise())
+			renormalisations += 1
+			
+			sums[0] += log_norms
+			sums[1] += log_norms**2/delta_t
+			if log_growth>0:
+				largest = np.max(np.abs(log_norms))
+				interval = delta_t * ( min(2.0, max(0.5, log_growth/largest)) if largest>0 else 2.0 )
+		
+		return sums, interval, renormalisations
+	
+	def integrate_lyap(self, T, renorm_interval=1.0, transient=0.0, max_growth=None, statistics=False):
+		"""
+		integrates the system for the time `T` (after an optional transient) and returns the Lyapunov exponents estimated from this time. The tangent vectors are renormalised at regular intervals in between, and the logarithms of their norms are summed up, so you do not need to call `integrate` at small intervals and average the local Lyapunov exponents yourself. With the integrator `native_dopri5`, all of this happens in compiled code; otherwise the renormalisations happen in place like with `integrate`.
+		
+		Parameters
+		----------
+		T : positive float
+			The integration time from which the Lyapunov exponents are estimated.
+		renorm_interval : positive float
+			The (initial) time between renormalisations.
+		transient : non-negative float
+			The time to integrate before `T` (with renormalisations) without estimating the Lyapunov exponents, e.g., to let the tangent vectors align.
+		max_growth : float larger than 1 or `None`
+			If not `None`, the time between renormalisations is adapted such that the norm of no tangent vector grows or shrinks by much more than this factor between renormalisations.
+		statistics : boolean
+			Whether to also return statistics (see below).
 		
-		super(jitcode_lyap, self).set_initial_value(self._y, self.t)
+		Returns
+		-------
+		lyaps : one-dimensional NumPy array
+			The Lyapunov exponents, i.e., the sums of the logarithms of the norms divided by `T`. If the integration stopped prematurely (e.g., because the maximum number of steps `nsteps` of the integrator was exceeded within one renormalisation interval), these are `nan`, a warning is issued, and `successful` returns `False`.
+		stats : dictionary
+			Only returned if `statistics` is `True`. Contains:
+			
+			* `"standard_deviation"`: the standard deviation of the local Lyapunov exponents of all renormalisation intervals, weighted with the length of the intervals,
+			* `"standard_error"`: the standard error of `lyaps` assuming that the local Lyapunov exponents of different intervals are independent,
+			* `"renormalisations"`: the number of renormalisations during `T`,
+			* `"renorm_interval"`: the last time between renormalisations (which may have been adapted; use this as `renorm_interval` for continuing the integration).
+		"""
 		
-		return hstack((self._y[:n], lyaps))
+		if not T>0:
+			raise ValueError("Integration time must be positive.")
+		if not renorm_interval>0:
+			raise ValueError("Renormalisation interval must be positive.")
+		if transient<0:
+			raise ValueError("Transient must not be negative.")
+		if (max_growth is not None) and not max_growth>1:
+			raise ValueError("max_growth must be larger than 1.")
+		
+		log_growth = log(max_growth) if max_growth else 0.0
+		interval = float(renorm_interval)
+		
+		t_end = self.t + transient + T
+		if transient>0:
+			_, interval, _ = self._lyap_sums(transient, interval, log_growth)
+		
+		t_start = self.t
+		if self.successful():
+			sums, interval, renormalisations = self._lyap_sums(T, interval, log_growth)
+		else:
+			sums, renormalisations = np.zeros((2,self._n_lyap)), 0
+		duration = self.t-t_start
+		
+		if self.t<t_end or not renormalisations:
+			warn("integrate_lyap: The integration stopped at t=%g instead of %g, e.g., because the maximum number of steps was exceeded. The Lyapunov exponents are not available." % (self.t,t_end))
+			lyaps = np.full(self._n_lyap, np.nan)
+			standard_deviation = np.full(self._n_lyap, np.nan)
+		else:
+			lyaps = sums[0] / duration
+			standard_deviation = np.sqrt(np.maximum( sums[1]/duration - lyaps**2, 0.0 ))
+		
+		if statistics:
+			stats = {
+					"standard_deviation": standard_deviation,
+					"standard_error": standard_deviation / np.sqrt(max(renormalisations-1,1)),
+					"renormalisations": renormalisations,
+					"renorm_interval": interval,
+				}
+			return lyaps, stats
+		else:
+			return lyaps
 	
 	def save_compiled(self, *args, **kwargs):
 		warn("Your module will be saved, but note that there is no method to generate a jitcode_lyap instance from a saved module file yet.")
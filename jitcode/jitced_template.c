@@ -1,142 +1,870 @@
-# pragma GCC diagnostic push
-# pragma GCC diagnostic ignored "-pedantic"
-# define NPY_NO_DEPRECATED_API NPY_1_8_API_VERSION
-# include <Python.h>
-# include <numpy/arrayobject.h>
-# pragma GCC diagnostic pop
+# include "jitced.h"
 
-# include <math.h>
+# define TYPE_INDEX NPY_DOUBLE
 
-# pragma GCC diagnostic push
-# pragma GCC diagnostic ignored "-Wunused-parameter"
+{% if control_pars: %}
+# define CONTROL_PAR_FORMAT "{{ "O"*(control_pars|length) }}"
+# define CONTROL_PAR_ARGUMENTS {% for _ in control_pars %}, &control_par_objects[{{loop.index0}}]{% endfor %}
+# define CONTROL_PAR_PARAMETERS , double const *restrict const control_pars, double const *const *restrict const control_par_arrays
+# define CONTROL_PAR_CALL_ARGUMENTS , control_pars, control_par_arrays
 
-# define TYPE_INDEX NPY_DOUBLE
+static int read_control_pars(
+	PyObject * control_par_objects[],
+	double control_pars[],
+	PyArrayObject * control_par_array_objects[],
+	double const * control_par_arrays[]
+	)
+{
+	{% for is_array, k, length in control_pars: %}
+	{% if is_array: %}
+	control_par_array_objects[{{k}}] = (PyArrayObject *) PyArray_FROMANY(control_par_objects[{{loop.index0}}], TYPE_INDEX, 1, 1, NPY_ARRAY_IN_ARRAY);
+	if (control_par_array_objects[{{k}}] == NULL)
+		return 0;
+	if (PyArray_DIM(control_par_array_objects[{{k}}],0) < {{length}})
+	{
+		PyErr_SetString(PyExc_ValueError,"Control-parameter array too short (needs {{length}} components).");
+		return 0;
+	}
+	control_par_arrays[{{k}}] = PyArray_DATA(control_par_array_objects[{{k}}]);
+	{% else: %}
+	control_pars[{{k}}] = PyFloat_AsDouble(control_par_objects[{{loop.index0}}]);
+	if (PyErr_Occurred())
+		return 0;
+	{% endif %}
+	{% endfor %}
+	return 1;
+}
 
-unsigned int const dimension={{n}};
+static void release_control_pars(PyArrayObject * control_par_array_objects[])
+{
+	for (int k=0; k<{{number_of_control_par_arrays}}; k++)
+		Py_XDECREF(control_par_array_objects[k]);
+}
+{% else: %}
+# define CONTROL_PAR_FORMAT ""
+# define CONTROL_PAR_ARGUMENTS
+# define CONTROL_PAR_PARAMETERS
+# define CONTROL_PAR_CALL_ARGUMENTS
+{% endif %}
+
+{% macro declare_control_par_objects() %}
+	{% if control_pars: %}
+	PyObject * control_par_objects[{{control_pars|length}}];
+	{% endif %}
+{% endmacro %}
 
-# define get_general_helper(i) ((general_helper[i]))
-# define set_general_helper(i,value) (general_helper[i] = value)
+{% macro read_control_pars() %}
+	{% if control_pars: %}
+	double control_pars[{{number_of_control_pars or 1}}];
+	PyArrayObject * control_par_array_objects[{{number_of_control_par_arrays or 1}}] = {NULL};
+	double const * control_par_arrays[{{number_of_control_par_arrays or 1}}];
+	if (!read_control_pars(control_par_objects, control_pars, control_par_array_objects, control_par_arrays))
+	{
+		release_control_pars(control_par_array_objects);
+		return NULL;
+	}
+	{% endif %}
+{% endmacro %}
 
-# define get_f_helper(i) ((f_helper[i]))
-# define set_f_helper(i,value) (f_helper[i] = value)
+{% macro release_control_pars() %}
+	{% if control_pars: %}
+	release_control_pars(control_par_array_objects);
+	{% endif %}
+{% endmacro %}
 
-{% if has_Jacobian: %}
-# define get_jac_helper(i) ((jac_helper[i]))
-# define set_jac_helper(i,value) (jac_helper[i] = value)
+{% if control_pars: %}
+# define CONTROL_PAR_OBJECTS control_par_objects
+{% else: %}
+# define CONTROL_PAR_OBJECTS NULL
 {% endif %}
 
-# define y(i) (* (double *) PyArray_GETPTR1(Y, i))
+{% if fastcall: %}
+// f and jac use the fast calling convention: the arguments are passed as an array without building a tuple.
+# define ARGUMENT_SIGNATURE (PyObject *self, PyObject *const *args, Py_ssize_t nargs, PyObject *kwnames)
+# define PARSE_ARGUMENTS(t, Y_array, out_object) parse_arguments(args, nargs, kwnames, t, Y_array, CONTROL_PAR_OBJECTS, out_object)
+# define CALLING_CONVENTION METH_FASTCALL|METH_KEYWORDS
 
-# define set_dy(i, value) (* (double *) PyArray_GETPTR1(dY, i) = value)
+static int parse_arguments(
+	PyObject *const *args,
+	Py_ssize_t const nargs,
+	PyObject * kwnames,
+	double * t,
+	PyArrayObject ** Y_array,
+	PyObject * control_par_objects[],
+	PyObject ** out_object
+	)
+{
+	if (nargs != {{2+control_pars|length}})
+	{
+		PyErr_Format(PyExc_TypeError,"Expected {{2+control_pars|length}} positional arguments, got %zd.",nargs);
+		return 0;
+	}
+	
+	*t = PyFloat_AsDouble(args[0]);
+	if ((*t == -1.0) && PyErr_Occurred())
+		return 0;
+	
+	if (!PyArray_Check(args[1]))
+	{
+		PyErr_SetString(PyExc_ValueError,"Wrong input.");
+		return 0;
+	}
+	*Y_array = (PyArrayObject *) args[1];
+	
+	for (Py_ssize_t i=2; i<nargs; i++)
+		control_par_objects[i-2] = args[i];
+	
+	if (kwnames != NULL)
+		for (Py_ssize_t i=0; i<PyTuple_GET_SIZE(kwnames); i++)
+		{
+			if (PyUnicode_CompareWithASCIIString(PyTuple_GET_ITEM(kwnames,i),"out") == 0)
+				*out_object = args[nargs+i];
+			else
+			{
+				PyErr_SetString(PyExc_TypeError,"The only keyword argument is out.");
+				return 0;
+			}
+		}
+	
+	return 1;
+}
+{% else: %}
+# define ARGUMENT_SIGNATURE (PyObject *self, PyObject *args, PyObject *kwargs)
+# define PARSE_ARGUMENTS(t, Y_array, out_object) parse_arguments(args, kwargs, t, Y_array, CONTROL_PAR_OBJECTS, out_object)
+# define CALLING_CONVENTION METH_VARARGS|METH_KEYWORDS
 
-{% if has_Jacobian: %}
-#define set_dfdy(i, j, value) (* (double *) PyArray_GETPTR2(dfdY, i, j) = value)
+static int parse_arguments(
+	PyObject * args,
+	PyObject * kwargs,
+	double * t,
+	PyArrayObject ** Y_array,
+	PyObject * control_par_objects[],
+	PyObject ** out_object
+	)
+{
+	if (!PyArg_ParseTuple(args, "dO!" CONTROL_PAR_FORMAT, t, &PyArray_Type, Y_array CONTROL_PAR_ARGUMENTS))
+	{
+		PyErr_SetString(PyExc_ValueError,"Wrong input.");
+		return 0;
+	}
+	
+	if (kwargs != NULL)
+	{
+		*out_object = PyDict_GetItemString(kwargs,"out");
+		if (PyDict_Size(kwargs) > (*out_object != NULL))
+		{
+			PyErr_SetString(PyExc_TypeError,"The only keyword argument is out.");
+			return 0;
+		}
+	}
+	
+	return 1;
+}
 {% endif %}
 
-{% if number_of_general_helpers>0: %}
-# include "general_helpers_definitions.c"
-static void general(PyArrayObject *restrict const Y, double *restrict const general_helper)
+static int check_state(PyArrayObject * Y_array)
 {
-	# include "general_helpers.c"
+	if (PyArray_NDIM(Y_array) != 1)
+	{
+		PyErr_SetString(PyExc_ValueError,"Array must be one-dimensional.");
+		return 0;
+	}
+	else if ((PyArray_TYPE(Y_array) != TYPE_INDEX))
+	{
+		PyErr_SetString(PyExc_TypeError,"Array needs to be of type double.");
+		return 0;
+	}
+	else if (PyArray_DIM(Y_array,0) != dimension)
+	{
+		PyErr_SetString(PyExc_ValueError,"Array must have the dimension of the differential equation.");
+		return 0;
+	}
+	return 1;
 }
+
+// Returns a new reference to out_object if it is a suitable output array, a new array if out_object is NULL or None, and NULL (with an exception set) otherwise.
+static PyArrayObject * get_output(PyObject * out_object, int const ndim, npy_intp const dims[], int const zeros)
+{
+	if ((out_object == NULL) || (out_object == Py_None))
+	{
+		PyArrayObject * output = (PyArrayObject *) (zeros ? PyArray_ZEROS(ndim, dims, TYPE_INDEX, 0) : PyArray_EMPTY(ndim, dims, TYPE_INDEX, 0));
+		if (output == NULL)
+			return (PyArrayObject *) PyErr_NoMemory();
+		return output;
+	}
+	
+	PyArrayObject * output = (PyArrayObject *) out_object;
+	int suitable = PyArray_Check(out_object) && (PyArray_NDIM(output) == ndim) && (PyArray_TYPE(output) == TYPE_INDEX) && PyArray_ISCARRAY(output);
+	for (int i=0; suitable && (i<ndim); i++)
+		suitable = (PyArray_DIM(output,i) == dims[i]);
+	
+	if (!suitable)
+	{
+		PyErr_SetString(PyExc_ValueError,"Output must be a writeable, contiguous array of doubles with the shape of the result.");
+		return NULL;
+	}
+	
+	Py_INCREF(output);
+	return output;
+}
+
+{% if instrument: %}
+// Counters of the calls of and the time spent in f, the Jacobian, and (optionally) the chunk functions, which are returned by stats(). Without instrumentation, none of this is compiled.
+# include <time.h>
+
+typedef struct
+{
+	unsigned long long calls;
+	double time;
+} counter;
+
+static counter f_counter = {0, 0.0};
+static counter jac_counter = {0, 0.0};
+static counter f_batch_counter = {0, 0.0};
+{% if timed_chunks: %}
+static counter chunk_counters[{{timed_chunks|length}}];
+static char const * const chunk_names[{{timed_chunks|length}}] = { {% for chunk in timed_chunks %}"{{chunk.name}}"{{ ", " if not loop.last }}{% endfor %} };
+{% endif %}
+
+static double current_time(void)
+{
+	struct timespec now;
+	# ifdef CLOCK_MONOTONIC
+	clock_gettime(CLOCK_MONOTONIC, &now);
+	# else
+	timespec_get(&now, TIME_UTC);
+	# endif
+	return now.tv_sec + 1e-9*now.tv_nsec;
+}
+
+static void count(counter *const target, double const start)
+{
+	target->calls++;
+	target->time += current_time()-start;
+}
+
+// Every call of a chunk function in the main code is replaced by a timed call. The name of the function is not expanded again within the macro.
+# define timed_chunk(k, call) do { double const chunk_start = current_time(); call; count(&chunk_counters[k], chunk_start); } while (0)
+{% endif %}
+
+{% macro start_counter() %}{% if instrument: %}double const counter_start = current_time();{% endif %}{% endmacro %}
+{% macro stop_counter(name) %}{% if instrument: %}count(&{{name}}_counter, counter_start);{% endif %}{% endmacro %}
+{% macro time_chunks(jacobian) %}
+{% for chunk in timed_chunks if chunk.jacobian==jacobian %}
+# define {{chunk.name}}(...) timed_chunk({{chunk.index}}, {{chunk.name}}(__VA_ARGS__))
+{% endfor %}
+{% endmacro %}
+
+{% set chunks = "declarations" if separate_units else "definitions" %}
+
+{% if couplings: %}
+// The couplings are a sparse matrix in CSR format, whose column indices refer to components of the state. Their values are computed once per call before anything else.
+static unsigned int const coupling_indptr[{{couplings.rows+1}}] = { {{couplings.indptr}} };
+static unsigned int const coupling_columns[{{couplings.size}}] = { {{couplings.columns}} };
+static double const coupling_data[{{couplings.size}}] = { {{couplings.data}} };
+
+{% macro coupling_code() %}
+	for (unsigned int i=0; i<{{couplings.rows}}; i++)
+	{
+		set_coupling(i, 0.0);
+		for (unsigned int p=coupling_indptr[i]; p<coupling_indptr[i+1]; p++)
+			add_to_coupling(i, coupling_data[p]*y(coupling_columns[p]));
+	}
+{% endmacro %}
+{% endif %}
+{% if number_of_general_helpers>0: %}
+# include "general_helpers_{{chunks}}.c"
 {% endif %}
 
 {% if number_of_f_helpers>0: %}
-# include "f_helpers_definitions.c"
+# include "f_helpers_{{chunks}}.c"
 {% endif %}
-# include "f_definitions.c"
+# include "f_{{chunks}}.c"
 
-static PyObject * py_f(PyObject *self, PyObject *args)
+{% if tangent_dynamics: %}
+{% set tangent_size = tangent_dynamics.rows|length %}
+// The tangent dynamics are obtained by applying the non-zero entries of the Jacobian of the original system (computed once per call) to all tangent vectors.
+{% if tangent_size: %}
+# include "tangent_jac_{{chunks}}.c"
+static unsigned int const tangent_rows[{{tangent_size}}] = { {{tangent_dynamics.rows|join(", ")}} };
+static unsigned int const tangent_columns[{{tangent_size}}] = { {{tangent_dynamics.columns|join(", ")}} };
+{% endif %}
+
+{% macro tangent_dynamics_code() %}
+	for (unsigned int i={{tangent_dynamics.n_basic}}; i<dimension; i++)
+	{
+		set_dy(i, 0.0);
+	}
+	{% if tangent_size: %}
+	# include "tangent_jac.c"
+	for (unsigned int offset={{tangent_dynamics.n_basic}}; offset<dimension; offset+={{tangent_dynamics.n_basic}})
+	{
+		for (unsigned int k=0; k<{{tangent_size}}; k++)
+		{
+			add_to_dy(offset+tangent_rows[k], get_tangent_jac(k)*y(offset+tangent_columns[k]));
+		}
+	}
+	{% endif %}
+{% endmacro %}
+{% endif %}
+
+{{ time_chunks(False) }}
+
+static void f_core(double const t, double const *restrict const Y, double *restrict const dY CONTROL_PAR_PARAMETERS)
+{
+	{{ start_counter() }}
+	
+	{% if couplings: %}
+	double coupling_value[{{couplings.rows or 1}}];
+	{{ coupling_code() }}
+	{% endif %}
+	
+	{% if number_of_general_helpers>0: %}
+	double general_helper[{{number_of_general_helpers}}];
+	# include "general_helpers.c"
+	{% endif %}
+	
+	{% if number_of_f_helpers>0: %}
+	double f_helper[{{number_of_f_helpers}}];
+	# include "f_helpers.c"
+	{% endif %}
+	
+	# include "f.c"
+	
+	{% if tangent_dynamics: %}
+	double tangent_jac[{{tangent_size or 1}}];
+	{{ tangent_dynamics_code() }}
+	{% endif %}
+	
+	{{ stop_counter("f") }}
+}
+
+static PyObject * py_f ARGUMENT_SIGNATURE
 {
 	double t;
-	PyArrayObject * Y;
+	PyArrayObject * Y_array;
+	PyObject * out_object = NULL;
+	{{ declare_control_par_objects() }}
+	
+	if (!PARSE_ARGUMENTS(&t, &Y_array, &out_object) || !check_state(Y_array))
+		return NULL;
+	
+	{{ read_control_pars() }}
+	
+	npy_intp dims[1] = {dimension};
+	PyArrayObject * dY_array = get_output(out_object, 1, dims, 0);
+	if (dY_array == NULL)
+	{
+		{{ release_control_pars() }}
+		return NULL;
+	}
+	
+	Y_array = PyArray_GETCONTIGUOUS(Y_array);
+	double const *restrict const Y = PyArray_DATA(Y_array);
+	double *restrict const dY = PyArray_DATA(dY_array);
 	
-	if (!PyArg_ParseTuple(args, "dO!", &t, &PyArray_Type, &Y))
+	f_core(t, Y, dY CONTROL_PAR_CALL_ARGUMENTS);
+	
+	Py_DECREF(Y_array);
+	{{ release_control_pars() }}
+	return PyArray_Return(dY_array);
+}
+
+{% if native_integrator: %}
+# include <float.h>
+
+static double scaled_rms(double const *restrict const x, double const *restrict const y, double const rtol, double const atol)
+{
+	double sum = 0.0;
+	for (unsigned int i=0; i<dimension; i++)
+	{
+		double const scaled = x[i] / (atol+rtol*fabs(y[i]));
+		sum += scaled*scaled;
+	}
+	return sqrt(sum/dimension);
+}
+
+// Integrates from *t to t_end with the Dormand–Prince 5(4) method and adaptive step size. Updates *t, y and the proposed step size *h. Returns 1 on success, -1 if nsteps were exceeded, and -2 if the step size became too small. work must hold 9*dimension doubles.
+static int dopri5(
+	double *restrict const t,
+	double const t_end,
+	double *restrict const y,
+	double *restrict const h,
+	double const rtol,
+	double const atol,
+	double const max_step,
+	long const nsteps,
+	double *restrict const work
+	CONTROL_PAR_PARAMETERS
+	)
+{
+	unsigned int const n = dimension;
+	double * k1 = work;
+	double *restrict const k2 = work + 1*n;
+	double *restrict const k3 = work + 2*n;
+	double *restrict const k4 = work + 3*n;
+	double *restrict const k5 = work + 4*n;
+	double *restrict const k6 = work + 5*n;
+	double * k7 = work + 6*n;
+	double *restrict const y_new = work + 7*n;
+	double *restrict const y_stage = work + 8*n;
+	
+	if (*t == t_end)
+		return 1;
+	double const direction = (t_end > *t) ? 1.0 : -1.0;
+	
+	f_core(*t, y, k1 CONTROL_PAR_CALL_ARGUMENTS);
+	
+	if (*h <= 0.0)
+	{
+		// initial step size as proposed by Hairer, Nørsett and Wanner
+		double const d0 = scaled_rms(y, y, rtol, atol);
+		double const d1 = scaled_rms(k1, y, rtol, atol);
+		double h0 = ((d0<1e-5) || (d1<1e-5)) ? 1e-6 : 0.01*d0/d1;
+		h0 = fmin(h0, fabs(t_end-*t));
+		for (unsigned int i=0; i<n; i++)
+			y_stage[i] = y[i] + direction*h0*k1[i];
+		f_core(*t+direction*h0, y_stage, k2 CONTROL_PAR_CALL_ARGUMENTS);
+		for (unsigned int i=0; i<n; i++)
+			y_new[i] = k2[i]-k1[i];
+		double const d2 = scaled_rms(y_new, y, rtol, atol) / h0;
+		double const d = fmax(d1,d2);
+		double const h1 = (d<=1e-15) ? fmax(1e-6, h0*1e-3) : pow(0.01/d, 0.2);
+		*h = fmin(100*h0, h1);
+	}
+	
+	for (long step=0; direction*(t_end-*t)>0; step++)
+	{
+		if (step >= nsteps)
+			return -1;
+		
+		double h_now = (max_step>0.0) ? fmin(*h,max_step) : *h;
+		int const last = (h_now >= direction*(t_end-*t));
+		if (last)
+			h_now = direction*(t_end-*t);
+		double const hs = direction*h_now;
+		if (fabs(hs) <= 10*DBL_EPSILON*fabs(*t))
+			return -2;
+		
+		for (unsigned int i=0; i<n; i++)
+			y_stage[i] = y[i] + hs*( 1.0/5.0*k1[i] );
+		f_core(*t+hs/5.0, y_stage, k2 CONTROL_PAR_CALL_ARGUMENTS);
+		
+		for (unsigned int i=0; i<n; i++)
+			y_stage[i] = y[i] + hs*( 3.0/40.0*k1[i] + 9.0/40.0*k2[i] );
+		f_core(*t+hs*3.0/10.0, y_stage, k3 CONTROL_PAR_CALL_ARGUMENTS);
+		
+		for (unsigned int i=0; i<n; i++)
+			y_stage[i] = y[i] + hs*( 44.0/45.0*k1[i] - 56.0/15.0*k2[i] + 32.0/9.0*k3[i] );
+		f_core(*t+hs*4.0/5.0, y_stage, k4 CONTROL_PAR_CALL_ARGUMENTS);
+		
+		for (unsigned int i=0; i<n; i++)
+			y_stage[i] = y[i] + hs*( 19372.0/6561.0*k1[i] - 25360.0/2187.0*k2[i] + 64448.0/6561.0*k3[i] - 212.0/729.0*k4[i] );
+		f_core(*t+hs*8.0/9.0, y_stage, k5 CONTROL_PAR_CALL_ARGUMENTS);
+		
+		for (unsigned int i=0; i<n; i++)
+			y_stage[i] = y[i] + hs*( 9017.0/3168.0*k1[i] - 355.0/33.0*k2[i] + 46732.0/5247.0*k3[i] + 49.0/176.0*k4[i] - 5103.0/18656.0*k5[i] );
+		f_core(*t+hs, y_stage, k6 CONTROL_PAR_CALL_ARGUMENTS);
+		
+		for (unsigned int i=0; i<n; i++)
+			y_new[i] = y[i] + hs*( 35.0/384.0*k1[i] + 500.0/1113.0*k3[i] + 125.0/192.0*k4[i] - 2187.0/6784.0*k5[i] + 11.0/84.0*k6[i] );
+		f_core(*t+hs, y_new, k7 CONTROL_PAR_CALL_ARGUMENTS);
+		
+		double sum = 0.0;
+		for (unsigned int i=0; i<n; i++)
+		{
+			double const error = hs*(
+					  71.0/57600.0*k1[i] - 71.0/16695.0*k3[i] + 71.0/1920.0*k4[i]
+					- 17253.0/339200.0*k5[i] + 22.0/525.0*k6[i] - 1.0/40.0*k7[i]
+				);
+			double const scaled = error / (atol+rtol*fmax(fabs(y[i]),fabs(y_new[i])));
+			sum += scaled*scaled;
+		}
+		double const error = sqrt(sum/n);
+		double const factor = (error==0.0) ? 10.0 : fmin(10.0, fmax(0.2, 0.9*pow(error,-0.2)));
+		
+		if (error <= 1.0)
+		{
+			*t = last ? t_end : *t+hs;
+			for (unsigned int i=0; i<n; i++)
+				y[i] = y_new[i];
+			// first same as last
+			double * const swap = k1;
+			k1 = k7;
+			k7 = swap;
+			if (!last || (factor<1.0))
+				*h = h_now*factor;
+		}
+		else
+			*h = h_now*factor;
+	}
+	
+	return 1;
+}
+
+static PyObject * py_dopri5(PyObject *self, PyObject *args)
+{
+	PyArrayObject * Y_array;
+	PyArrayObject * work_array;
+	double t, t_end, h, rtol, atol, max_step;
+	long nsteps;
+	{{ declare_control_par_objects() }}
+	
+	if (!PyArg_ParseTuple(
+			args,
+			"O!ddddddlO!" CONTROL_PAR_FORMAT,
+			&PyArray_Type, &Y_array,
+			&t, &t_end, &h, &rtol, &atol, &max_step, &nsteps,
+			&PyArray_Type, &work_array
+			CONTROL_PAR_ARGUMENTS
+		))
 	{
 		PyErr_SetString(PyExc_ValueError,"Wrong input.");
 		return NULL;
 	}
 	
-	if (PyArray_NDIM(Y) != 1)
+	if (
+		   (PyArray_NDIM(Y_array) != 1)
+		|| (PyArray_DIM(Y_array,0) != dimension)
+		|| (PyArray_TYPE(Y_array) != TYPE_INDEX)
+		|| !PyArray_ISCARRAY(Y_array)
+		)
 	{
-		PyErr_SetString(PyExc_ValueError,"Array must be one-dimensional.");
+		PyErr_SetString(PyExc_ValueError,"State must be a writeable, contiguous array of doubles with the dimension of the differential equation.");
 		return NULL;
 	}
-	else if ((PyArray_TYPE(Y) != TYPE_INDEX))
+	else if (
+		   (PyArray_TYPE(work_array) != TYPE_INDEX)
+		|| !PyArray_ISCARRAY(work_array)
+		|| (PyArray_SIZE(work_array) < 9*dimension)
+		)
 	{
-		PyErr_SetString(PyExc_TypeError,"Array needs to be of type double.");
+		PyErr_SetString(PyExc_ValueError,"Work array must be a writeable, contiguous array of at least 9n doubles.");
 		return NULL;
 	}
 	
-	npy_intp dims[1] = {dimension};
-	PyArrayObject * dY = (PyArrayObject *) PyArray_EMPTY(1, dims, TYPE_INDEX, 0);
+	{{ read_control_pars() }}
+	
+	int const status = dopri5(
+			&t, t_end, PyArray_DATA(Y_array), &h,
+			rtol, atol, max_step, nsteps,
+			PyArray_DATA(work_array)
+			CONTROL_PAR_CALL_ARGUMENTS
+		);
+	
+	{{ release_control_pars() }}
+	return Py_BuildValue("ddi", t, h, status);
+}
+
+static PyObject * py_dopri5_grid(PyObject *self, PyObject *args)
+{
+	PyArrayObject * Y_array;
+	PyArrayObject * times_array;
+	PyArrayObject * out_array;
+	PyArrayObject * work_array;
+	double t, h, rtol, atol, max_step;
+	long nsteps;
+	{{ declare_control_par_objects() }}
 	
-	if (dY == NULL)
+	if (!PyArg_ParseTuple(
+			args,
+			"O!dO!O!ddddlO!" CONTROL_PAR_FORMAT,
+			&PyArray_Type, &Y_array,
+			&t,
+			&PyArray_Type, &times_array,
+			&PyArray_Type, &out_array,
+			&h, &rtol, &atol, &max_step, &nsteps,
+			&PyArray_Type, &work_array
+			CONTROL_PAR_ARGUMENTS
+		))
 	{
-		PyErr_SetString (PyExc_ValueError, "Error: Could not allocate array.");
-		exit(1);
+		PyErr_SetString(PyExc_ValueError,"Wrong input.");
+		return NULL;
 	}
 	
-	{% if number_of_general_helpers>0: %}
-	double general_helper[{{number_of_general_helpers}}];
-	general(Y, general_helper);
-	{% endif %}
+	if (
+		   (PyArray_NDIM(Y_array) != 1)
+		|| (PyArray_DIM(Y_array,0) != dimension)
+		|| (PyArray_TYPE(Y_array) != TYPE_INDEX)
+		|| !PyArray_ISCARRAY(Y_array)
+		)
+	{
+		PyErr_SetString(PyExc_ValueError,"State must be a writeable, contiguous array of doubles with the dimension of the differential equation.");
+		return NULL;
+	}
+	else if (
+		   (PyArray_NDIM(times_array) != 1)
+		|| (PyArray_TYPE(times_array) != TYPE_INDEX)
+		|| !PyArray_ISCARRAY_RO(times_array)
+		)
+	{
+		PyErr_SetString(PyExc_ValueError,"Times must be a one-dimensional, contiguous array of doubles.");
+		return NULL;
+	}
+	else if (
+		   (PyArray_NDIM(out_array) != 2)
+		|| (PyArray_DIM(out_array,0) != PyArray_DIM(times_array,0))
+		|| (PyArray_DIM(out_array,1) != dimension)
+		|| (PyArray_TYPE(out_array) != TYPE_INDEX)
+		|| !PyArray_ISCARRAY(out_array)
+		)
+	{
+		PyErr_SetString(PyExc_ValueError,"Output must be a writeable, contiguous array of doubles with one row per time.");
+		return NULL;
+	}
+	else if (
+		   (PyArray_TYPE(work_array) != TYPE_INDEX)
+		|| !PyArray_ISCARRAY(work_array)
+		|| (PyArray_SIZE(work_array) < 9*dimension)
+		)
+	{
+		PyErr_SetString(PyExc_ValueError,"Work array must be a writeable, contiguous array of at least 9n doubles.");
+		return NULL;
+	}
 	
-	{% if number_of_f_helpers>0: %}
-	double f_helper[{{number_of_f_helpers}}];
-	# include "f_helpers.c"
-	{% endif %}
+	{{ read_control_pars() }}
 	
-	# include "f.c"
+	double *restrict const y = PyArray_DATA(Y_array);
+	double const *restrict const times = PyArray_DATA(times_array);
+	double *restrict const out = PyArray_DATA(out_array);
+	npy_intp const number_of_times = PyArray_DIM(times_array,0);
+	
+	int status = 1;
+	npy_intp i = 0;
+	for (; i<number_of_times; i++)
+	{
+		status = dopri5(
+				&t, times[i], y, &h,
+				rtol, atol, max_step, nsteps,
+				PyArray_DATA(work_array)
+				CONTROL_PAR_CALL_ARGUMENTS
+			);
+		if (status < 0)
+			break;
+		for (unsigned int j=0; j<dimension; j++)
+			out[i*dimension+j] = y[j];
+	}
 	
-	return PyArray_Return(dY);
+	{{ release_control_pars() }}
+	return Py_BuildValue("ddin", t, h, status, i);
 }
 
-{% if has_Jacobian: %}
-{% if number_of_jac_helpers>0: %}
-# include "jac_helpers_definitions.c"
-{% endif %}
-# include "jac_definitions.c"
+{% if tangent_dynamics: %}
+{% set n_basic = tangent_dynamics.n_basic %}
+{% set n_lyap = n//n_basic-1 %}
+// Orthonormalises the tangent vectors in y with the modified Gram–Schmidt process and writes the logarithms of their norms before the normalisation to log_norms. Returns 0 if a norm is out of numerical bounds (which is checked without isfinite, as the latter does not survive -ffast-math), and 1 otherwise.
+static int renormalise(double *restrict const y, double *restrict const log_norms)
+{
+	for (unsigned int i=0; i<{{n_lyap}}; i++)
+	{
+		double * const vector = y + (i+1)*{{n_basic}};
+		for (unsigned int j=0; j<i; j++)
+		{
+			double const * const other = y + (j+1)*{{n_basic}};
+			double product = 0.0;
+			for (unsigned int k=0; k<{{n_basic}}; k++)
+				product += vector[k]*other[k];
+			for (unsigned int k=0; k<{{n_basic}}; k++)
+				vector[k] -= product*other[k];
+		}
+		double sum = 0.0;
+		for (unsigned int k=0; k<{{n_basic}}; k++)
+			sum += vector[k]*vector[k];
+		if (!((sum > DBL_MIN) && (sum < DBL_MAX)))
+			return 0;
+		double const norm = sqrt(sum);
+		for (unsigned int k=0; k<{{n_basic}}; k++)
+			vector[k] /= norm;
+		log_norms[i] = log(norm);
+	}
+	return 1;
+}
 
-static PyObject * py_jac(PyObject *self, PyObject *args)
+// Integrates from *t to t_end > *t like dopri5, renormalising the tangent vectors after every *interval. The logarithms of the norms are added to sums[0:n_lyap], their squares divided by the respective interval to sums[n_lyap:2*n_lyap]. If log_growth is positive, *interval is adapted such that the largest absolute logarithm of a norm is about log_growth. *renormalisations is incremented with every renormalisation. Returns like dopri5 or -3 if a norm is out of numerical bounds.
+static int dopri5_lyap(
+	double *restrict const t,
+	double const t_end,
+	double *restrict const y,
+	double *restrict const h,
+	double *restrict const interval,
+	double const log_growth,
+	double const rtol,
+	double const atol,
+	double const max_step,
+	long const nsteps,
+	double *restrict const work,
+	double *restrict const sums,
+	long *restrict const renormalisations
+	CONTROL_PAR_PARAMETERS
+	)
 {
-	double t;
-	PyArrayObject * Y;
+	double log_norms[{{n_lyap}}];
+	
+	while (*t < t_end)
+	{
+		double const t_start = *t;
+		double const t_target = (*interval >= t_end-*t) ? t_end : *t+*interval;
+		int const status = dopri5(
+				t, t_target, y, h,
+				rtol, atol, max_step, nsteps,
+				work
+				CONTROL_PAR_CALL_ARGUMENTS
+			);
+		if (status < 0)
+			return status;
+		
+		if (!renormalise(y, log_norms))
+			return -3;
+		(*renormalisations)++;
+		
+		double const delta_t = *t-t_start;
+		double largest = 0.0;
+		for (unsigned int i=0; i<{{n_lyap}}; i++)
+		{
+			sums[i] += log_norms[i];
+			sums[{{n_lyap}}+i] += log_norms[i]*log_norms[i]/delta_t;
+			largest = fmax(largest, fabs(log_norms[i]));
+		}
+		
+		if (log_growth > 0.0)
+			*interval = delta_t * ( (largest>0.0) ? fmin(2.0, fmax(0.5, log_growth/largest)) : 2.0 );
+	}
+	
+	return 1;
+}
+
+static PyObject * py_dopri5_lyap(PyObject *self, PyObject *args)
+{
+	PyArrayObject * Y_array;
+	PyArrayObject * sums_array;
+	PyArrayObject * work_array;
+	double t, t_end, interval, log_growth, h, rtol, atol, max_step;
+	long nsteps;
+	{{ declare_control_par_objects() }}
 	
-	if (!PyArg_ParseTuple(args, "dO!", &t, &PyArray_Type, &Y))
+	if (!PyArg_ParseTuple(
+			args,
+			"O!ddddO!ddddlO!" CONTROL_PAR_FORMAT,
+			&PyArray_Type, &Y_array,
+			&t, &t_end, &interval, &log_growth,
+			&PyArray_Type, &sums_array,
+			&h, &rtol, &atol, &max_step, &nsteps,
+			&PyArray_Type, &work_array
+			CONTROL_PAR_ARGUMENTS
+		))
 	{
 		PyErr_SetString(PyExc_ValueError,"Wrong input.");
 		return NULL;
 	}
 	
-	if (PyArray_NDIM(Y) != 1)
+	if (
+		   (PyArray_NDIM(Y_array) != 1)
+		|| (PyArray_DIM(Y_array,0) != dimension)
+		|| (PyArray_TYPE(Y_array) != TYPE_INDEX)
+		|| !PyArray_ISCARRAY(Y_array)
+		)
 	{
-		PyErr_SetString(PyExc_ValueError,"Array must be one-dimensional.");
+		PyErr_SetString(PyExc_ValueError,"State must be a writeable, contiguous array of doubles with the dimension of the differential equation.");
 		return NULL;
 	}
-	else if ((PyArray_TYPE(Y) != TYPE_INDEX))
+	else if (
+		   (PyArray_TYPE(sums_array) != TYPE_INDEX)
+		|| !PyArray_ISCARRAY(sums_array)
+		|| (PyArray_SIZE(sums_array) != 2*{{n_lyap}})
+		)
 	{
-		PyErr_SetString(PyExc_TypeError,"Array needs to be of type double.");
+		PyErr_SetString(PyExc_ValueError,"Sums must be a writeable, contiguous array of 2*n_lyap doubles.");
+		return NULL;
+	}
+	else if (
+		   (PyArray_TYPE(work_array) != TYPE_INDEX)
+		|| !PyArray_ISCARRAY(work_array)
+		|| (PyArray_SIZE(work_array) < 9*dimension)
+		)
+	{
+		PyErr_SetString(PyExc_ValueError,"Work array must be a writeable, contiguous array of at least 9n doubles.");
+		return NULL;
+	}
+	else if (!(interval > 0.0))
+	{
+		PyErr_SetString(PyExc_ValueError,"Renormalisation interval must be positive.");
 		return NULL;
 	}
 	
-	npy_intp dims[2] = {dimension, dimension};
+	{{ read_control_pars() }}
+	
+	long renormalisations = 0;
+	int const status = dopri5_lyap(
+			&t, t_end, PyArray_DATA(Y_array), &h, &interval, log_growth,
+			rtol, atol, max_step, nsteps,
+			PyArray_DATA(work_array),
+			PyArray_DATA(sums_array),
+			&renormalisations
+			CONTROL_PAR_CALL_ARGUMENTS
+		);
 	
-	{% if sparse_jac: %}
-	PyArrayObject * dfdY = (PyArrayObject *) PyArray_ZEROS(2, dims, TYPE_INDEX, 0);
+	{{ release_control_pars() }}
+	return Py_BuildValue("dddil", t, h, interval, status, renormalisations);
+}
+{% endif %}
+{% endif %}
+
+{% if has_Jacobian: %}
+{% if number_of_jac_helpers>0: %}
+# include "jac_helpers_{{chunks}}.c"
+{% endif %}
+# include "jac_{{chunks}}.c"
+
+{% if coupling_jac: %}
+{% set coupling_jac_size = coupling_jac.rows|length %}
+// The contribution of the couplings to the Jacobian: The coupling_jac_couplings[k]-th row of the coupling matrix, weighted with the k-th coupling factor, is added to the coupling_jac_rows[k]-th row of the Jacobian.
+# include "coupling_factors_{{chunks}}.c"
+static unsigned int const coupling_jac_rows[{{coupling_jac_size}}] = { {{coupling_jac.rows|join(", ")}} };
+static unsigned int const coupling_jac_couplings[{{coupling_jac_size}}] = { {{coupling_jac.couplings|join(", ")}} };
+{% endif %}
+
+{{ time_chunks(True) }}
+
+static PyObject * py_jac ARGUMENT_SIGNATURE
+{
+	double t;
+	PyArrayObject * Y_array;
+	PyObject * out_object = NULL;
+	{{ declare_control_par_objects() }}
+	
+	if (!PARSE_ARGUMENTS(&t, &Y_array, &out_object) || !check_state(Y_array))
+		return NULL;
+	
+	{{ read_control_pars() }}
+	
+	{% if jac_band: %}
+	npy_intp dims[2] = { {{jac_band[0]+jac_band[1]+1}}, dimension };
 	{% else: %}
-	PyArrayObject * dfdY = (PyArrayObject *) PyArray_EMPTY(2, dims, TYPE_INDEX, 0);
+	npy_intp dims[2] = {dimension, dimension};
 	{% endif %}
 	
-	if (dfdY == NULL)
+	// For a sparse Jacobian, only non-zero entries are written. Hence new arrays need to be zeroed, while the zero entries of a given output array are left untouched.
+	PyArrayObject * dfdY_array = get_output(out_object, 2, dims, {{1 if sparse_jac else 0}});
+	if (dfdY_array == NULL)
 	{
-		PyErr_SetString (PyExc_ValueError, "Error: Could not allocate array.");
-		exit(1);
+		{{ release_control_pars() }}
+		return NULL;
 	}
 	
+	Y_array = PyArray_GETCONTIGUOUS(Y_array);
+	double const *restrict const Y = PyArray_DATA(Y_array);
+	double *restrict const dfdY = PyArray_DATA(dfdY_array);
+	
+	{{ start_counter() }}
+	
+	{% if couplings: %}
+	double coupling_value[{{couplings.rows or 1}}];
+	{{ coupling_code() }}
+	{% endif %}
+	
 	{% if number_of_general_helpers>0: %}
 	double general_helper[{{number_of_general_helpers}}];
-	general(Y, general_helper);
+	# include "general_helpers.c"
 	{% endif %}
 	
 	{% if number_of_jac_helpers>0: %}
@@ -144,18 +872,321 @@ static PyObject * py_jac(PyObject *self, PyObject *args)
 	# include "jac_helpers.c"
 	{% endif %}
 	
+	{% if coupling_jac: %}
+	// entries that only receive contributions from couplings need to be zeroed
+	for (unsigned int k=0; k<{{coupling_jac_size}}; k++)
+		for (unsigned int p=coupling_indptr[coupling_jac_couplings[k]]; p<coupling_indptr[coupling_jac_couplings[k]+1]; p++)
+			set_dfdy(coupling_jac_rows[k], coupling_columns[p], 0.0);
+	{% endif %}
+	
 	# include "jac.c"
 	
-	return PyArray_Return(dfdY);
+	{% if coupling_jac: %}
+	double coupling_factor[{{coupling_jac_size}}];
+	# include "coupling_factors.c"
+	for (unsigned int k=0; k<{{coupling_jac_size}}; k++)
+		for (unsigned int p=coupling_indptr[coupling_jac_couplings[k]]; p<coupling_indptr[coupling_jac_couplings[k]+1]; p++)
+			add_to_dfdy(coupling_jac_rows[k], coupling_columns[p], coupling_factor[k]*coupling_data[p]);
+	{% endif %}
+	
+	{{ stop_counter("jac") }}
+	
+	Py_DECREF(Y_array);
+	{{ release_control_pars() }}
+	return PyArray_Return(dfdY_array);
+}
+{% endif %}
+
+{% if batch_size: %}
+// The same code as for f, but every instruction is executed for a block of batch_size states at once, which are stored interleaved, i.e., component i of the m-th state of the block is at Y[i*batch_size+m]. This way, the compiler can vectorise along the block.
+
+{% for chunk in timed_chunks: %}
+# undef {{chunk.name}}
+{% endfor %}
+{% for function in batch_functions: %}
+# define {{function}} {{function}}_batch
+{% endfor %}
+
+# undef y
+# undef set_dy
+# undef get_general_helper
+# undef set_general_helper
+# undef get_f_helper
+# undef set_f_helper
+# undef cse_array
+# undef get_cse
+# undef set_cse
+# undef get_coupling
+# undef set_coupling
+# undef add_to_coupling
+{% if tangent_dynamics: %}
+# undef add_to_dy
+# undef get_tangent_jac
+# undef set_tangent_jac
+{% endif %}
+
+# define BATCH_SIZE {{batch_size}}
+# define y(i) (Y[(i)*BATCH_SIZE+member])
+# define set_dy(i, value) for (npy_intp member=0; member<BATCH_SIZE; member++) dY[(i)*BATCH_SIZE+member] = value
+# define get_general_helper(i) (general_helper[(i)*BATCH_SIZE+member])
+# define set_general_helper(i, value) for (npy_intp member=0; member<BATCH_SIZE; member++) general_helper[(i)*BATCH_SIZE+member] = value
+# define get_f_helper(i) (f_helper[(i)*BATCH_SIZE+member])
+# define set_f_helper(i, value) for (npy_intp member=0; member<BATCH_SIZE; member++) f_helper[(i)*BATCH_SIZE+member] = value
+# define cse_array(number) double cse[(number)*BATCH_SIZE]
+# define get_cse(i) (cse[(i)*BATCH_SIZE+member])
+# define set_cse(i, value) for (npy_intp member=0; member<BATCH_SIZE; member++) cse[(i)*BATCH_SIZE+member] = value
+# define get_coupling(i) (coupling_value[(i)*BATCH_SIZE+member])
+# define set_coupling(i, value) for (npy_intp member=0; member<BATCH_SIZE; member++) coupling_value[(i)*BATCH_SIZE+member] = value
+# define add_to_coupling(i, value) for (npy_intp member=0; member<BATCH_SIZE; member++) coupling_value[(i)*BATCH_SIZE+member] += value
+{% if tangent_dynamics: %}
+# define add_to_dy(i, value) for (npy_intp member=0; member<BATCH_SIZE; member++) dY[(i)*BATCH_SIZE+member] += value
+# define get_tangent_jac(i) (tangent_jac[(i)*BATCH_SIZE+member])
+# define set_tangent_jac(i, value) for (npy_intp member=0; member<BATCH_SIZE; member++) tangent_jac[(i)*BATCH_SIZE+member] = value
+{% endif %}
+
+{% if number_of_general_helpers>0: %}
+# include "general_helpers_definitions.c"
+{% endif %}
+{% if number_of_f_helpers>0: %}
+# include "f_helpers_definitions.c"
+{% endif %}
+# include "f_definitions.c"
+{% if tangent_dynamics and tangent_size: %}
+# include "tangent_jac_definitions.c"
+{% endif %}
+
+{% macro free_batch_buffers() %}
+	free(Y);
+	free(dY);
+	{% if couplings: %}
+	free(coupling_value);
+	{% endif %}
+	{% if number_of_general_helpers>0: %}
+	free(general_helper);
+	{% endif %}
+	{% if number_of_f_helpers>0: %}
+	free(f_helper);
+	{% endif %}
+	{% if tangent_dynamics: %}
+	free(tangent_jac);
+	{% endif %}
+{% endmacro %}
+
+static PyObject * py_f_batch(PyObject *self, PyObject *args)
+{
+	double t;
+	PyArrayObject * Y_array;
+	{{ declare_control_par_objects() }}
+	
+	if (!PyArg_ParseTuple(args, "dO!" CONTROL_PAR_FORMAT, &t, &PyArray_Type, &Y_array CONTROL_PAR_ARGUMENTS))
+	{
+		PyErr_SetString(PyExc_ValueError,"Wrong input.");
+		return NULL;
+	}
+	
+	if (PyArray_NDIM(Y_array) != 2)
+	{
+		PyErr_SetString(PyExc_ValueError,"Array must be two-dimensional.");
+		return NULL;
+	}
+	else if ((PyArray_TYPE(Y_array) != TYPE_INDEX))
+	{
+		PyErr_SetString(PyExc_TypeError,"Array needs to be of type double.");
+		return NULL;
+	}
+	
+	int state_axis;
+	if (PyArray_DIM(Y_array,0) == dimension)
+		state_axis = 0;
+	else if (PyArray_DIM(Y_array,1) == dimension)
+		state_axis = 1;
+	else
+	{
+		PyErr_SetString(PyExc_ValueError,"Array must have the dimension of the differential equation along one axis.");
+		return NULL;
+	}
+	
+	{{ read_control_pars() }}
+	
+	PyArrayObject * dY_array = (PyArrayObject *) PyArray_EMPTY(2, PyArray_DIMS(Y_array), TYPE_INDEX, 0);
+	double * Y = malloc(dimension*BATCH_SIZE*sizeof(double));
+	double * dY = malloc(dimension*BATCH_SIZE*sizeof(double));
+	{% if couplings: %}
+	double * coupling_value = malloc({{couplings.rows or 1}}*BATCH_SIZE*sizeof(double));
+	{% endif %}
+	{% if number_of_general_helpers>0: %}
+	double * general_helper = malloc({{number_of_general_helpers}}*BATCH_SIZE*sizeof(double));
+	{% endif %}
+	{% if number_of_f_helpers>0: %}
+	double * f_helper = malloc({{number_of_f_helpers}}*BATCH_SIZE*sizeof(double));
+	{% endif %}
+	{% if tangent_dynamics: %}
+	double * tangent_jac = malloc({{tangent_size or 1}}*BATCH_SIZE*sizeof(double));
+	{% endif %}
+	
+	if (
+		   (dY_array == NULL) || (Y == NULL) || (dY == NULL)
+		{% if couplings: %}
+		|| (coupling_value == NULL)
+		{% endif %}
+		{% if number_of_general_helpers>0: %}
+		|| (general_helper == NULL)
+		{% endif %}
+		{% if number_of_f_helpers>0: %}
+		|| (f_helper == NULL)
+		{% endif %}
+		{% if tangent_dynamics: %}
+		|| (tangent_jac == NULL)
+		{% endif %}
+		)
+	{
+		// free ignores null pointers, i.e., buffers that could not be allocated
+		{{ free_batch_buffers() }}
+		Py_XDECREF(dY_array);
+		{{ release_control_pars() }}
+		return PyErr_NoMemory();
+	}
+	
+	npy_intp const ensemble_size = PyArray_DIM(Y_array,1-state_axis);
+	char const * const Y_data = PyArray_BYTES(Y_array);
+	npy_intp const Y_state_stride = PyArray_STRIDE(Y_array,state_axis);
+	npy_intp const Y_member_stride = PyArray_STRIDE(Y_array,1-state_axis);
+	char * const dY_data = PyArray_BYTES(dY_array);
+	npy_intp const dY_state_stride = PyArray_STRIDE(dY_array,state_axis);
+	npy_intp const dY_member_stride = PyArray_STRIDE(dY_array,1-state_axis);
+	
+	{{ start_counter() }}
+	
+	for (npy_intp start=0; start<ensemble_size; start+=BATCH_SIZE)
+	{
+		// an incomplete last block is padded with copies of the last state
+		for (npy_intp m=0; m<BATCH_SIZE; m++)
+		{
+			npy_intp const source = (start+m<ensemble_size) ? start+m : ensemble_size-1;
+			for (npy_intp i=0; i<dimension; i++)
+				Y[i*BATCH_SIZE+m] = * (double const *) (Y_data + i*Y_state_stride + source*Y_member_stride);
+		}
+		
+		{% if couplings: %}
+		{{ coupling_code() }}
+		{% endif %}
+		
+		{% if number_of_general_helpers>0: %}
+		# include "general_helpers.c"
+		{% endif %}
+		
+		{% if number_of_f_helpers>0: %}
+		# include "f_helpers.c"
+		{% endif %}
+		
+		# include "f.c"
+		
+		{% if tangent_dynamics: %}
+		{{ tangent_dynamics_code() }}
+		{% endif %}
+		
+		for (npy_intp m=0; (m<BATCH_SIZE) && (start+m<ensemble_size); m++)
+			for (npy_intp i=0; i<dimension; i++)
+				* (double *) (dY_data + i*dY_state_stride + (start+m)*dY_member_stride) = dY[i*BATCH_SIZE+m];
+	}
+	
+	{{ stop_counter("f_batch") }}
+	
+	{{ free_batch_buffers() }}
+	{{ release_control_pars() }}
+	
+	return PyArray_Return(dY_array);
+}
+{% endif %}
+
+{% if instrument: %}
+static int add_counter(PyObject * dict, char const * name, counter const * const source)
+{
+	PyObject * item = Py_BuildValue("{s:K,s:d}", "calls", source->calls, "time", source->time);
+	if (item == NULL)
+		return -1;
+	int const result = PyDict_SetItemString(dict, name, item);
+	Py_DECREF(item);
+	return result;
+}
+
+static PyObject * py_stats(PyObject *self, PyObject *args)
+{
+	PyObject * stats = PyDict_New();
+	if (
+		   (stats == NULL)
+		|| add_counter(stats, "f", &f_counter)
+		{% if has_Jacobian: %}
+		|| add_counter(stats, "jac", &jac_counter)
+		{% endif %}
+		{% if batch_size: %}
+		|| add_counter(stats, "f_batch", &f_batch_counter)
+		{% endif %}
+		)
+	{
+		Py_XDECREF(stats);
+		return NULL;
+	}
+	
+	{% if timed_chunks: %}
+	PyObject * chunk_stats = PyDict_New();
+	if (chunk_stats == NULL)
+	{
+		Py_DECREF(stats);
+		return NULL;
+	}
+	for (unsigned int k=0; k<{{timed_chunks|length}}; k++)
+	{
+		if (add_counter(chunk_stats, chunk_names[k], &chunk_counters[k]))
+		{
+			Py_DECREF(chunk_stats);
+			Py_DECREF(stats);
+			return NULL;
+		}
+	}
+	int const result = PyDict_SetItemString(stats, "chunks", chunk_stats);
+	Py_DECREF(chunk_stats);
+	if (result)
+	{
+		Py_DECREF(stats);
+		return NULL;
+	}
+	{% endif %}
+	
+	return stats;
+}
+
+static PyObject * py_reset_stats(PyObject *self, PyObject *args)
+{
+	f_counter = jac_counter = f_batch_counter = (counter) {0, 0.0};
+	{% if timed_chunks: %}
+	for (unsigned int k=0; k<{{timed_chunks|length}}; k++)
+		chunk_counters[k] = (counter) {0, 0.0};
+	{% endif %}
+	Py_RETURN_NONE;
 }
 {% endif %}
 
 # pragma GCC diagnostic pop
 
 static PyMethodDef {{module_name}}_methods[] = {
-	{"f", py_f, METH_VARARGS, NULL},
+	{"f", (PyCFunction) py_f, CALLING_CONVENTION, NULL},
+	{% if native_integrator: %}
+	{"dopri5", py_dopri5, METH_VARARGS, NULL},
+	{"dopri5_grid", py_dopri5_grid, METH_VARARGS, NULL},
+	{% if tangent_dynamics: %}
+	{"dopri5_lyap", py_dopri5_lyap, METH_VARARGS, NULL},
+	{% endif %}
+	{% endif %}
 	{% if has_Jacobian: %}
-	{"jac", py_jac, METH_VARARGS, NULL},
+	{"jac", (PyCFunction) py_jac, CALLING_CONVENTION, NULL},
+	{% endif %}
+	{% if batch_size: %}
+	{"f_batch", py_f_batch, METH_VARARGS, NULL},
+	{% endif %}
+	{% if instrument: %}
+	{"stats", py_stats, METH_NOARGS, NULL},
+	{"reset_stats", py_reset_stats, METH_NOARGS, NULL},
 	{% endif %}
 	{NULL, NULL, 0, NULL}
 };
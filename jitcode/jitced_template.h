@@ -0,0 +1,59 @@
+# pragma GCC diagnostic push
+# pragma GCC diagnostic ignored "-pedantic"
+# define NPY_NO_DEPRECATED_API NPY_1_8_API_VERSION
+# include <Python.h>
+# include <numpy/arrayobject.h>
+# pragma GCC diagnostic pop
+
+# include <math.h>
+
+# pragma GCC diagnostic push
+# pragma GCC diagnostic ignored "-Wunused-parameter"
+
+static unsigned int const dimension={{n}};
+
+# define get_general_helper(i) ((general_helper[i]))
+# define set_general_helper(i,value) (general_helper[i] = value)
+
+# define get_f_helper(i) ((f_helper[i]))
+# define set_f_helper(i,value) (f_helper[i] = value)
+
+{% if has_Jacobian: %}
+# define get_jac_helper(i) ((jac_helper[i]))
+# define set_jac_helper(i,value) (jac_helper[i] = value)
+{% endif %}
+
+# define cse_array(number) double cse[number]
+# define get_cse(i) ((cse[i]))
+# define set_cse(i,value) (cse[i] = value)
+
+# define motif_index(j) (motif_indices[instance][j])
+# define motif_constant(j) (motif_constants[instance][j])
+
+# define get_coupling(i) ((coupling_value[i]))
+# define set_coupling(i,value) (coupling_value[i] = value)
+# define add_to_coupling(i,value) (coupling_value[i] += value)
+# define set_coupling_factor(i,value) (coupling_factor[i] = value)
+
+# define y(i) (Y[i])
+
+# define control_par(i) (control_pars[i])
+# define control_par_array(i, j) (control_par_arrays[i][j])
+
+# define set_dy(i, value) (dY[i] = value)
+
+{% if tangent_dynamics: %}
+# define add_to_dy(i, value) (dY[i] += value)
+# define get_tangent_jac(i) (tangent_jac[i])
+# define set_tangent_jac(i, value) (tangent_jac[i] = value)
+{% endif %}
+
+{% if has_Jacobian: %}
+{% if jac_band: %}
+#define set_dfdy(i, j, value) (dfdY[((i)-(j)+{{jac_band[1]}})*dimension+(j)] = value)
+#define add_to_dfdy(i, j, value) (dfdY[((i)-(j)+{{jac_band[1]}})*dimension+(j)] += value)
+{% else: %}
+#define set_dfdy(i, j, value) (dfdY[(i)*dimension+(j)] = value)
+#define add_to_dfdy(i, j, value) (dfdY[(i)*dimension+(j)] += value)
+{% endif %}
+{% endif %}
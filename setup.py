@@ -18,7 +18,7 @@ setup(
 	author_email = 'gansmann@uni-bonn.de',
 	url = 'http://github.com/neurophysik/jitcode',
 	packages = ['jitcode'],
-	package_data = {'jitcode': ['jitced_template.c']},
+	package_data = {'jitcode': ['jitced_template.c', 'jitced_template.h']},
 	include_package_data = True,
 	install_requires = requirements,
 	setup_requires = ['setuptools_scm'],
@@ -5,6 +5,12 @@ from jitcode._helpers import *
 import numpy as np
 from numpy.testing import assert_allclose
 import unittest
+import pickle
+import json
+import sympy
+import shutil
+from os import path
+from tempfile import mkdtemp
 
 class OrdersTest(unittest.TestCase):
 	def test_remove_suffix(self):
@@ -31,6 +37,21 @@ class OrdersTest(unittest.TestCase):
 		average = np.average(n_vectors, axis=0)
 		assert_allclose( average, np.zeros(d), rtol=0, atol=0.01 )
 	
+	def test_banded_from_dense(self):
+		A = np.array([
+			[ 1, 2, 0, 0 ],
+			[ 3, 4, 5, 0 ],
+			[ 6, 7, 8, 9 ],
+			[ 0,10,11,12 ],
+			])
+		banded = np.array([
+			[ 0, 2, 5, 9 ],
+			[ 1, 4, 8,12 ],
+			[ 3, 7,11, 0 ],
+			[ 6,10, 0, 0 ],
+			])
+		assert_allclose( banded_from_dense(A,2,1), banded )
+	
 	def test_orthonormalise_1(self):
 		vectors = [ np.array([3.0,4.0]) ]
 		norms = orthonormalise(vectors)
@@ -71,5 +92,89 @@ class OrdersTest(unittest.TestCase):
 		assert_allclose( vectors[1], np.array([np.sqrt(0.5),-np.sqrt(0.5)]) )
 		assert_allclose( norms, np.array([np.sqrt(2),np.sqrt(0.5)]) )
 
+	def test_orthonormalise_qr(self):
+		vectors = np.array([ [1.0,1.0,0.0], [1.0,0.0,2.0] ])
+		norms = orthonormalise_qr(vectors)
+		assert_allclose( vectors[0], np.array([np.sqrt(0.5),np.sqrt(0.5),0.0]) )
+		assert_allclose( vectors[1], np.array([1.0,-1.0,4.0])/np.sqrt(18) )
+		assert_allclose( norms, np.array([np.sqrt(2),np.sqrt(4.5)]) )
+	
+	def test_orthonormalise_qr_like_gram_schmidt(self):
+		vectors = np.random.normal(0,1,(5,8))
+		control = [ vector.copy() for vector in vectors ]
+		assert_allclose( orthonormalise_qr(vectors), orthonormalise(control) )
+		assert_allclose( vectors, np.array(control), atol=1e-10 )
+		assert_allclose( vectors.dot(vectors.T), np.identity(5), atol=1e-10 )
+	
+	def test_orthonormalise_qr_dependents(self):
+		vectors = np.random.normal(0,1,(3,6))
+		dependent = np.array([ vectors, 2*vectors ])
+		orthonormalise_qr(vectors, [dependent])
+		assert_allclose( dependent[0], vectors, atol=1e-10 )
+		assert_allclose( dependent[1], 2*vectors, atol=1e-10 )
+	
+	def test_expression_store(self):
+		y = sympy.Function("y")
+		expressions = [ y(0)*sympy.sin(y(1)), y(1)**2, sympy.Integer(3) ]
+		directory = mkdtemp()
+		store = expression_store(iter(expressions), path.join(directory,"store"))
+		self.assertEqual( len(store), 3 )
+		self.assertEqual( list(store()), expressions )
+		self.assertEqual( list(store()), expressions )
+		shutil.rmtree(directory)
+	
+	def test_motifs(self):
+		y = sympy.Function("y")
+		set_dy = sympy.Function("set_dy")
+		expressions = [
+				set_dy(2*i, 0.5*i*y(2*i+1)**2 - 3*y(2*i) + 0.1)
+				for i in range(1,4)
+			] + [ set_dy(1, y(0)**2) ]
+		motifs = collect_motifs(iter(expressions), ["y","set_dy"])
+		self.assertEqual( list(map(len,motifs.values())), [3,1] )
+		self.assertEqual(
+				[
+					fill_in_motif(template,*instance)
+					for template,instances in motifs.items()
+					for instance in instances
+				],
+				expressions
+			)
+		
+		template,instances = next(iter(motifs.items()))
+		code = render_motif(template, instances, {"y":"y","set_dy":"set_dy"})
+		self.assertIn( "motif_indices[3][3]", code )
+		self.assertIn( "motif_constants[3][1]", code )
+		self.assertIn( "0.1", code )
+	
+	def test_build_statistics(self):
+		statistics = build_statistics()
+		statistics.add("ignored", 1)
+		with statistics.stage("outer"):
+			statistics.add("expressions", 2)
+			with statistics.stage("inner"):
+				statistics.add("expressions", 3)
+				statistics.add("units", "a.c")
+				with statistics.stage("inner"):
+					statistics.add("expressions", 4)
+		outer, inner = statistics.stages
+		self.assertEqual( outer["expressions"], 9 )
+		self.assertEqual( inner["expressions"], 7 )
+		self.assertEqual( inner["units"], ["a.c"] )
+		self.assertEqual( inner["parent"], "outer" )
+		self.assertIsNone( outer["parent"] )
+		self.assertGreaterEqual( outer["wall_time"], inner["wall_time"] )
+		self.assertEqual( json.loads(statistics.to_json())["stages"], [outer,inner] )
+	
+	def test_map_in_parallel(self):
+		for n_jobs in [1,2,None]:
+			result = list(map_in_parallel(abs, range(-50,50), n_jobs=n_jobs, chunk_size=7))
+			self.assertEqual( result, list(map(abs,range(-50,50))) )
+	
+	def test_pickle_undefined_function(self):
+		y = sympy.Function("y")
+		expression = y(0)**2 + sympy.sin(y(1))
+		self.assertEqual( pickle.loads(pickle.dumps(expression)), expression )
+
 
 unittest.main(buffer=True)
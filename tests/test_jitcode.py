@@ -2,15 +2,21 @@
 # -*- coding: utf-8 -*-
 
 import os
+import json
+import logging
 from jitcode import jitcode, jitcode_lyap, provide_basic_symbols, ode_from_module_file, convert_to_required_symbols
-from jitcode._jitcode import _is_C, _is_lambda, _sort_helpers
+from jitcode._jitcode import _is_C, _is_lambda, _sort_helpers, _jac_from_f_with_helpers, _register_integrator, native_dopri5
+from jitcode._helpers import banded_from_dense
 import numpy as np
 from numpy.testing import assert_allclose
 from scipy.stats import sem as standard_error
+from scipy.sparse import csr_matrix
+from scipy.integrate._ode import IntegratorBase
 import shutil
 import unittest
+import warnings
 from tempfile import mkdtemp
-from sympy import symbols
+from sympy import symbols, Sum, Function
 from random import shuffle
 
 # control values:
@@ -101,6 +107,24 @@ class basic_test(unittest.TestCase):
 		self.assertTrue(_is_C(self.ODE.f))
 		self.assertTrue(_is_C(self.ODE.jac))
 	
+	def test_chunkwise_cse(self):
+		self.ODE = jitcode(**self.argdict)
+		self.ODE.generate_f_C(chunk_size=2,do_cse="chunk")
+		self.ODE.generate_jac_C(chunk_size=3,do_cse="chunk")
+		self.ODE.set_integrator('vode')
+		self.ODE.set_initial_value(y0,0.0)
+		self.assertTrue(_is_C(self.ODE.f))
+		self.assertTrue(_is_C(self.ODE.jac))
+	
+	def test_motifs(self):
+		self.ODE = jitcode(**self.argdict)
+		self.ODE.generate_f_C(chunk_size=1,motifs=True)
+		self.ODE.generate_jac_C(chunk_size=2,motifs=True)
+		self.ODE.set_integrator('vode')
+		self.ODE.set_initial_value(y0,0.0)
+		self.assertTrue(_is_C(self.ODE.f))
+		self.assertTrue(_is_C(self.ODE.jac))
+	
 	def test_heavily_chunked_helpers(self):
 		self.ODE = jitcode(**self.argdict)
 		self.ODE.generate_helpers_C(chunk_size=1)
@@ -109,6 +133,49 @@ class basic_test(unittest.TestCase):
 		self.assertTrue(_is_C(self.ODE.f))
 		self.assertTrue(_is_C(self.ODE.jac))
 	
+	def test_cheap_simplification(self):
+		self.ODE = jitcode(**self.argdict)
+		self.ODE.generate_f_C(simplify="cheap")
+		self.ODE.generate_jac_sym(simplify="cheap")
+		self.ODE.set_integrator('vode')
+		self.ODE.set_initial_value(y0,0.0)
+		self.assertTrue(_is_C(self.ODE.f))
+	
+	def test_simplification_budget(self):
+		self.ODE = jitcode(verbose=False, **self.argdict)
+		self.ODE.generate_f_C(simplify_budget=0)
+		self.ODE.set_integrator('dopri5')
+		self.ODE.set_initial_value(y0,0.0)
+		report = self.ODE.simplification_report()
+		self.assertEqual( len(report), len(f) )
+		self.assertTrue( all(fell_back for _,_,fell_back in report) )
+	
+	def test_parallel_generation(self):
+		self.ODE = jitcode(**self.argdict)
+		self.ODE.generate_f_C(chunk_size=1, n_jobs=2)
+		self.ODE.generate_jac_C(chunk_size=2, n_jobs=2)
+		self.ODE.set_integrator('vode')
+		self.ODE.set_initial_value(y0,0.0)
+		self.assertTrue(_is_C(self.ODE.f))
+		self.assertTrue(_is_C(self.ODE.jac))
+	
+	def test_separate_units(self):
+		self.ODE = jitcode(**self.argdict)
+		self.ODE.generate_helpers_C(chunk_size=1)
+		self.ODE.generate_f_C(chunk_size=1)
+		self.ODE.generate_jac_C(chunk_size=1)
+		self.ODE.compile_C(n_jobs=2)
+		self.ODE.set_integrator('vode')
+		self.ODE.set_initial_value(y0,0.0)
+		self.assertTrue(_is_C(self.ODE.f))
+		self.assertTrue(_is_C(self.ODE.jac))
+	
+	def test_native_integrator(self):
+		self.ODE = jitcode(**self.argdict)
+		self.ODE.set_integrator('native_dopri5')
+		self.ODE.set_initial_value(y0,0.0)
+		self.assertTrue(_is_C(self.ODE.f))
+	
 	def test_initial_value_first(self):
 		self.ODE = jitcode(**self.argdict)
 		self.ODE.set_initial_value(y0,0.0)
@@ -221,6 +288,258 @@ class basic_test(unittest.TestCase):
 		assert_allclose( self.ODE.integrate(1.0), y1, rtol=1e-5 )
 		shutil.rmtree(self.directory)
 
+class banded_test(unittest.TestCase):
+	def test_detected_band(self):
+		ODE = jitcode(f)
+		ODE.generate_jac_C(banded=True)
+		ODE.set_integrator("lsoda")
+		ODE.set_initial_value(y0,0.0)
+		self.assertTrue(_is_C(ODE.jac))
+		self.assertEqual( (ODE._integrator.ml, ODE._integrator.mu), (2,2) )
+		assert_allclose( ODE.jac(0.0,y0), banded_from_dense(jac_of_y0,2,2), rtol=1e-5 )
+		assert_allclose( ODE.integrate(1.0), y1, rtol=1e-5 )
+	
+	def test_given_band(self):
+		ODE = jitcode(f)
+		ODE.generate_jac_C(banded=(3,2))
+		ODE.set_integrator("vode")
+		ODE.set_initial_value(y0,0.0)
+		self.assertEqual( (ODE._integrator.ml, ODE._integrator.mu), (3,2) )
+		assert_allclose( ODE.jac(0.0,y0), banded_from_dense(jac_of_y0,3,2), rtol=1e-5 )
+		assert_allclose( ODE.integrate(1.0), y1, rtol=1e-5 )
+	
+	def test_lambda_with_band(self):
+		ODE = jitcode(f)
+		ODE.generate_jac_C(banded=True)
+		ODE.generate_jac_sym()
+		ODE.generate_jac_lambda()
+		assert_allclose( ODE.jac(0.0,y0), banded_from_dense(jac_of_y0,2,2), rtol=1e-5 )
+	
+	def test_too_narrow_band(self):
+		ODE = jitcode(f)
+		with self.assertRaises(ValueError):
+			ODE.generate_jac_C(banded=(1,1))
+
+class output_test(unittest.TestCase):
+	def setUp(self):
+		self.ODE = jitcode(f)
+		self.ODE.generate_jac_C()
+		self.ODE.compile_C()
+	
+	def test_f(self):
+		dY = np.empty(len(f))
+		self.assertIs( self.ODE.f(0.0,y0,out=dY), dY )
+		assert_allclose( dY, f_of_y0, rtol=1e-5 )
+	
+	def test_jac(self):
+		dfdY = np.zeros((len(f),len(f)))
+		for _ in range(2):
+			self.assertIs( self.ODE.jac(0.0,y0,out=dfdY), dfdY )
+			assert_allclose( dfdY, jac_of_y0, rtol=1e-5 )
+	
+	def test_wrong_output(self):
+		with self.assertRaises(ValueError):
+			self.ODE.f(0.0,y0,out=np.empty(len(f)+1))
+		with self.assertRaises(ValueError):
+			self.ODE.jac(0.0,y0,out=np.zeros((len(f),len(f)))[:,::2])
+		with self.assertRaises(TypeError):
+			self.ODE.f(0.0,y0,output=np.empty(len(f)))
+
+class numpy_lambdas_test(unittest.TestCase):
+	def setUp(self):
+		self.ODE = jitcode(f_alt, get_f_alt_helpers(), wants_jacobian=True)
+		self.ODE.generate_lambdas()
+	
+	def test_output(self):
+		dY = np.empty(len(f))
+		self.assertIs( self.ODE.f(0.0,y0,out=dY), dY )
+		assert_allclose( dY, f_of_y0, rtol=1e-5 )
+		dfdY = np.zeros((len(f),len(f)))
+		self.assertIs( self.ODE.jac(0.0,y0,out=dfdY), dfdY )
+		assert_allclose( dfdY, jac_of_y0, rtol=1e-5 )
+	
+	def test_several_states(self):
+		Y = np.random.random((len(f),5))
+		dY = self.ODE.f(0.0,Y)
+		dfdY = self.ODE.jac(0.0,Y)
+		for k in range(Y.shape[1]):
+			assert_allclose( dY[:,k], self.ODE.f(0.0,Y[:,k]) )
+			assert_allclose( dfdY[:,:,k], self.ODE.jac(0.0,Y[:,k]) )
+
+class batch_test(unittest.TestCase):
+	def check_batch(self, ODE):
+		Y = np.random.random((len(f),13))
+		control = np.array([ ODE.f(0.0,Y[:,k].copy()) for k in range(Y.shape[1]) ]).T
+		assert_allclose( ODE.f_batch(0.0,Y), control )
+		assert_allclose( ODE.f_batch(0.0,Y.T), control.T )
+		assert_allclose( ODE.f(0.0,y0), f_of_y0, rtol=1e-5 )
+	
+	def test_batch(self):
+		ODE = jitcode(f)
+		ODE.compile_C(batch=True)
+		self.check_batch(ODE)
+	
+	def test_batch_with_helpers_and_chunks(self):
+		ODE = jitcode(f_alt, get_f_alt_helpers())
+		ODE.generate_helpers_C(chunk_size=2)
+		ODE.generate_f_C(chunk_size=1, do_cse=True)
+		ODE.compile_C(batch=4, n_jobs=2)
+		self.check_batch(ODE)
+	
+	def test_batch_with_chunkwise_cse(self):
+		ODE = jitcode(f_alt, get_f_alt_helpers())
+		ODE.generate_f_C(chunk_size=2, do_cse="chunk")
+		ODE.compile_C(batch=4)
+		self.check_batch(ODE)
+	
+	def test_batch_with_motifs(self):
+		ODE = jitcode(f)
+		ODE.generate_f_C(motifs=True)
+		ODE.compile_C(batch=True)
+		self.check_batch(ODE)
+	
+	def test_wrong_shape(self):
+		ODE = jitcode(f)
+		ODE.compile_C(batch=True)
+		with self.assertRaises(ValueError):
+			ODE.f_batch(0.0, np.random.random((len(f)+1,3)))
+
+class control_pars_test(unittest.TestCase):
+	def setUp(self):
+		a, h = symbols("a, h")
+		omega = Function("omega")
+		self.args = {
+				"f_sym": [ -omega(0)*y(1) + a*y(0), omega(1)*y(0) - h, a*y(2) ],
+				"helpers": [ (h, omega(2)*y(2)) ],
+				"control_pars": [omega, a],
+			}
+		self.omega = np.array([1.0, 2.0, 3.0])
+		self.a = 0.7
+		self.y = np.array([0.5, 0.3, 0.2])
+		self.f_control = np.array([ 0.05, 0.4, 0.14 ])
+		self.jac_control = np.array([ [0.7,-1.0,0.0], [2.0,0.0,-3.0], [0.0,0.0,0.7] ])
+	
+	def check(self, ODE):
+		assert_allclose( ODE.f(0.0,self.y,self.omega,self.a), self.f_control )
+		assert_allclose( ODE.jac(0.0,self.y,self.omega,self.a), self.jac_control )
+		self.omega[0] = 5.0
+		assert_allclose( ODE.f(0.0,self.y,self.omega,self.a)[0], -1.15 )
+	
+	def test_compiled(self):
+		ODE = jitcode(**self.args)
+		ODE.set_parameters(self.omega, self.a)
+		ODE.set_integrator("vode")
+		self.assertTrue(_is_C(ODE.f))
+		self.assertIs(ODE.f_params[0], self.omega)
+		self.check(ODE)
+	
+	def test_chunked(self):
+		ODE = jitcode(**self.args)
+		ODE.generate_helpers_C(chunk_size=1)
+		ODE.generate_f_C(chunk_size=1)
+		ODE.generate_jac_C(chunk_size=1)
+		ODE.compile_C()
+		self.check(ODE)
+	
+	def test_lambdas(self):
+		ODE = jitcode(wants_jacobian=True, **self.args)
+		ODE.generate_lambdas()
+		self.check(ODE)
+	
+	def test_parameter_sweep(self):
+		ODE = jitcode(**self.args)
+		for integrator in ["dopri5", "native_dopri5"]:
+			ODE.set_integrator(integrator)
+			results = []
+			for a in [0.1, 0.2]:
+				ODE.set_parameters(self.omega, a)
+				ODE.set_initial_value(self.y, 0.0)
+				results.append(ODE.integrate(1.0))
+			assert_allclose( results[0][2], 0.2*np.exp(0.1) )
+			assert_allclose( results[1][2], 0.2*np.exp(0.2) )
+	
+	def test_errors(self):
+		ODE = jitcode(**self.args)
+		ODE.compile_C()
+		with self.assertRaises(ValueError):
+			ODE.f(0.0, self.y, self.omega[:2], self.a)
+		with self.assertRaises(ValueError):
+			ODE.set_parameters(self.omega)
+
+class couplings_test(unittest.TestCase):
+	# the same system as f with the coupling between y(0) and y(2) realised as a coupling operator
+	def setUp(self):
+		exchange = Function("exchange")
+		self.args = {
+				"f_sym": [
+					y(0) * ( a-y(0) ) * ( y(0)-1.0 ) - y(1) + k * (exchange(0) - y(0)),
+					b1*y(0) - c*y(1),
+					y(2) * ( a-y(2) ) * ( y(2)-1.0 ) - y(3) + k * (exchange(1) - y(2)),
+					b2*y(2) - c*y(3)
+				],
+				"couplings": [( exchange, csr_matrix([[0.0,1.0],[1.0,0.0]]), [0,2] )],
+			}
+	
+	def check(self, ODE):
+		assert_allclose( ODE.f(0.0,y0), f_of_y0, rtol=1e-5 )
+		assert_allclose( ODE.jac(0.0,y0), jac_of_y0, rtol=1e-5 )
+	
+	def test_compiled(self):
+		ODE = jitcode(wants_jacobian=True, **self.args)
+		ODE.compile_C()
+		self.check(ODE)
+		out = np.zeros((len(f),len(f)))
+		ODE.jac(0.0,y0,out=out)
+		ODE.jac(0.0,y0,out=out)
+		assert_allclose( out, jac_of_y0, rtol=1e-5 )
+	
+	def test_chunked_with_motifs(self):
+		ODE = jitcode(**self.args)
+		ODE.generate_f_C(chunk_size=1, motifs=True)
+		ODE.generate_jac_C(chunk_size=1, motifs=True)
+		ODE.compile_C(n_jobs=2)
+		self.check(ODE)
+	
+	def test_lambdas(self):
+		ODE = jitcode(wants_jacobian=True, **self.args)
+		ODE.generate_lambdas()
+		self.check(ODE)
+	
+	def test_banded(self):
+		ODE = jitcode(**self.args)
+		ODE.generate_jac_C(banded=True)
+		ODE.compile_C()
+		self.assertEqual( ODE._jac_band, (2,2) )
+		assert_allclose( ODE.jac(0.0,y0), banded_from_dense(jac_of_y0,2,2), rtol=1e-5 )
+	
+	def test_batch(self):
+		ODE = jitcode(**self.args)
+		ODE.compile_C(batch=True)
+		Y = np.random.random((len(f),5))
+		control = np.array([ ODE.f(0.0,Y[:,i].copy()) for i in range(5) ]).T
+		assert_allclose( ODE.f_batch(0.0,Y), control )
+	
+	def test_sparsity(self):
+		ODE = jitcode(**self.args)
+		assert_allclose( ODE.get_jac_sparsity().toarray(), jac_of_y0!=0 )
+	
+	def test_integration(self):
+		ODE = jitcode(**self.args)
+		ODE.set_integrator("vode")
+		ODE.set_initial_value(y0,0.0)
+		assert_allclose( ODE.integrate(1.0), y1, rtol=1e-5 )
+	
+	def test_errors(self):
+		exchange = self.args["couplings"][0][0]
+		h = symbols("h")
+		with self.assertRaises(ValueError):
+			jitcode(f, helpers=[(h,exchange(0))], couplings=self.args["couplings"])
+		with self.assertRaises(ValueError):
+			jitcode(f, couplings=[( exchange, np.identity(2), [0,1,2] )])
+		ODE = jitcode([exchange(2),y(1),y(2),y(3)], couplings=self.args["couplings"])
+		with self.assertRaises(ValueError):
+			ODE.generate_f_C()
+
 f1, f2, f3, f4 = symbols("f1, f2, f3, f4")
 coupling, first_y, first_y_sq = symbols("coupling, first_y, first_y_sq")
 a_alt, b1_alt, b2_alt, c_alt, k_alt = symbols("a_alt, b1_alt, b2_alt, c_alt, k_alt")
@@ -257,6 +576,31 @@ class helpers_test(unittest.TestCase):
 		with self.assertRaises(ValueError):
 			_sort_helpers(cyclic_helpers)
 	
+	def test_sorting_names_cycle(self):
+		p, q, r, s = symbols("p, q, r, s")
+		helpers = [ [s,p+1], [p,q], [q,p] ]
+		with self.assertRaises(ValueError) as context:
+			_sort_helpers(helpers)
+		self.assertTrue( str(context.exception).endswith("p, q") )
+	
+	def test_sorting_long_chain(self):
+		chain = symbols("h_0:3000")
+		helpers = [ (chain[i],chain[i-1]+1) for i in range(1,3000) ] + [(chain[0],t)]
+		shuffle(helpers)
+		sorted_helpers = _sort_helpers(helpers)
+		self.assertEqual( [ helper[0] for helper in sorted_helpers ], list(chain) )
+	
+	def test_jacobian_with_chained_helpers(self):
+		p, q, r = symbols("p, q, r")
+		helpers = [ (p,y(0)*y(1)), (q,p**2+y(2)), (r,q*p) ]
+		f_sym = [ r+y(0), q*y(1), p, y(2) ]
+		jac = _jac_from_f_with_helpers(lambda: iter(f_sym), helpers, False, 4)
+		substituted = [ entry.subs(list(reversed(helpers))) for entry in f_sym ]
+		for line,entry in zip(jac,substituted):
+			for j,jac_entry in enumerate(line):
+				control = entry.diff(y(j))
+				self.assertEqual( (jac_entry.subs(list(reversed(helpers)))-control).expand(), 0 )
+	
 	def test_identity_of_jacs(self):
 		x = np.random.random(len(f))
 		ODE1 = jitcode(f)
@@ -274,6 +618,106 @@ class helpers_test(unittest.TestCase):
 		ODE2.set_integrator("dopri5")
 		assert_allclose(ODE1.f(0.0,x), ODE2.f(0.0,x))
 
+	def test_identity_of_parallel_code(self):
+		helpers = get_f_alt_helpers()
+		ODE1 = jitcode(f_alt, list(helpers))
+		ODE2 = jitcode(f_alt, list(helpers))
+		for ODE,n_jobs in [(ODE1,1), (ODE2,3)]:
+			ODE.generate_helpers_C(chunk_size=2, n_jobs=n_jobs)
+			ODE.generate_f_C(chunk_size=2, n_jobs=n_jobs)
+			ODE.generate_jac_C(chunk_size=3, n_jobs=n_jobs)
+		filenames = sorted(os.listdir(ODE1._tmpfile()))
+		self.assertEqual(filenames, sorted(os.listdir(ODE2._tmpfile())))
+		self.assertIn("definitions_jac_1.c", filenames)
+		for filename in filenames:
+			with open(ODE1._tmpfile(filename)) as file1, open(ODE2._tmpfile(filename)) as file2:
+				self.assertEqual(file1.read(), file2.read())
+
+	def test_jac_sparsity(self):
+		for ODE in [ jitcode(f), jitcode(f_alt, get_f_alt_helpers()) ]:
+			sparsity = ODE.get_jac_sparsity()
+			self.assertEqual(sparsity.shape, (len(f),len(f)))
+			assert_allclose(sparsity.toarray(), jac_of_y0!=0)
+	
+	def test_jac_sparsity_with_symbolic_index(self):
+		i = symbols("i", integer=True)
+		def f_with_sum():
+			yield y(0)
+			yield Sum(y(i),(i,0,2))
+			yield y(1)
+		ODE = jitcode(f_with_sum)
+		assert_allclose(
+			ODE.get_jac_sparsity().toarray(),
+			[ [1,0,0], [1,1,1], [0,1,0] ]
+			)
+
+class grid_test(unittest.TestCase):
+	def setUp(self):
+		self.times = np.linspace(0.0,1.0,11)
+	
+	def test_integrators(self):
+		ODE = jitcode(f)
+		for integrator in ["dopri5", "vode", "native_dopri5"]:
+			ODE.set_integrator(integrator)
+			ODE.set_initial_value(y0,0.0)
+			data = ODE.integrate_grid(self.times)
+			self.assertEqual(data.shape, (len(self.times),len(f)))
+			assert_allclose(data[0], y0)
+			assert_allclose(data[-1], y1, rtol=1e-5)
+			self.assertEqual(ODE.t, 1.0)
+	
+	def test_native_identical_to_loop(self):
+		ODE = jitcode(f)
+		ODE.set_integrator("native_dopri5")
+		ODE.set_initial_value(y0,0.0)
+		control = np.vstack([ ODE.integrate(time) for time in self.times ])
+		ODE.set_initial_value(y0,0.0)
+		out = np.empty((len(self.times),len(f)))
+		data = ODE.integrate_grid(self.times, out=out)
+		self.assertIs(data, out)
+		assert_allclose(data, control, rtol=1e-12)
+		assert_allclose(ODE.integrate_grid([2.0])[0], ODE._y)
+	
+	def test_lyapunov(self):
+		ODE = jitcode_lyap(f, n_lyap=2)
+		ODE.set_integrator("native_dopri5")
+		ODE.set_initial_value(y0,0.0)
+		states, local_lyaps = ODE.integrate_grid(self.times[1:])
+		self.assertEqual(states.shape, (len(self.times)-1,len(f)))
+		self.assertEqual(local_lyaps.shape, (len(self.times)-1,2))
+		assert_allclose(states[-1], y1, rtol=1e-5)
+	
+	def test_exceeded_steps(self):
+		times = 100*self.times
+		for integrator in ["native_dopri5", "lsoda", "dopri5"]:
+			ODE = jitcode(f)
+			ODE.set_integrator(integrator, nsteps=5)
+			ODE.set_initial_value(y0,0.0)
+			with warnings.catch_warnings():
+				warnings.simplefilter("ignore")
+				data = ODE.integrate_grid(times)
+			assert_allclose(data[0], y0)
+			self.assertTrue( np.all(np.isnan(data[-2:])) )
+			self.assertFalse( ODE.successful() )
+	
+	def test_lyapunov_exceeded_steps(self):
+		ODE = jitcode_lyap(f, n_lyap=2)
+		ODE.set_integrator("lsoda", nsteps=5)
+		ODE.set_initial_value(y0,0.0)
+		with warnings.catch_warnings():
+			warnings.simplefilter("ignore")
+			states, local_lyaps = ODE.integrate_grid(100*self.times[1:])
+		self.assertTrue( np.all(np.isnan(states[-2:])) )
+		self.assertTrue( np.all(np.isnan(local_lyaps[-2:])) )
+		self.assertFalse( ODE.successful() )
+	
+	def test_unsorted(self):
+		ODE = jitcode(f)
+		ODE.set_integrator("dopri5")
+		ODE.set_initial_value(y0,0.0)
+		with self.assertRaises(ValueError):
+			ODE.integrate_grid([1.0,3.0,2.0])
+
 class lyapunov_test(unittest.TestCase):
 	def setUp(self):
 		self.n = len(f)
@@ -286,6 +730,10 @@ class lyapunov_test(unittest.TestCase):
 		self.ODE = jitcode_lyap(f, n_lyap=self.n)
 		self.ODE.set_integrator("vode")
 	
+	def test_lyapunov_with_lsoda(self):
+		self.ODE = jitcode_lyap(f, n_lyap=self.n)
+		self.ODE.set_integrator("lsoda")
+	
 	def test_lyapunov_with_helpers(self):
 		self.ODE = jitcode_lyap(f_alt, get_f_alt_helpers(), n_lyap=self.n)
 		self.ODE.set_integrator("dopri5")
@@ -294,6 +742,10 @@ class lyapunov_test(unittest.TestCase):
 		self.ODE = jitcode_lyap(f_alt, get_f_alt_helpers(), n_lyap=self.n)
 		self.ODE.set_integrator("vode")
 	
+	def test_lyapunov_with_native_integrator(self):
+		self.ODE = jitcode_lyap(f, n_lyap=self.n)
+		self.ODE.set_integrator("native_dopri5")
+	
 	def tearDown(self):
 		self.ODE.set_initial_value(y0,0.0)
 		data = np.vstack(self.ODE.integrate(t) for t in range(10,100000,10))
@@ -303,6 +755,98 @@ class lyapunov_test(unittest.TestCase):
 		for i in range(self.n):
 			self.assertLess( result[i]-lyaps[i], 3*margin[i] )
 
+class integrate_lyap_test(unittest.TestCase):
+	def setUp(self):
+		self.n = len(f)
+		self.renorm_interval = 10
+		self.max_growth = None
+	
+	def test_native_integrator(self):
+		self.ODE = jitcode_lyap(f, n_lyap=self.n)
+		self.ODE.set_integrator("native_dopri5")
+	
+	def test_vode(self):
+		self.ODE = jitcode_lyap(f, n_lyap=self.n)
+		self.ODE.set_integrator("vode", nsteps=10000)
+	
+	def test_adaptive_interval(self):
+		self.ODE = jitcode_lyap(f, n_lyap=self.n)
+		self.ODE.set_integrator("native_dopri5")
+		self.renorm_interval = 1
+		self.max_growth = 5
+	
+	def test_lsoda_with_reduced_orders(self):
+		self.ODE = jitcode_lyap(f, n_lyap=self.n)
+		self.ODE.set_integrator("lsoda", max_order_ns=4, max_order_s=2)
+	
+	def test_vode_with_reduced_order(self):
+		self.ODE = jitcode_lyap(f, n_lyap=self.n)
+		self.ODE.set_integrator("vode", order=3, nsteps=10000)
+	
+	def test_unexpected_work_array(self):
+		self.ODE = jitcode_lyap(f, n_lyap=self.n)
+		self.ODE.set_integrator("lsoda")
+		self.ODE.set_initial_value(y0,0.0)
+		self.ODE.integrate(1.0)
+		self.ODE._integrator.rwork = self.ODE._integrator.rwork[:20]
+		self.ODE._renormalise()
+		self.assertGreater(len(self.ODE._integrator.rwork), 20)
+	
+	def tearDown(self):
+		self.ODE.set_initial_value(y0,0.0)
+		result, stats = self.ODE.integrate_lyap(
+				99990, transient = 10000,
+				renorm_interval = self.renorm_interval,
+				max_growth = self.max_growth,
+				statistics = True
+			)
+		self.assertEqual(self.ODE.t, 109990)
+		margin = stats["standard_error"]
+		self.assertLess( np.max(margin), 0.003 )
+		for i in range(self.n):
+			self.assertLess( result[i]-lyaps[i], 3*margin[i] )
+		if self.max_growth is None:
+			self.assertEqual(stats["renormalisations"], 9999)
+		else:
+			self.assertNotEqual(stats["renorm_interval"], self.renorm_interval)
+
+class integrate_lyap_failure_test(unittest.TestCase):
+	def test_exceeded_steps(self):
+		for integrator in ["native_dopri5", "lsoda", "dopri5"]:
+			ODE = jitcode_lyap(f, n_lyap=len(f))
+			ODE.set_integrator(integrator, nsteps=5)
+			ODE.set_initial_value(y0,0.0)
+			with warnings.catch_warnings(record=True) as caught:
+				warnings.simplefilter("always")
+				result, stats = ODE.integrate_lyap(1000, renorm_interval=100, statistics=True)
+			self.assertTrue( np.all(np.isnan(result)) )
+			self.assertTrue( np.all(np.isnan(stats["standard_error"])) )
+			self.assertLess( ODE.t, 1000 )
+			self.assertFalse( ODE.successful() )
+			self.assertLess( len(caught), 10 )
+			self.assertTrue(any( "integrate_lyap" in str(warning.message) for warning in caught ))
+
+class tangent_dynamics_test(unittest.TestCase):
+	def test_compiled_identical_to_lambda(self):
+		Y = np.random.random(len(f)*4)
+		control = jitcode_lyap(f_alt, get_f_alt_helpers(), n_lyap=3)
+		control.generate_f_lambda()
+		ODE = jitcode_lyap(f_alt, get_f_alt_helpers(), n_lyap=3)
+		ODE.compile_C(batch=True)
+		assert_allclose( ODE.f(0.0,Y), control.f(0.0,Y) )
+		assert_allclose( ODE.f_batch(0.0,np.vstack([Y,Y]).T)[:,1], control.f(0.0,Y) )
+	
+	def test_lambda_identical_to_full(self):
+		Y = np.random.random((len(f)*4,2))
+		control = jitcode_lyap(f_alt, get_f_alt_helpers(), n_lyap=3)
+		jitcode.generate_f_lambda(control)
+		ODE = jitcode_lyap(f_alt, get_f_alt_helpers(), n_lyap=3)
+		ODE.generate_f_lambda()
+		assert_allclose( ODE.f(0.0,Y), control.f(0.0,Y) )
+		out = np.empty(len(f)*4)
+		self.assertIs( ODE.f(0.0,Y[:,0],out=out), out )
+		assert_allclose( out, control.f(0.0,Y[:,0]) )
+
 dynvars = x_1,y_1,x_2,y_2 = symbols("x, y, y_1, y_2")
 f_dv_helpers = [
 	( coupling, k*(x_2-x_1) ),
@@ -328,6 +872,175 @@ class basic_test_with_generator_function(basic_test):
 	def setUpClass(self):
 		self.argdict = {"f_sym": f_generator, "n": 4}
 
+class basic_test_with_stored_generator_function(basic_test):
+	@classmethod
+	def setUpClass(self):
+		self.argdict = {"f_sym": f_generator, "store_f_sym": True}
+
+class store_test(unittest.TestCase):
+	def test_single_evaluation(self):
+		calls = []
+		def f_counted():
+			calls.append(None)
+			for entry in f:
+				yield entry
+		
+		ODE = jitcode_lyap(f_counted, n_lyap=2, store_f_sym=True)
+		ODE.set_integrator("vode")
+		ODE.set_initial_value(y0,0.0)
+		ODE.integrate(1.0)
+		self.assertEqual(len(calls), 1)
+		self.assertEqual(ODE.n_basic, len(f))
+	
+	def test_wrong_n(self):
+		with self.assertRaises(ValueError):
+			jitcode(f_generator, n=3, store_f_sym=True)
+
+
+cache_dir = mkdtemp()
+
+class basic_test_with_cache(basic_test):
+	@classmethod
+	def setUpClass(self):
+		self.argdict = {"f_sym": f, "cache_dir": cache_dir}
+
+class cache_test(unittest.TestCase):
+	def setUp(self):
+		self.cache_dir = mkdtemp()
+	
+	def test_reuse(self):
+		ODE1 = jitcode(f, cache_dir=self.cache_dir)
+		ODE1.compile_C()
+		
+		ODE2 = jitcode(f_generator, n=len(f), cache_dir=self.cache_dir)
+		ODE2.compile_C()
+		self.assertFalse(ODE2._f_C_source)
+		self.assertIsNone(ODE2.jac)
+		assert_allclose( ODE2.f(0.0,y0), f_of_y0, rtol=1e-5 )
+		
+		ODE3 = jitcode(f, wants_jacobian=True, cache_dir=self.cache_dir)
+		ODE3.compile_C()
+		assert_allclose( ODE3.jac(0.0,y0), jac_of_y0, rtol=1e-5 )
+		
+		entries = [entry for entry in os.listdir(self.cache_dir) if not entry.endswith(".lock")]
+		self.assertEqual(len(entries), 2)
+	
+	def test_different_models(self):
+		ODE1 = jitcode(f, cache_dir=self.cache_dir)
+		ODE1.compile_C()
+		ODE2 = jitcode(f[::-1], cache_dir=self.cache_dir)
+		ODE2.compile_C()
+		self.assertTrue(ODE2._f_C_source)
+		assert_allclose( ODE2.f(0.0,y0), f_of_y0[::-1], rtol=1e-5 )
+	
+	def test_nonexistent_directory(self):
+		cache_dir = os.path.join(self.cache_dir, "a", "b")
+		ODE = jitcode(f[1:]+f[:1], cache_dir=cache_dir)
+		self.assertTrue(os.path.isdir(cache_dir))
+		ODE.compile_C()
+		assert_allclose( ODE.f(0.0,y0), np.roll(f_of_y0,-1), rtol=1e-5 )
+	
+	def test_generation_options(self):
+		f_rolled = f[2:]+f[:2]
+		ODE1 = jitcode(f_rolled, cache_dir=self.cache_dir)
+		ODE1.generate_f_C()
+		ODE1.compile_C()
+		
+		ODE2 = jitcode(f_rolled, cache_dir=self.cache_dir)
+		ODE2.generate_f_C(chunk_size=1)
+		ODE2.compile_C()
+		self.assertNotEqual(ODE1._modulename, ODE2._modulename)
+		assert_allclose( ODE2.f(0.0,y0), np.roll(f_of_y0,-2), rtol=1e-5 )
+		
+		ODE3 = jitcode(f_rolled, cache_dir=self.cache_dir)
+		ODE3.compile_C()
+		self.assertEqual(ODE1._modulename, ODE3._modulename)
+	
+	def tearDown(self):
+		shutil.rmtree(self.cache_dir)
+
+class build_statistics_test(unittest.TestCase):
+	def setUp(self):
+		self.records = []
+		self.handler = logging.Handler()
+		self.handler.emit = self.records.append
+		self.logger = logging.getLogger("jitcode")
+		self.logger.addHandler(self.handler)
+		self.level = self.logger.level
+		self.logger.setLevel(logging.INFO)
+	
+	def test_stages(self):
+		ODE = jitcode(f_alt, helpers=f_alt_helpers, wants_jacobian=True, verbose=False)
+		ODE.generate_f_C(chunk_size=1)
+		ODE.compile_C(n_jobs=2)
+		assert_allclose( ODE.f(0.0,y0), f_of_y0, rtol=1e-5 )
+		
+		stages = {stage["name"]:stage for stage in ODE.build_statistics.stages}
+		self.assertEqual(
+				set(stages),
+				{"generate_helpers_C", "generate_f_C", "generate_jac_sym", "generate_jac_C", "compile_C", "load"}
+			)
+		self.assertEqual( stages["generate_helpers_C"]["parent"], "generate_f_C" )
+		self.assertEqual( stages["generate_f_C"]["expressions"], len(f_alt)+len(f_alt_helpers) )
+		self.assertGreaterEqual( stages["generate_f_C"]["chunks"], len(f_alt) )
+		self.assertGreater( stages["generate_jac_C"]["differentiation_time"], 0 )
+		compiled = [ unit["file"] for unit in stages["compile_C"]["units"] ]
+		self.assertIn( ODE._modulename+".c", compiled )
+		self.assertGreater( len(compiled), 1 )
+		for stage in stages.values():
+			self.assertGreaterEqual( stage["wall_time"], 0 )
+			self.assertGreaterEqual( stage["cpu_time"], 0 )
+		for name in ["generate_helpers_C", "generate_f_C", "generate_jac_C", "compile_C"]:
+			self.assertGreater( stages[name]["code_size"], 0 )
+		
+		exported = json.loads(ODE.build_statistics.to_json())
+		self.assertEqual( exported["stages"], ODE.build_statistics.stages )
+		
+		logged = [ record.jitcode_stage for record in self.records if hasattr(record,"jitcode_stage") ]
+		self.assertEqual( sorted(logged, key=id), sorted(ODE.build_statistics.stages, key=id) )
+	
+	def tearDown(self):
+		self.logger.removeHandler(self.handler)
+		self.logger.setLevel(self.level)
+
+class instrumentation_test(unittest.TestCase):
+	def test_calls(self):
+		ODE = jitcode(f, wants_jacobian=True, verbose=False)
+		ODE.compile_C(instrument=True)
+		for _ in range(3):
+			ODE.f(0.0,y0)
+		ODE.jac(0.0,y0)
+		statistics = ODE.runtime_statistics()
+		self.assertEqual( statistics["f"]["calls"], 3 )
+		self.assertEqual( statistics["jac"]["calls"], 1 )
+		self.assertGreaterEqual( statistics["f"]["time"], 0 )
+		self.assertNotIn( "chunks", statistics )
+		
+		ODE.reset_runtime_statistics()
+		ODE.set_integrator("native_dopri5")
+		ODE.set_initial_value(y0,0.0)
+		ODE.integrate(1.0)
+		self.assertGreater( ODE.runtime_statistics()["f"]["calls"], 0 )
+		self.assertEqual( ODE.runtime_statistics()["jac"]["calls"], 0 )
+	
+	def test_chunks(self):
+		ODE = jitcode(f_alt, helpers=f_alt_helpers, wants_jacobian=True, verbose=False)
+		ODE.generate_f_C(chunk_size=1)
+		ODE.generate_jac_C(chunk_size=1)
+		ODE.compile_C(instrument="chunks", n_jobs=2)
+		assert_allclose( ODE.f(0.0,y0), f_of_y0, rtol=1e-5 )
+		assert_allclose( ODE.jac(0.0,y0), jac_of_y0, rtol=1e-5 )
+		chunks = ODE.runtime_statistics()["chunks"]
+		self.assertIn( "definitions_f", chunks )
+		self.assertIn( "definitions_jac", chunks )
+		self.assertEqual( chunks["definitions_f"]["calls"], 1 )
+		self.assertEqual( chunks["definitions_jac"]["calls"], 1 )
+	
+	def test_not_instrumented(self):
+		ODE = jitcode(f, verbose=False)
+		ODE.compile_C()
+		with self.assertRaises(RuntimeError):
+			ODE.runtime_statistics()
 
 class errors_test(unittest.TestCase):
 	def test_duplicate_error(self):
@@ -341,6 +1054,28 @@ class errors_test(unittest.TestCase):
 		with self.assertRaises(ValueError):
 			ODE = jitcode(f)
 			ODE.set_initial_value(np.array([1.,2.,3.]),0.0)
+	
+	def test_without_native_integrator(self):
+		ODE = jitcode(f)
+		ODE.compile_C(native_integrator=False)
+		self.assertFalse(hasattr(ODE._jitced, "dopri5"))
+		ODE.set_integrator("native_dopri5")
+		ODE.set_initial_value(y0,0.0)
+		with self.assertRaises(NotImplementedError):
+			ODE.integrate(1.0)
+	
+	def test_native_integrator_registered_once(self):
+		_register_integrator(native_dopri5)
+		names = [ integrator.__name__ for integrator in IntegratorBase.integrator_classes ]
+		self.assertEqual(names.count("native_dopri5"), 1)
+	
+	def test_native_integrator_with_lambdas(self):
+		ODE = jitcode(f)
+		ODE.generate_lambdas()
+		ODE.set_integrator("native_dopri5")
+		ODE.set_initial_value(y0,0.0)
+		with self.assertRaises(NotImplementedError):
+			ODE.integrate(1.0)
 
 
 unittest.main(buffer=True)
\ No newline at end of file